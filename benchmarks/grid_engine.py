@@ -0,0 +1,56 @@
+"""Benchmark of grid engine shared by PTPS, TXPS and PXPS explorers.
+
+Project files are copied to temporary directory, so stored grids are not
+modified. Original working directory is used for THERMOCALC calculations.
+
+Usage:
+
+    python benchmarks/grid_engine.py project.ptb project.txb project.pxb --nx 20 --ny 20
+
+Every project is gridded with both raster and wavefront traversal.
+
+"""
+import argparse
+import shutil
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+from pypsbuilder.psexplorer import explorers
+
+
+def bench(projfile, nx, ny, traversal):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        tmpfile = Path(tmpdir) / Path(projfile).name
+        shutil.copy(projfile, tmpfile)
+        ps = explorers[tmpfile.suffix](tmpfile, origwd=True)
+        start_time = time.time()
+        ps.calculate_composition(nx=nx, ny=ny, traversal=traversal)
+        elapsed = time.time() - start_time
+        ok = sum(len(np.flatnonzero(grid.status == 1)) for grid in ps.grids.values())
+        failed = sum(len(np.flatnonzero(grid.status == 0)) for grid in ps.grids.values())
+    return type(ps).__name__, elapsed, ps.tc_calls, ps.tc_failed, ok, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark grid engine')
+    parser.add_argument('project', type=str, nargs='+',
+                        help='builder project file(s)')
+    parser.add_argument('--nx', type=int, default=20,
+                        help='number of x steps')
+    parser.add_argument('--ny', type=int, default=20,
+                        help='number of y steps')
+    args = parser.parse_args()
+    tmpl = '{:<6} {:<30} {:<10} {:>10.1f} {:>8d} {:>8.1%} {:>8d} {:>8d}'
+    print('{:<6} {:<30} {:<10} {:>10} {:>8} {:>8} {:>8} {:>8}'.format('Type', 'Project', 'Traversal', 'Time [s]',
+                                                                   'TC runs', 'TC fail', 'OK', 'Failed'))
+    for projfile in args.project:
+        for traversal in ['raster', 'wavefront']:
+            name, elapsed, calls, tcfailed, ok, failed = bench(projfile, args.nx, args.ny, traversal)
+            print(tmpl.format(name, Path(projfile).name, traversal, elapsed, calls, tcfailed / max(calls, 1), ok, failed))
+
+
+if __name__ == '__main__':
+    main()
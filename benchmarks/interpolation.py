@@ -0,0 +1,61 @@
+"""Benchmark of interpolation methods used for isopleths.
+
+Smooth synthetic field is sampled in scattered points, similarly to grid,
+univariant lines and invariant point data of divariant field. Every method
+is fitted and evaluated on refined grid. Time and root mean square error
+against exact values are reported. No THERMOCALC is needed.
+
+Usage:
+
+    python benchmarks/interpolation.py --samples 500 2000 5000
+
+"""
+import argparse
+import time
+
+import numpy as np
+
+from pypsbuilder.psexplorer import Interpolant
+
+
+def field(x, y):
+    return np.sin(x / 80) * np.cos(3 * y) + 0.001 * x
+
+
+def bench(n, method, neighbors, seed=0):
+    rng = np.random.default_rng(seed)
+    bounds = (450, 4, 750, 14)
+    x = rng.uniform(bounds[0], bounds[2], n)
+    y = rng.uniform(bounds[1], bounds[3], n)
+    tg, pg = np.meshgrid(np.linspace(bounds[0], bounds[2], 150), np.linspace(bounds[1], bounds[3], 150))
+    ratio = (bounds[2] - bounds[0]) / (bounds[3] - bounds[1])
+    start_time = time.time()
+    interp = Interpolant(np.column_stack((x, y)), field(x, y), ratio, bounds, (6, 0.2),
+                         method=method, neighbors=neighbors)
+    fit = time.time() - start_time
+    start_time = time.time()
+    zg = interp(tg, pg)
+    evaluate = time.time() - start_time
+    rmse = np.sqrt(np.nanmean((zg - field(tg, pg))**2))
+    return interp.method, fit, evaluate, rmse
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark interpolation methods')
+    parser.add_argument('--samples', type=int, nargs='+', default=[500, 2000],
+                        help='number of samples in field')
+    parser.add_argument('--methods', nargs='+', default=['rbf', 'local', 'linear', 'cubic'],
+                        help='interpolation methods')
+    parser.add_argument('--neighbors', type=int, default=50,
+                        help='number of neighbours for local method')
+    args = parser.parse_args()
+    tmpl = '{:>8d} {:<12} {:>10.3f} {:>10.3f} {:>10.2e}'
+    print('{:>8} {:<12} {:>10} {:>10} {:>10}'.format('Samples', 'Method', 'Fit [s]', 'Eval [s]', 'RMSE'))
+    for n in args.samples:
+        for method in args.methods:
+            used, fit, evaluate, rmse = bench(n, method, args.neighbors)
+            print(tmpl.format(n, used, fit, evaluate, rmse))
+
+
+if __name__ == '__main__':
+    main()
@@ -45,7 +45,7 @@ from .ui_adduni import Ui_AddUni
 from .ui_uniguess import Ui_UniGuess
 from .psclasses import (TCAPI, InvPoint, UniLine, Dogmin, polymorphs,
                         PTsection, TXsection, PXsection,
-                        TCResult, TCResultSet)
+                        TCResult, TCResultSet, intersect_segments)
 from . import __version__
 
 # Make sure that we are using QT5
@@ -594,7 +594,7 @@ class BuildersBase(QtWidgets.QMainWindow):
                         self.changed = True
                 except ValueError:
                     pass
-
+            self.ps.reindex()
             self.refresh_gui()
         else:
             self.statusBar().showMessage('Project is not yet initialized.')
@@ -670,6 +670,9 @@ class BuildersBase(QtWidgets.QMainWindow):
                 'bulk': self.bulk,
                 'datetime': datetime.now(),
                 'version': __version__}
+        # keep last calculated grid for incremental regridding
+        if self.stale_grid is not None:
+            data['stale_grid'] = self.stale_grid
         return data
 
     @property
@@ -1125,7 +1128,7 @@ class BuildersBase(QtWidgets.QMainWindow):
                             self.uniview.scrollToBottom()
                             self.statusBar().showMessage('User-defined univariant line added.')
                         else:
-                            self.ps.unilines[id_uni] = uni
+                            self.ps.add_uni(id_uni, uni)
                             self.uni_connect(id_uni, candidates)
                             idx = self.unimodel.getIndexID(id_uni)
                             self.uniview.selectRow(idx.row())
@@ -1179,7 +1182,7 @@ class BuildersBase(QtWidgets.QMainWindow):
                                                     self.uni_connect(uni.id, candidates)
                                                     self.uniview.resizeColumnsToContents()
                                 else:
-                                    self.ps.invpoints[id_inv] = inv
+                                    self.ps.add_inv(id_inv, inv)
                                     for uni in self.ps.unilines.values():
                                         if uni.begin == id_inv or uni.end == id_inv:
                                             self.ps.trim_uni(uni.id)
@@ -1249,7 +1252,7 @@ class BuildersBase(QtWidgets.QMainWindow):
                         self.ps.invpoints[id_inv].x = inv.x
                         self.ps.invpoints[id_inv].y = inv.y
                     else:
-                        self.ps.invpoints[id_inv] = inv
+                        self.ps.add_inv(id_inv, inv)
                     for uni in self.ps.unilines.values():
                         if uni.begin == id_inv or uni.end == id_inv:
                             self.ps.trim_uni(uni.id)
@@ -1463,20 +1466,7 @@ class BuildersBase(QtWidgets.QMainWindow):
                             xl, yl = uni.get_label_point()
                             self.ax.annotate(uni.annotation(self.checkLabelUniText.isChecked()), (xl, yl), **unilabel_kw)
             for inv in self.ps.invpoints.values():
-                all_uni = inv.all_unilines()
-                isnew1, id_uni = self.ps.getiduni(UniLine(phases=all_uni[0][0], out=all_uni[0][1]))
-                if not isnew1:
-                    isnew1 = not (self.ps.unilines[id_uni].begin == inv.id or self.ps.unilines[id_uni].end == inv.id)
-                isnew2, id_uni = self.ps.getiduni(UniLine(phases=all_uni[1][0], out=all_uni[1][1]))
-                if not isnew2:
-                    isnew2 = not (self.ps.unilines[id_uni].begin == inv.id or self.ps.unilines[id_uni].end == inv.id)
-                isnew3, id_uni = self.ps.getiduni(UniLine(phases=all_uni[2][0], out=all_uni[2][1]))
-                if not isnew3:
-                    isnew3 = not (self.ps.unilines[id_uni].begin == inv.id or self.ps.unilines[id_uni].end == inv.id)
-                isnew4, id_uni = self.ps.getiduni(UniLine(phases=all_uni[3][0], out=all_uni[3][1]))
-                if not isnew4:
-                    isnew4 = not (self.ps.unilines[id_uni].begin == inv.id or self.ps.unilines[id_uni].end == inv.id)
-                unconnected = isnew1 or isnew2 or isnew3 or isnew4
+                unconnected = not self.ps.inv_connected(inv.id)
                 if self.checkLabelInv.isChecked():
                     if unconnected:
                         self.ax.annotate(inv.annotation(self.checkLabelInvText.isChecked()), (inv.x, inv.y), **invlabel_unc_kw)
@@ -1561,6 +1551,7 @@ class PTBuilder(BuildersBase, Ui_PTBuilder):
         self.builder_name = 'PTBuilder'
         self.builder_extension = '.ptb'
         self.ps = PTsection()
+        self.stale_grid = None
         super(PTBuilder, self).__init__(parent)
 
     def builder_ui_settings(self):
@@ -1654,6 +1645,7 @@ class PTBuilder(BuildersBase, Ui_PTBuilder):
                 self.ps = PTsection(trange=self.tc.trange,
                                     prange=self.tc.prange,
                                     excess=self.tc.excess)
+                self.stale_grid = None
                 self.bulk = self.tc.bulk
                 self.ready = True
                 self.initViewModels()
@@ -1712,6 +1704,7 @@ class PTBuilder(BuildersBase, Ui_PTBuilder):
                     self.ps = PTsection(trange=data['section'].xrange,
                                         prange=data['section'].yrange,
                                         excess=data['section'].excess)
+                    self.stale_grid = data.get('grid', data.get('stale_grid', None))
                     self.initViewModels()
                     # select phases
                     for i in range(self.phasemodel.rowCount()):
@@ -1806,6 +1799,7 @@ class PTBuilder(BuildersBase, Ui_PTBuilder):
                     self.ps = PTsection(trange=data['trange'],
                                         prange=data['prange'],
                                         excess=self.tc.excess)
+                    self.stale_grid = None
                     self.initViewModels()
                     # select phases
                     for i in range(self.phasemodel.rowCount()):
@@ -2123,7 +2117,7 @@ class PTBuilder(BuildersBase, Ui_PTBuilder):
                             else:
                                 uni.begin = self.ps.unilines[id_uni].begin
                                 uni.end = self.ps.unilines[id_uni].end
-                                self.ps.unilines[id_uni] = uni
+                                self.ps.add_uni(id_uni, uni)
                                 self.ps.trim_uni(id_uni)
                                 if self.checkAutoconnectUni.isChecked():
                                     if len(candidates) == 2:
@@ -2173,7 +2167,7 @@ class PTBuilder(BuildersBase, Ui_PTBuilder):
                         self.statusBar().showMessage('New invariant point calculated.')
                     else:
                         if not self.checkOverwrite.isChecked():
-                            self.ps.invpoints[id_inv] = inv
+                            self.ps.add_inv(id_inv, inv)
                             for uni in self.ps.unilines.values():
                                 if uni.begin == id_inv or uni.end == id_inv:
                                     self.ps.trim_uni(uni.id)
@@ -2202,6 +2196,7 @@ class TXBuilder(BuildersBase, Ui_TXBuilder):
         self.builder_name = 'TXBuilder'
         self.builder_extension = '.txb'
         self.ps = TXsection()
+        self.stale_grid = None
         super(TXBuilder, self).__init__(parent)
 
     def builder_ui_settings(self):
@@ -2290,6 +2285,7 @@ class TXBuilder(BuildersBase, Ui_TXBuilder):
                 self.tc = tc
                 self.ps = TXsection(trange=self.tc.trange,
                                     excess=self.tc.excess)
+                self.stale_grid = None
                 self.bulk = self.tc.bulk
                 self.ready = True
                 self.initViewModels()
@@ -2346,6 +2342,7 @@ class TXBuilder(BuildersBase, Ui_TXBuilder):
                     self.tc = tc
                     self.ps = TXsection(trange=data['section'].xrange,
                                         excess=data['section'].excess)
+                    self.stale_grid = data.get('grid', data.get('stale_grid', None))
                     self.initViewModels()
                     # select phases
                     for i in range(self.phasemodel.rowCount()):
@@ -2751,7 +2748,7 @@ class TXBuilder(BuildersBase, Ui_TXBuilder):
                             else:
                                 uni.begin = self.ps.unilines[id_uni].begin
                                 uni.end = self.ps.unilines[id_uni].end
-                                self.ps.unilines[id_uni] = uni
+                                self.ps.add_uni(id_uni, uni)
                                 self.ps.trim_uni(id_uni)
                                 if self.checkAutoconnectUni.isChecked():
                                     if len(candidates) == 2:
@@ -2814,7 +2811,7 @@ class TXBuilder(BuildersBase, Ui_TXBuilder):
                             self.statusBar().showMessage('New invariant point calculated.')
                         else:
                             if not self.checkOverwrite.isChecked():
-                                self.ps.invpoints[id_inv] = inv
+                                self.ps.add_inv(id_inv, inv)
                                 for uni in self.ps.unilines.values():
                                     if uni.begin == id_inv or uni.end == id_inv:
                                         self.ps.trim_uni(uni.id)
@@ -2844,6 +2841,7 @@ class PXBuilder(BuildersBase, Ui_PXBuilder):
         self.builder_name = 'PXBuilder'
         self.builder_extension = '.pxb'
         self.ps = PXsection()
+        self.stale_grid = None
         super(PXBuilder, self).__init__(parent)
 
     def builder_ui_settings(self):
@@ -2932,6 +2930,7 @@ class PXBuilder(BuildersBase, Ui_PXBuilder):
                 self.tc = tc
                 self.ps = PXsection(prange=self.tc.prange,
                                     excess=self.tc.excess)
+                self.stale_grid = None
                 self.bulk = self.tc.bulk
                 self.ready = True
                 self.initViewModels()
@@ -2988,6 +2987,7 @@ class PXBuilder(BuildersBase, Ui_PXBuilder):
                     self.tc = tc
                     self.ps = PXsection(prange=data['section'].yrange,
                                         excess=data['section'].excess)
+                    self.stale_grid = data.get('grid', data.get('stale_grid', None))
                     self.initViewModels()
                     # select phases
                     for i in range(self.phasemodel.rowCount()):
@@ -3394,7 +3394,7 @@ class PXBuilder(BuildersBase, Ui_PXBuilder):
                             else:
                                 uni.begin = self.ps.unilines[id_uni].begin
                                 uni.end = self.ps.unilines[id_uni].end
-                                self.ps.unilines[id_uni] = uni
+                                self.ps.add_uni(id_uni, uni)
                                 self.ps.trim_uni(id_uni)
                                 if self.checkAutoconnectUni.isChecked():
                                     if len(candidates) == 2:
@@ -3457,7 +3457,7 @@ class PXBuilder(BuildersBase, Ui_PXBuilder):
                             self.statusBar().showMessage('New invariant point calculated.')
                         else:
                             if not self.checkOverwrite.isChecked():
-                                self.ps.invpoints[id_inv] = inv
+                                self.ps.add_inv(id_inv, inv)
                                 for uni in self.ps.unilines.values():
                                     if uni.begin == id_inv or uni.end == id_inv:
                                         self.ps.trim_uni(uni.id)
@@ -3534,7 +3534,7 @@ class InvModel(QtCore.QAbstractTableModel):
         self.beginRemoveRows(QtCore.QModelIndex(), index.row(), index.row())
         id = self.invlist[index.row()]
         del self.invlist[index.row()]
-        del self.ps.invpoints[id]
+        self.ps.remove_inv(id)
         self.endRemoveRows()
 
     def headerData(self, col, orientation, role=QtCore.Qt.DisplayRole):
@@ -3616,7 +3616,7 @@ class UniModel(QtCore.QAbstractTableModel):
         self.beginRemoveRows(QtCore.QModelIndex(), index.row(), index.row())
         id = self.unilist[index.row()]
         del self.unilist[index.row()]
-        del self.ps.unilines[id]
+        self.ps.remove_uni(id)
         self.endRemoveRows()
 
     def headerData(self, col, orientation, role=QtCore.Qt.DisplayRole):
@@ -3993,29 +3993,11 @@ def intersection(uni1, uni2, ratio=1, extra=0.2, N=100):
     x2, y2 = s2x(p), s2y(p)
 
     ii, jj = _rectangle_intersection_(x1, y1, x2, y2)
-    n = len(ii)
-
-    dxy1 = np.diff(np.c_[x1, y1], axis=0)
-    dxy2 = np.diff(np.c_[x2, y2], axis=0)
-
-    T = np.zeros((4, n))
-    AA = np.zeros((4, 4, n))
-    AA[0:2, 2, :] = -1
-    AA[2:4, 3, :] = -1
-    AA[0::2, 0, :] = dxy1[ii, :].T
-    AA[1::2, 1, :] = dxy2[jj, :].T
 
-    BB = np.zeros((4, n))
-    BB[0, :] = -x1[ii].ravel()
-    BB[1, :] = -x2[jj].ravel()
-    BB[2, :] = -y1[ii].ravel()
-    BB[3, :] = -y2[jj].ravel()
-
-    for i in range(n):
-        try:
-            T[:, i] = np.linalg.solve(AA[:, :, i], BB[:, i])
-        except Exception:
-            T[:, i] = np.NaN
+    xy1 = np.c_[x1, y1]
+    xy2 = np.c_[x2, y2]
+    T = intersect_segments(np.stack((xy1[ii], xy1[ii + 1]), axis=1),
+                           np.stack((xy2[jj], xy2[jj + 1]), axis=1)).T
 
     in_range = (T[0, :] >= 0) & (T[1, :] >= 0) & (T[0, :] <= 1) & (T[1, :] <= 1)
 
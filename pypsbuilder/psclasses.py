@@ -17,7 +17,10 @@ try:
 except ImportError:
     import pickle
 import gzip
+import shutil
 import subprocess
+import threading
+import warnings
 # import itertools
 # import re
 from pathlib import Path
@@ -27,6 +30,7 @@ import numpy as np
 import matplotlib.pyplot as plt
 from shapely.geometry import LineString, Point
 from shapely.ops import polygonize, linemerge   # unary_union
+from shapely.strtree import STRtree
 
 popen_kw = dict(stdout=subprocess.PIPE, stdin=subprocess.PIPE,
                 stderr=subprocess.STDOUT, universal_newlines=False)
@@ -35,6 +39,40 @@ polymorphs = [{'sill', 'and'}, {'ky', 'and'}, {'sill', 'ky'}, {'q', 'coe'}, {'di
 """list: List of two-element sets containing polymorphs."""
 
 
+def intersect_segments(xy1, xy2):
+    """Batched intersections of pairs of segments.
+
+    For each pair, the 4x4 system for line parameters and coordinates of
+    intersection is solved. All systems are solved at once.
+
+    Args:
+        xy1 (numpy.array): Array of shape (n, 2, 2) with start and end points
+            of first segments.
+        xy2 (numpy.array): Array of shape (n, 2, 2) with start and end points
+            of second segments.
+
+    Returns:
+        numpy.array: Array of shape (n, 4) with parameters along first and
+        second segment and x, y coordinates of intersection. NaN for
+        parallel segments.
+    """
+    xy1, xy2 = np.asarray(xy1, dtype=float), np.asarray(xy2, dtype=float)
+    d1 = xy1[:, 1] - xy1[:, 0]
+    d2 = xy2[:, 1] - xy2[:, 0]
+    n = len(d1)
+    AA = np.zeros((n, 4, 4))
+    AA[:, 0:2, 2] = -1
+    AA[:, 2:4, 3] = -1
+    AA[:, 0::2, 0] = d1
+    AA[:, 1::2, 1] = d2
+    BB = -np.array([xy1[:, 0, 0], xy2[:, 0, 0], xy1[:, 0, 1], xy2[:, 0, 1]]).T
+    T = np.full((n, 4), np.nan)
+    ok = d1[:, 0] * d2[:, 1] - d1[:, 1] * d2[:, 0] != 0
+    if np.any(ok):
+        T[ok] = np.linalg.solve(AA[ok], BB[ok][:, :, np.newaxis])[:, :, 0]
+    return T
+
+
 class InitError(Exception):
     pass
 
@@ -66,6 +104,8 @@ class TCAPI(object):
         phases (list): List of names of available phases.
         TCenc (str): Encoding used for THERMOCALC output text files.
             Default 'mac-roman'.
+        cancelled (bool): True when calculation was cancelled by `terminate`.
+            New THERMOCALC sessions are not started until it is reset to False.
 
     Raises:
         InitError: An error occurred during initialization of working dir.
@@ -76,6 +116,9 @@ class TCAPI(object):
     def __init__(self, workdir, tcexe=None, drexe=None):
         self.workdir = Path(workdir).resolve()
         self.TCenc = 'mac-roman'
+        self.cancelled = False
+        self._process = None
+        self._lock = threading.Lock()
         try:
             errinfo = 'Initialize project error!'
             self.tcexe = None
@@ -858,7 +901,8 @@ class TCAPI(object):
             instr (str): String to be passed to standard input for session.
 
         Returns:
-            str: THERMOCALC standard output
+            str: THERMOCALC standard output. Empty when session was cancelled
+            by `terminate` before it started.
         """
         if sys.platform.startswith('win'):
             startupinfo = subprocess.STARTUPINFO()
@@ -866,13 +910,44 @@ class TCAPI(object):
             startupinfo.wShowWindow = 0
         else:
             startupinfo = None
-        p = subprocess.Popen(str(self.tcexe), cwd=str(self.workdir), startupinfo=startupinfo, **popen_kw)
+        with self._lock:
+            if self.cancelled:
+                return ''
+            p = subprocess.Popen(str(self.tcexe), cwd=str(self.workdir), startupinfo=startupinfo, **popen_kw)
+            self._process = p
         output, err = p.communicate(input=instr.encode(self.TCenc))
+        self._process = None
         if err is not None:
             print(err.decode('utf-8'))
         sys.stdout.flush()
         return output.decode(self.TCenc)
 
+    def terminate(self):
+        """Kill running THERMOCALC session, if any, and set `cancelled` flag,
+        so not yet started session is not run. Could be called from other
+        thread to cancel calculation."""
+        with self._lock:
+            self.cancelled = True
+            p = self._process
+            if p is not None and p.poll() is None:
+                p.kill()
+
+    def clone(self, workdir):
+        """Copy files of working directory to other directory.
+
+        Args:
+            workdir (str, Path): Target directory. Created when not exists.
+
+        Returns:
+            TCAPI: THERMOCALC API of isolated copy of working directory.
+        """
+        workdir = Path(workdir)
+        workdir.mkdir(parents=True, exist_ok=True)
+        for p in self.workdir.iterdir():
+            if p.is_file():
+                shutil.copy2(str(p), str(workdir / p.name))
+        return TCAPI(workdir, tcexe=self.tcexe, drexe=self.drexe)
+
     def rundr(self):
         """Method to run drawpd."""
         if self.drexe:
@@ -1381,6 +1456,19 @@ class SectionBase:
         self.invpoints = {}
         self.unilines = {}
         self.dogmins = {}
+        self.reindex()
+
+    def __getstate__(self):
+        # lookup tables are not stored in project files
+        state = self.__dict__.copy()
+        for attr in ('_inv_index', '_uni_index', '_inv_maxid', '_uni_maxid',
+                     '_inv_expects', '_connectivity'):
+            state.pop(attr, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.reindex()
 
     def __repr__(self):
         return '\n'.join(['{}'.format(type(self).__name__),
@@ -1406,6 +1494,115 @@ class SectionBase:
                           (self.xrange[0], self.yrange[0])])]
         return bnd, next(polygonize(bnd))
 
+    @staticmethod
+    def _inv_keys(inv):
+        """Return lookup keys of invariant point including polymorphs identities."""
+        keys = [(frozenset(inv.phases), frozenset(inv.out))]
+        for poly in polymorphs:
+            if poly.issubset(inv.phases):
+                switched = inv.out.difference(poly).union(poly.difference(inv.out))
+                if switched:
+                    keys.append((frozenset(inv.phases), frozenset(switched)))
+        return keys
+
+    @staticmethod
+    def _uni_keys(uni):
+        """Return lookup keys of univariant line including polymorphs identities."""
+        keys = [(frozenset(uni.phases), frozenset(uni.out))]
+        for poly in polymorphs:
+            if poly.issubset(uni.phases) and not poly.isdisjoint(uni.out):
+                keys.append((frozenset(uni.phases), frozenset(poly.difference(uni.out))))
+        return keys
+
+    @staticmethod
+    def _index_add(index, keys, id):
+        for key in keys:
+            ids = index.setdefault(key, [])
+            if id not in ids:
+                ids.append(id)
+
+    @staticmethod
+    def _index_remove(index, keys, id):
+        for key in keys:
+            ids = index.get(key, [])
+            if id in ids:
+                ids.remove(id)
+                if not ids:
+                    del index[key]
+
+    def reindex(self):
+        """Rebuild lookup tables of invariant points and univariant lines.
+
+        Needed only when phases or zero mode phases of stored invariant points
+        or univariant lines are changed in place.
+        """
+        self._inv_index = {}
+        self._uni_index = {}
+        for id, inv in self.invpoints.items():
+            self._index_add(self._inv_index, self._inv_keys(inv), id)
+        for id, uni in self.unilines.items():
+            self._index_add(self._uni_index, self._uni_keys(uni), id)
+        self._inv_maxid = max(self.invpoints, default=0)
+        self._uni_maxid = max(self.unilines, default=0)
+        # invariant points connectivity
+        self._inv_expects = {}
+        self._connectivity = {}
+        for id, inv in self.invpoints.items():
+            self._expect_add(id, inv)
+
+    def _expect_add(self, id, inv):
+        """Register four univariant lines expected to pass trough invariant point."""
+        self._connectivity[id] = {}
+        for phases, out in inv.all_unilines():
+            key = (frozenset(phases), frozenset(out))
+            self._inv_expects.setdefault(key, set()).add(id)
+            self._connectivity[id][key] = None
+        self._update_connectivity(id)
+
+    def _expect_remove(self, id):
+        for key in self._connectivity.pop(id, {}):
+            ids = self._inv_expects.get(key, set())
+            ids.discard(id)
+            if not ids:
+                del self._inv_expects[key]
+
+    def _update_connectivity(self, id):
+        """Update ids of univariant lines connected to invariant point."""
+        conn = self._connectivity[id]
+        for key in conn:
+            conn[key] = None
+            ids = self._uni_index.get(key)
+            if ids:
+                uni = self.unilines[ids[0]]
+                if uni.begin == id or uni.end == id:
+                    conn[key] = ids[0]
+
+    def _uni_changed(self, uni):
+        """Update connectivity of invariant points expecting univariant line."""
+        affected = set()
+        for key in self._uni_keys(uni):
+            affected.update(self._inv_expects.get(key, set()))
+        for id in affected:
+            self._update_connectivity(id)
+
+    def inv_connections(self, id):
+        """Return connectivity of invariant point.
+
+        Args:
+            id (int): id of invariant point
+
+        Returns:
+            dict: keys of four expected univariant lines (frozenset of phases,
+            frozenset of zero mode phases) and id of connected univariant line
+            or None when missing.
+        """
+        return dict(self._connectivity[id])
+
+    def inv_connected(self, id):
+        """Return True when all four expected univariant lines are connected
+        to invariant point."""
+        return None not in self._connectivity[id].values()
+
     def add_inv(self, id, inv):
         if inv.manual:
             inv.results = None
@@ -1414,8 +1611,14 @@ class SectionBase:
                 inv.results = TCResultSet([TCResult(float(x), float(y), variance=inv.variance,
                                                     data=r['data'], ptguess=r['ptguess'])
                                            for r, x, y in zip(inv.results, inv.x, inv.y)])
+        if id in self.invpoints:
+            self._index_remove(self._inv_index, self._inv_keys(self.invpoints[id]), id)
+            self._expect_remove(id)
         self.invpoints[id] = inv
         self.invpoints[id].id = id
+        self._index_add(self._inv_index, self._inv_keys(inv), id)
+        self._inv_maxid = max(self._inv_maxid, id)
+        self._expect_add(id, inv)
 
     def add_uni(self, id, uni):
         if uni.manual:
@@ -1425,15 +1628,36 @@ class SectionBase:
                 uni.results = TCResultSet([TCResult(float(x), float(y), variance=uni.variance,
                                                     data=r['data'], ptguess=r['ptguess'])
                                            for r, x, y in zip(uni.results, uni._x, uni._y)])
+        if id in self.unilines:
+            old = self.unilines[id]
+            self._index_remove(self._uni_index, self._uni_keys(old), id)
+            self._uni_changed(old)
         self.unilines[id] = uni
         self.unilines[id].id = id
+        self._index_add(self._uni_index, self._uni_keys(uni), id)
+        self._uni_maxid = max(self._uni_maxid, id)
+        self._uni_changed(uni)
+
+    def remove_inv(self, id):
+        inv = self.invpoints.pop(id)
+        self._index_remove(self._inv_index, self._inv_keys(inv), id)
+        self._expect_remove(id)
+        if id == self._inv_maxid:
+            self._inv_maxid = max(self.invpoints, default=0)
+
+    def remove_uni(self, id):
+        uni = self.unilines.pop(id)
+        self._index_remove(self._uni_index, self._uni_keys(uni), id)
+        self._uni_changed(uni)
+        if id == self._uni_maxid:
+            self._uni_maxid = max(self.unilines, default=0)
 
     def add_dogmin(self, id, dgm):
         self.dogmins[id] = dgm
         self.dogmins[id].id = id
 
     def cleanup_data(self):
-        for id_uni, uni in self.unilines.items():
+        for uni in self.unilines.values():
             if not uni.manual:
                 keep = slice(max(uni.used.start - 1, 0), min(uni.used.stop + 1, len(uni._x)))
                 uni._x = uni._x[keep]
@@ -1449,75 +1673,94 @@ class SectionBase:
                 uni.used = slice(0, 0)
                 uni.x = np.array([])
                 uni.y = np.array([])
-            self.trim_uni(id_uni)
+        self.trim_all()
 
     def getidinv(self, inv=None):
         '''Return id of either new or existing invariant point'''
-        ids = 0
-        # collect polymorphs identities
         if inv is not None:
-            outs = [inv.out]
-            for poly in polymorphs:
-                if poly.issubset(inv.phases):
-                    switched = inv.out.difference(poly).union(poly.difference(inv.out))
-                    if switched:
-                        outs.append(switched)
-
-        for iid, cinv in self.invpoints.items():
-            if inv is not None:
-                if cinv.phases == inv.phases:
-                    if cinv.out in outs:
-                        inv.out = cinv.out  # switch to already used ??? Needed ???
-                        return False, iid
-            ids = max(ids, iid)
-        return True, ids + 1
+            ids = self._inv_index.get((frozenset(inv.phases), frozenset(inv.out)))
+            if ids:
+                inv.out = self.invpoints[ids[0]].out  # switch to already used ??? Needed ???
+                return False, ids[0]
+        return True, self._inv_maxid + 1
 
     def getiduni(self, uni=None):
         '''Return id of either new or existing univariant line'''
-        ids = 0
-        # collect polymorphs identities
         if uni is not None:
-            outs = [uni.out]
-            for poly in polymorphs:
-                if poly.issubset(uni.phases):
-                    outs.append(poly.difference(uni.out))
-
-        for uid, cuni in self.unilines.items():
-            if uni is not None:
-                if cuni.phases == uni.phases:
-                    if cuni.out in outs:
-                        uni.out = cuni.out  # switch to already used ??? Needed ???
-                        return False, uid
-            ids = max(ids, uid)
-        return True, ids + 1
-
-    def trim_uni(self, id):
-        uni = self.unilines[id]
+            ids = self._uni_index.get((frozenset(uni.phases), frozenset(uni.out)))
+            if ids:
+                uni.out = self.unilines[ids[0]].out  # switch to already used ??? Needed ???
+                return False, ids[0]
+        return True, self._uni_maxid + 1
+
+    def _trim_points(self, uni):
+        """Return scaled coordinates of begin and end of univariant line."""
         if uni.begin > 0:
-            p1 = Point(self.invpoints[uni.begin].x,
-                       self.ratio * self.invpoints[uni.begin].y)
+            p1 = (self.invpoints[uni.begin]._x, self.ratio * self.invpoints[uni.begin]._y)
         else:
-            p1 = Point(uni._x[0], self.ratio * uni._y[0])
+            p1 = (uni._x[0], self.ratio * uni._y[0])
         if uni.end > 0:
-            p2 = Point(self.invpoints[uni.end].x,
-                       self.ratio * self.invpoints[uni.end].y)
+            p2 = (self.invpoints[uni.end]._x, self.ratio * self.invpoints[uni.end]._y)
         else:
-            p2 = Point(uni._x[-1], self.ratio * uni._y[-1])
-        if not uni.manual:
-            xy = np.array([uni._x, self.ratio * uni._y]).T
-            line = LineString(xy)
+            p2 = (uni._x[-1], self.ratio * uni._y[-1])
+        return p1, p2
+
+    def _trim_slices(self, unis):
+        """Calculate used slices for calculated univariant lines.
+
+        Vertex distances along the lines are cumulative segment lengths and
+        begin and end points are projected on all segments at once. Lines with
+        single vertex have no segments and are used whole.
+
+        Args:
+            unis (list): list of calculated (not manual) UniLine instances
+
+        Returns:
+            list: list of slices indicating used points for each uniline
+        """
+        slices = [slice(0, len(uni._x)) for uni in unis]
+        lines = [ix for ix, uni in enumerate(unis) if len(uni._x) > 1]
+        if not lines:
+            return slices
+        unis = [unis[ix] for ix in lines]
+        xy = [np.array([uni._x, self.ratio * uni._y]).T for uni in unis]
+        nseg = np.array([len(v) - 1 for v in xy])
+        owner = np.repeat(np.arange(len(unis)), nseg)
+        a = np.vstack([v[:-1] for v in xy])
+        d = np.vstack([np.diff(v, axis=0) for v in xy])
+        seglen2 = np.sum(d**2, axis=1)
+        seglen = np.sqrt(seglen2)
+        # cumulative distance of segment origins restarted for each line
+        first = np.cumsum(nseg) - nseg
+        cs = np.hstack([np.append(0, np.cumsum(sl[:-1])) for sl in np.split(seglen, first[1:])])
+        pts = np.array([self._trim_points(uni) for uni in unis])
+        dst = []
+        for p in (pts[:, 0][owner], pts[:, 1][owner]):
+            ap = p - a
+            t = np.divide(np.sum(ap * d, axis=1), seglen2,
+                          out=np.zeros_like(seglen2), where=seglen2 > 0)
+            t = np.clip(t, 0, 1)
+            dist2 = np.sum((ap - t[:, np.newaxis] * d)**2, axis=1)
+            # first closest segment for each line
+            order = np.lexsort((dist2, owner))
+            _, closest = np.unique(owner[order], return_index=True)
+            sel = order[closest]
+            dst.append(cs[sel] + t[sel] * seglen[sel])
+        last = first + nseg - 1
+        for ix, uni in enumerate(unis):
             # vertex distances
-            vdst = np.array([line.project(Point(*v)) for v in xy])
-            d1 = line.project(p1)
-            d2 = line.project(p2)
+            vdst = np.append(cs[first[ix]:last[ix] + 1], cs[last[ix]] + seglen[last[ix]])
+            d1, d2 = dst[0][ix], dst[1][ix]
             # switch if needed
             if d1 > d2:
                 d1, d2 = d2, d1
                 uni.begin, uni.end = uni.end, uni.begin
-            # get slice of points to keep
-            uni.used = slice(np.flatnonzero(vdst >= d1)[0].item(),
-                             np.flatnonzero(vdst <= d2)[-1].item() + 1)
+            slices[lines[ix]] = slice(np.searchsorted(vdst, d1, side='left').item(),
+                                      np.searchsorted(vdst, d2, side='right').item())
+        return slices
 
+    def _store_trimmed(self, uni):
+        """Store trimmed coordinates of univariant line."""
         # concatenate begin, keep, end
         if uni.begin > 0:
             x1, y1 = self.invpoints[uni.begin].x, self.invpoints[uni.begin].y
@@ -1537,6 +1780,94 @@ class SectionBase:
         uni.x = np.hstack((x1, xx, x2))
         uni.y = np.hstack((y1, yy, y2))
 
+    def trim_uni(self, id):
+        """Trim univariant line to begin and end invariant points.
+
+        Args:
+            id (int): id of univariant line
+        """
+        uni = self.unilines[id]
+        if not uni.manual:
+            uni.used = self._trim_slices([uni])[0]
+        self._store_trimmed(uni)
+        self._uni_changed(uni)
+
+    def trim_all(self):
+        """Trim all univariant lines in single vectorised sweep."""
+        unis = [uni for uni in self.unilines.values() if not uni.manual]
+        if unis:
+            for uni, used in zip(unis, self._trim_slices(unis)):
+                uni.used = used
+        for uni in self.unilines.values():
+            self._store_trimmed(uni)
+        for id in self._connectivity:
+            self._update_connectivity(id)
+
+    def find_intersections(self):
+        """Find crossings of univariant lines which could define invariant point.
+
+        All segments of calculated univariant lines are indexed with STRtree and
+        every crossing of two lines, which could share invariant point according
+        to `UniLine.contains_inv`, is reported. Coordinates are scaled by
+        section ratio.
+
+        Returns:
+            list: List of dicts with keys 'phases' and 'out' of invariant point,
+            'x' and 'y' coordinates of crossing, 'unilines' tuple of ids of
+            crossing lines, 'ptguess' from nearest calculated point and 'id'
+            of already existing invariant point or None.
+        """
+        unis = [uni for uni in self.unilines.values() if not uni.manual and len(uni._x) > 1]
+        if len(unis) < 2:
+            return []
+        xy = [np.array([uni._x, self.ratio * uni._y]).T for uni in unis]
+        owner = np.hstack([np.full(len(v) - 1, ix) for ix, v in enumerate(xy)])
+        vix = np.hstack([np.arange(len(v) - 1) for v in xy])
+        segs = np.vstack([np.stack((v[:-1], v[1:]), axis=1) for v in xy])
+        geoms = [LineString(seg) for seg in segs]
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            tree = STRtree(geoms)
+        if hasattr(tree, 'query_items'):
+            ii, jj = [], []
+            for i, geom in enumerate(geoms):
+                for j in tree.query_items(geom):
+                    ii.append(i)
+                    jj.append(j)
+            ii, jj = np.array(ii, dtype=int), np.array(jj, dtype=int)
+        else:
+            ii, jj = tree.query(geoms)
+        # only pairs of distinct lines and each pair once
+        keep = owner[ii] < owner[jj]
+        ii, jj = ii[keep], jj[keep]
+        # only lines which could share invariant point
+        shared = {}
+        for pair in set(zip(owner[ii], owner[jj])):
+            u1, u2 = unis[pair[0]], unis[pair[1]]
+            out = u1.out.union(u2.out)
+            if len(out) == 2:
+                inv = InvPoint(phases=u1.phases.union(u2.phases), out=out)
+                if u1.contains_inv(inv) and u2.contains_inv(inv):
+                    shared[pair] = inv
+        keep = np.array([(o1, o2) in shared for o1, o2 in zip(owner[ii], owner[jj])], dtype=bool)
+        ii, jj = ii[keep], jj[keep]
+        if len(ii) == 0:
+            return []
+        T = intersect_segments(segs[ii], segs[jj])
+        with np.errstate(invalid='ignore'):
+            crossing = (T[:, 0] >= 0) & (T[:, 0] <= 1) & (T[:, 1] >= 0) & (T[:, 1] <= 1)
+        candidates = []
+        for i, j, (t1, t2, x, y) in zip(ii[crossing], jj[crossing], T[crossing]):
+            inv = shared[(owner[i], owner[j])]
+            uni = unis[owner[i]]
+            isnew, id_inv = self.getidinv(InvPoint(phases=inv.phases, out=inv.out))
+            candidates.append(dict(phases=inv.phases, out=inv.out,
+                                   x=x, y=y / self.ratio,
+                                   unilines=(uni.id, unis[owner[j]].id),
+                                   ptguess=uni.ptguess(idx=int(vix[i] + round(t1))),
+                                   id=None if isnew else id_inv))
+        return candidates
+
     def create_shapes(self, tolerance=None):
         def splitme(seg):
             '''Recursive boundary splitter'''
@@ -7,8 +7,8 @@ It provides a tools to visualize pseudosections constructed with
 builders, calculate compositional variations within multivariant fields, and
 plot compositional isopleths.
 
-It provides four command line scipts `psgrid`, `psdrawpd`, `psshow` and `psiso`,
-or could be used interactively, e.g. within jupyter notebooks.
+It provides five command line scripts `psgrid`, `psdrawpd`, `psshow`, `psiso`
+and `psquery`, or could be used interactively, e.g. within jupyter notebooks.
 
 Example:
 
@@ -28,11 +28,19 @@ try:
 except ImportError:
     import pickle
 import gzip
+import itertools
 import ast
+import functools
+import hashlib
+import json
 import time
+import tempfile
+import threading
 import re
 from pathlib import Path
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from contextlib import ExitStack, redirect_stdout
 import warnings
 
 import numpy as np
@@ -43,12 +51,27 @@ from matplotlib.colorbar import ColorbarBase
 from mpl_toolkits.axes_grid1 import make_axes_locatable
 from matplotlib import ticker
 
-from shapely.geometry import MultiPoint, Point
-from shapely.ops import linemerge
+from shapely.geometry import MultiPoint, Point, MultiLineString, mapping
+from shapely.ops import linemerge, unary_union
+from shapely.prepared import prep
+try:
+    from shapely.vectorized import contains as contains_xy
+except ImportError:
+    from shapely import contains_xy
 from descartes import PolygonPatch
 from scipy.interpolate import Rbf, interp1d
 from scipy.linalg import LinAlgWarning
 from scipy.interpolate import griddata  # interp2d
+from scipy.interpolate import LinearNDInterpolator, CloughTocher2DInterpolator, NearestNDInterpolator
+try:
+    from scipy.interpolate import RBFInterpolator
+except ImportError:
+    RBFInterpolator = None
+try:
+    from contourpy import contour_generator
+except ImportError:
+    contour_generator = None
+from scipy.spatial import cKDTree
 from tqdm import tqdm, trange
 
 from .psclasses import TCAPI
@@ -59,6 +82,9 @@ from .psclasses import polymorphs
 class PS:
     """Base class for PTPS, TXPS and PXPS classes
     """
+    # guards THERMOCALC runs counters updated from worker threads
+    _tc_lock = threading.Lock()
+
     def __init__(self, *args, **kwargs):
         """Create PTPS class instance from builder project file.
 
@@ -67,6 +93,8 @@ class PS:
             tolerance (float): if not None, simplification tolerance. Default None
             origwd (bool): If True TCAPI uses original stored working directory
                 Default False.
+            cachesize (int): Maximum number of cached interpolants and isolines.
+                Default 128
         """
         projfiles = [Path(projfile).resolve() for projfile in args if Path(projfile).exists()]
         assert len(projfiles) > 0, 'You have to provide existing filename.'
@@ -78,9 +106,16 @@ class PS:
         self.projfiles = {}
         self.sections = {}
         self.grids = {}
+        self.stale_grids = {}
+        self.pointstores = {}
         self._shapes = {}
         self.unilists = {}
+        self.seeds = {}
         self._variance = {}
+        self.tc_calls, self.tc_failed = 0, 0
+        self._checkpoint = None
+        self.interpolants = FieldCache(maxsize=kwargs.get('cachesize', 128))
+        self.isolines = FieldCache(maxsize=kwargs.get('cachesize', 128))
         # common
         self.tolerance = tolerance
         self.tc = None
@@ -114,6 +149,7 @@ class PS:
             self._shapes[ix], self.unilists[ix], log = self.sections[ix].create_shapes(tolerance=self.tolerance)
             if log:
                 print('\n'.join(log))
+            self.seeds[ix] = SeedIndex(self.sections[ix], self.unilists[ix])
             # process variances
             if 'variance' in data:
                 self._variance[ix] = data['variance']
@@ -153,14 +189,16 @@ class PS:
             # already gridded?
             if 'grid' in data:
                 self.grids[ix] = data['grid']
-        # union _shapes
-        self.shapes = {}
-        for shapes in self._shapes.values():
-            for key, shape in shapes.items():
-                if key in self.shapes:
-                    self.shapes[key] = self.shapes[key].union(shape)
-                else:
-                    self.shapes[key] = shape
+            elif 'stale_grid' in data:
+                self.stale_grids[ix] = data['stale_grid']
+            if 'points' in data:
+                self.pointstores[ix] = data['points']
+        # union _shapes and build field index
+        self.union_shapes()
+        self.build_sample_index()
+        # persisted interpolants
+        if self.interpolants_file.exists():
+            self.interpolants.load(self.interpolants_file)
         # update variable lookup table
         self.collect_all_data_keys()
 
@@ -224,6 +262,12 @@ class PS:
         """True when compositional grid(s) is calculated, otherwise False"""
         return all([i in self.grids for i in range(len(self.sections))])
 
+    @property
+    def has_results(self):
+        """True when compositional grid(s) or adaptive point stores are
+        calculated, otherwise False"""
+        return self.gridded or bool(self.pointstores)
+
     @property
     def phases(self):
         """Returns set of all phases present in pseudosection"""
@@ -267,21 +311,93 @@ class PS:
                     print('Available end-members for {}: {}'.format(phase, ' '.join(self.endmembers[phase])))
                 return False
             else:
+                try:
+                    unknown = compile_expr(expr).unknown(phase, self.all_data_keys)
+                except (SyntaxError, TypeError) as e:
+                    print('Invalid expression {}: {}'.format(expr, e))
+                    return False
+                if unknown:
+                    msg = 'Unknown variables {}. Available variables for phase {} are:\n{}'
+                    print(msg.format(' '.join(unknown), phase, ' '.join(self.all_data_keys[phase])))
+                    return False
                 return True
         else:
             print('Unknown phase {}'.format(phase))
             return False
 
+    def union_shapes(self):
+        """Merge divariant fields of all sections and create field index.
+
+        All parts of a field are merged at once using `unary_union`. Field index
+        stores for every field its bounds, prepared geometry and ids of owning
+        sections and is used for fast point queries by `identify` and
+        `get_section_id`.
+        """
+        parts, owners = OrderedDict(), OrderedDict()
+        for ix, shapes in self._shapes.items():
+            for key, shape in shapes.items():
+                parts.setdefault(key, []).append(shape)
+                owners.setdefault(key, []).append(ix)
+        self.shapes = {}
+        for key, shapelist in parts.items():
+            if len(shapelist) > 1:
+                self.shapes[key] = unary_union(shapelist)
+            else:
+                self.shapes[key] = shapelist[0]
+        self._field_index = [(key, shape.bounds, prep(shape), owners[key]) for key, shape in self.shapes.items()]
+        self._section_index = []
+        for ix, ps in self.sections.items():
+            _, area = ps.range_shapes
+            self._section_index.append((ix, area.bounds, prep(area)))
+
+    def build_sample_index(self):
+        """Build `samples` dictionary associating divariant field keys and
+        `FieldSamples` of invariant points and univariant lines within field.
+        """
+        self.samples = {}
+        for key, shape in self.shapes.items():
+            pshape = prep(shape)
+            pts, results, source = [], [], []
+            for ix, ps in self.sections.items():
+                if key in self.unilists[ix]:
+                    for id_inv in self.invs_from_unilist(ix, self.unilists[ix][key]):
+                        inv = ps.invpoints[id_inv]
+                        if not inv.manual and pshape.intersects(Point(inv._x, inv._y)):
+                            pts.append((inv._x, inv._y))
+                            results.append(inv.results[0])
+                            source.append(0)
+                    for id_uni in self.unilists[ix][key]:
+                        uni = ps.unilines[id_uni]
+                        if not uni.manual:
+                            for x, y, res in zip(uni._x[uni.used], uni._y[uni.used], uni.results[uni.used]):
+                                if pshape.intersects(Point(x, y)):
+                                    pts.append((x, y))
+                                    results.append(res)
+                                    source.append(1)
+            self.samples[key] = FieldSamples(pts, results, source)
+
+    def _find_field(self, x, y):
+        """Return field index record containing point or None."""
+        pt = Point(x, y)
+        for rec in self._field_index:
+            xmin, ymin, xmax, ymax = rec[1]
+            if xmin <= x <= xmax and ymin <= y <= ymax:
+                if rec[2].contains(pt):
+                    return rec
+
     def get_section_id(self, x, y):
         """Return index of pseudosection and grid containing point
         """
-        ix_ok = None
-        for ix, ps in enumerate(self.sections.values()):
-            _, area = ps.range_shapes
-            if area.contains(Point(x, y)):
-                ix_ok = ix
-                break
-        return ix_ok
+        rec = self._find_field(x, y)
+        # field owned by single section identifies it directly
+        if rec is not None and len(rec[3]) == 1:
+            return rec[3][0]
+        pt = Point(x, y)
+        for ix, (xmin, ymin, xmax, ymax), area in self._section_index:
+            if rec is None or ix in rec[3]:
+                if xmin <= x <= xmax and ymin <= y <= ymax:
+                    if area.contains(pt):
+                        return ix
 
     def invs_from_unilist(self, ix, unilist):
         """Return set of IDs of invariant points associated with unilines.
@@ -303,28 +419,997 @@ class PS:
         are removed and need to be recalculated using `PTPS.calculate_composition`
         method.
         """
-        if self.gridded:
+        if self.gridded or self.pointstores:
             for ix, projfile in self.projfiles.items():
                 # put to dict
                 with gzip.open(str(projfile), 'rb') as stream:
                     data = pickle.load(stream)
                 data['variance'] = self._variance[ix]
-                data['grid'] = self.grids[ix]
+                if ix in self.grids:
+                    data['grid'] = self.grids[ix]
+                    data.pop('stale_grid', None)
+                if ix in self.pointstores:
+                    data['points'] = self.pointstores[ix]
                 # do save
                 with gzip.open(str(projfile), 'wb') as stream:
                     pickle.dump(data, stream)
         else:
             print('Not yet gridded...')
 
+    @property
+    def interpolants_file(self):
+        """Path of sidecar file with persisted interpolants."""
+        projfile = self.projfiles[0]
+        return projfile.with_name(projfile.name + '.interp')
+
+    def save_interpolants(self):
+        """Save cached interpolants to sidecar file of project. Cached
+        interpolants are loaded automatically when project is opened."""
+        self.interpolants.save(self.interpolants_file)
+
+    def field_version(self, key):
+        """Return fingerprint of data used for interpolation within divariant
+        field. It changes when field shape or status of calculations changes.
+
+        Args:
+            key (frozenset): Key identifying divariant field
+        """
+        h = hashlib.md5(self.shapes[key].wkb)
+        for ix, grid in self.grids.items():
+            if key in grid.masks:
+                h.update(grid.status[grid.masks[key]].tobytes())
+        for ix, store in self.pointstores.items():
+            h.update(store.status[store.keys == key].tobytes())
+        return h.hexdigest()
+
+    def interpolant(self, key, phase, expr, which=7, smooth=0, rbf_func='thin_plate', method='rbf', neighbors=50):
+        """Return interpolant of values of expression within divariant field.
+
+        Fitted interpolants are cached in `interpolants` LRU cache. Cached
+        interpolant is reused, when data used for fitting did not change.
+
+        Args:
+            key (frozenset): Key identifying divariant field
+            phase (str): Phase or end-member named
+            expr (str): Expression to evaluate.
+            which (int): Bitopt defining from where data are collected. See
+                `collect_data`. Default 7
+            smooth (int): Values greater than zero increase the smoothness
+                of the approximation. Default 0
+            rbf_func (str): Radial basis function. Default 'thin_plate'
+            method (str): Interpolation method 'rbf', 'local', 'linear' or
+                'cubic'. See `Interpolant`. Default 'rbf'
+            neighbors (int): Number of neighbours used by 'local' method.
+                Default 50
+
+        Returns:
+            Interpolant: Fitted interpolant or None when no data available.
+        """
+        ckey = (key, phase, expr, which, smooth, rbf_func, method, neighbors, self.field_version(key))
+        if ckey in self.interpolants:
+            return self.interpolants[ckey]
+        task = self.interpolant_task(key, phase, expr, which=which, smooth=smooth, rbf_func=rbf_func,
+                                     method=method, neighbors=neighbors)
+        interp = None
+        if task is not None:
+            interp = _fit_interpolant(task)
+            if interp.method == 'nearest':
+                print('Failed to nearest method in {}'.format(' '.join(sorted(list(key)))))
+        self.interpolants[ckey] = interp
+        return interp
+
+    def interpolant_task(self, key, phase, expr, which=7, smooth=0, rbf_func='thin_plate', method='rbf', neighbors=50):
+        """Return tuple of arguments of `Interpolant` of values of expression
+        within divariant field. Data are collected by `collect_data`. Used by
+        `interpolant` and `fit_interpolants`.
+
+        Args:
+            key (frozenset): Key identifying divariant field
+            phase (str): Phase or end-member named
+            expr (str): Expression to evaluate.
+            which (int): Bitopt defining from where data are collected. See
+                `collect_data`. Default 7
+            smooth (int): Values greater than zero increase the smoothness
+                of the approximation. Default 0
+            rbf_func (str): Radial basis function. Default 'thin_plate'
+            method (str): Interpolation method. See `Interpolant`. Default 'rbf'
+            neighbors (int): Number of neighbours used by 'local' method.
+                Default 50
+
+        Returns:
+            tuple: Arguments of `Interpolant` or None when no data available.
+        """
+        d = self.collect_data(key, phase, expr, which=which)
+        if d['data']:
+            return (d['pts'], d['data'], self.ratio, self.shapes[key].bounds, (self.gridxstep, self.gridystep),
+                    rbf_func, smooth, method, neighbors)
+
+    def query(self, phase, expr, x, y, which=7, smooth=0, rbf_func='thin_plate', method='rbf', neighbors=50):
+        """Return values of expression in arbitrary points.
+
+        Points are grouped by divariant fields and values are evaluated by
+        cached interpolant of each field. See `interpolant`.
+
+        Args:
+            phase (str): Phase or end-member named
+            expr (str): Expression to evaluate.
+            x (numpy.array): Array of x coordinates
+            y (numpy.array): Array of y coordinates
+            which (int): Bitopt defining from where data are collected. See
+                `collect_data`. Default 7
+            smooth (int): Values greater than zero increase the smoothness
+                of the approximation. Default 0
+            rbf_func (str): Radial basis function. Default 'thin_plate'
+            method (str): Interpolation method 'rbf', 'local', 'linear' or
+                'cubic'. See `Interpolant`. Default 'rbf'
+            neighbors (int): Number of neighbours used by 'local' method.
+                Default 50
+
+        Returns:
+            numpy.array: Values of same shape as coordinates. NaN is used
+            outside of divariant fields and where phase is not present.
+        """
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(y, dtype=float))
+        vals = np.full(x.size, np.nan)
+        if self.check_phase_expr(phase, expr):
+            xf, yf = x.ravel(), y.ravel()
+            for key, ind in self.identify_points(xf, yf).items():
+                interp = self.interpolant(key, phase, expr, which=which, smooth=smooth, rbf_func=rbf_func,
+                                          method=method, neighbors=neighbors)
+                if interp is not None:
+                    vals[ind] = interp(xf[ind], yf[ind])
+        return vals.reshape(x.shape)
+
     def create_masks(self):
         """Update grid masks from existing divariant fields"""
         if self.gridded:
+            self.interpolants.invalidate()
+            self.isolines.invalidate()
             for ix, grid in self.grids.items():
+                grid.invalidate()
                 # Create data masks
-                points = MultiPoint(list(zip(grid.xg.flatten(), grid.yg.flatten())))
                 shapes = self._shapes[ix]
                 for key in shapes:
-                    grid.masks[key] = np.array(list(map(shapes[key].contains, points))).reshape(grid.xg.shape)
+                    grid.masks[key] = contains_xy(shapes[key], grid.xg, grid.yg)
+        else:
+            print('Not yet gridded...')
+
+    def calc_node(self, key, x, y, guesses=None, tc=None):
+        """Calculate compositions of stable assemblage in single point.
+
+        Section axes are mapped to THERMOCALC calculation by `_calc_node`
+        adaptor method of individual explorers.
+
+        Args:
+            key (frozenset): Key identifying divariant field
+            x (float): x-coordinate of point
+            y (float): y-coordinate of point
+            guesses (list): ptguess lines used for calculation. When None, actual
+                guesses from scriptfile are used. Default None.
+            tc (TCAPI): THERMOCALC API used for calculation. Default `tc` property.
+
+        Returns:
+            tuple: (res, delta) THERMOCALC result or None when calculation failed
+            and time needed for calculation. When calculation was terminated
+            by `TCAPI.terminate`, (None, None) is returned and it is not counted
+            as THERMOCALC run.
+        """
+        if tc is None:
+            tc = self.tc
+        if guesses is not None:
+            tc.update_scriptfile(guesses=guesses)
+        start_time = time.time()
+        self._calc_node(tc, key.difference(tc.excess), x, y)
+        delta = time.time() - start_time
+        if tc.cancelled:
+            return None, None
+        status, res, output = tc.parse_logfile()
+        with self._tc_lock:
+            self.tc_calls += 1
+            if res is None:
+                self.tc_failed += 1
+        if res is not None:
+            return res[0], delta
+        else:
+            return None, delta
+
+    def grid_nodes(self, ix, grid, nodes, desc='Gridding'):
+        """Calculate compositions on selected nodes of section grid.
+
+        This is grid engine shared by all explorers. Before any node calculation,
+        ptguesses are updated from nearest invariant point. If calculation fails,
+        nearest solution from univariant line is used to update ptguesses.
+        Nearest points are found using `SeedIndex` of section.
+
+        Args:
+            ix (int): Index of section
+            grid (GridData): Grid of section
+            nodes (list): List of (row, column) tuples to be calculated
+            desc (str): Description of progress bar
+
+        Returns:
+            int: Number of failed nodes
+        """
+        seeds = self.seeds[ix]
+        rr, cc = np.array(nodes, dtype=int).reshape(-1, 2).T
+        nearest = seeds.nearest_inv(grid.xg[rr, cc], grid.yg[rr, cc])
+        last_inv = None
+        failed = 0
+        for (r, c), id_close in tqdm(zip(nodes, nearest), desc=desc, total=len(nodes)):
+            if self._out_of_budget():
+                break
+            x, y = grid.xg[r, c], grid.yg[r, c]
+            k = self.identify(x, y)
+            if k is not None:
+                # update guesses from closest inv point
+                guesses = None
+                if id_close is not None and id_close != last_inv:
+                    guesses = seeds.inv_guess(id_close)
+                    last_inv = id_close
+                res, delta = self.calc_node(k, x, y, guesses=guesses)
+                if res is None:
+                    # update guesses from closest uni line point
+                    guesses = seeds.uni_guess(k, x, y)
+                    if guesses is not None:
+                        last_inv = None
+                        res, delta = self.calc_node(k, x, y, guesses=guesses)
+                grid.gridcalcs[r, c] = res
+                if res is not None:
+                    grid.status[r, c] = 1
+                    grid.delta[r, c] = delta
+                else:
+                    grid.status[r, c] = 0
+                    failed += 1
+            else:
+                grid.gridcalcs[r, c] = None
+            self._node_done(ix, grid, r, c)
+        return failed
+
+    def grid_wavefront(self, ix, grid, nodes, desc='Gridding', attempts=3):
+        """Calculate compositions on selected nodes of section grid using wavefront.
+
+        Each divariant field is processed as breadth-first wavefront started
+        from nodes on field boundary. Node is calculated using ptguess of nearest
+        already solved neighbour from same field, or nearest univariant line or
+        invariant point seed. Failed nodes are re-queued and calculated again with
+        alternative guesses up to `attempts` times.
+
+        Args:
+            ix (int): Index of section
+            grid (GridData): Grid of section
+            nodes (list): List of (row, column) tuples to be calculated
+            desc (str): Description of progress bar
+            attempts (int): Maximum number of calculations per node. Default 3
+
+        Returns:
+            int: Number of failed nodes
+        """
+        seeds = self.seeds[ix]
+        keys = OrderedDict()
+        for r, c in nodes:
+            k = self.identify(grid.xg[r, c], grid.yg[r, c])
+            if k is None:
+                grid.gridcalcs[r, c] = None
+                self._node_done(ix, grid, r, c)
+            else:
+                keys[(r, c)] = k
+        tried = {node: [] for node in keys}
+
+        def nkey(node):
+            if node not in keys:
+                keys[node] = self.identify(grid.xg[node], grid.yg[node])
+            return keys[node]
+
+        def candidates(r, c, k):
+            x, y = grid.xg[r, c], grid.yg[r, c]
+            neighs = [(rn, cn) for rn, cn in grid.neighs(r, c) if grid.status[rn, cn] == 1 and nkey((rn, cn)) == k]
+            neighs.sort(key=lambda n: (grid.xg[n] - x)**2 + (seeds.ratio * (grid.yg[n] - y))**2)
+            guesses = [grid.gridcalcs[n].ptguess for n in neighs]
+            guesses.append(seeds.uni_guess(k, x, y))
+            id_inv = seeds.nearest_inv(x, y)[0]
+            if id_inv is not None:
+                guesses.append(seeds.inv_guess(id_inv))
+            return [g for g in guesses if g is not None and g not in tried[(r, c)]]
+
+        failed = 0
+        with tqdm(desc=desc, total=len(nodes)) as pbar:
+            pbar.update(len(nodes) - len(keys))
+            for k in sorted(set(keys.values()), key=lambda k: sorted(k)):
+                field = OrderedDict((node, True) for node, nk in list(keys.items()) if nk == k and node in tried)
+                # start from nodes on field boundary
+                queue = deque(node for node in field if any(nkey(n) != k for n in grid.neighs(*node)))
+                queued = set(queue)
+                while field and not self._out_of_budget():
+                    if not queue:
+                        node = next(iter(field))
+                        queue.append(node)
+                        queued.add(node)
+                    r, c = queue.popleft()
+                    guesses = candidates(r, c, k)
+                    if guesses or not tried[(r, c)]:
+                        guess = guesses[0] if guesses else None
+                        tried[(r, c)].append(guess)
+                        res, delta = self.calc_node(k, grid.xg[r, c], grid.yg[r, c], guesses=guess)
+                        grid.gridcalcs[r, c] = res
+                        if res is not None:
+                            grid.status[r, c] = 1
+                            grid.delta[r, c] = delta
+                            for n in grid.neighs(r, c):
+                                if n in field and n not in queued:
+                                    queue.append(n)
+                                    queued.add(n)
+                        else:
+                            grid.status[r, c] = 0
+                            if len(tried[(r, c)]) < attempts:
+                                # re-queue to try alternative guesses later
+                                queue.append((r, c))
+                                continue
+                    if grid.status[r, c] == 0:
+                        failed += 1
+                    del field[(r, c)]
+                    self._node_done(ix, grid, r, c)
+                    pbar.update(1)
+        return failed
+
+    def grid_progressive(self, ix, grid, nodes, desc='Gridding', attempts=3):
+        """Calculate compositions on selected nodes of section grid from coarse
+        to fine.
+
+        Nodes are calculated in interleaved levels. First level is subsampled
+        grid with step of power of two, each next level halves the step until
+        full resolution is reached. Node is calculated using ptguesses of
+        already solved nodes of same divariant field on the level spacing,
+        nearest univariant line or invariant point seed. Calculation is repeated
+        with next ptguess until success or number of `attempts` is reached.
+
+        Args:
+            ix (int): Index of section
+            grid (GridData): Grid of section
+            nodes (list): List of (row, column) tuples to be calculated
+            desc (str): Description of progress bar
+            attempts (int): Maximum number of calculations per node. Default 3
+
+        Returns:
+            int: Number of failed nodes
+        """
+        seeds = self.seeds[ix]
+        failed = 0
+        for (r, c), step in tqdm(grid.levels(nodes), desc=desc, total=len(nodes)):
+            if self._out_of_budget():
+                break
+            x, y = grid.xg[r, c], grid.yg[r, c]
+            k = self.identify(x, y)
+            if k is not None:
+                neighs = [n for n in grid.neighs(r, c, step=step) if grid.status[n] == 1 and self.identify(grid.xg[n], grid.yg[n]) == k]
+                neighs.sort(key=lambda n: (grid.xg[n] - x)**2 + (seeds.ratio * (grid.yg[n] - y))**2)
+                guesses = [grid.gridcalcs[n].ptguess for n in neighs]
+                guesses.append(seeds.uni_guess(k, x, y))
+                id_inv = seeds.nearest_inv(x, y)[0]
+                if id_inv is not None:
+                    guesses.append(seeds.inv_guess(id_inv))
+                tried = []
+                res, delta = None, np.nan
+                for guess in guesses:
+                    if guess is not None and guess not in tried:
+                        tried.append(guess)
+                        res, delta = self.calc_node(k, x, y, guesses=guess)
+                        if res is not None or len(tried) >= attempts:
+                            break
+                if not tried:
+                    res, delta = self.calc_node(k, x, y)
+                grid.gridcalcs[r, c] = res
+                if res is not None:
+                    grid.status[r, c] = 1
+                    grid.delta[r, c] = delta
+                else:
+                    grid.status[r, c] = 0
+                    failed += 1
+            else:
+                grid.gridcalcs[r, c] = None
+            self._node_done(ix, grid, r, c)
+        return failed
+
+    def checkpoint_file(self, ix):
+        """Return path of checkpoint sidecar file of section."""
+        projfile = self.projfiles[ix]
+        return projfile.with_name(projfile.name + '.ckpt')
+
+    def save_checkpoint(self, ix, grid, done):
+        """Save partially calculated grid of section to checkpoint sidecar file.
+
+        Args:
+            ix (int): Index of section
+            grid (GridData): Grid of section
+            done (numpy.array): 2D boolean array of already processed nodes
+        """
+        ckfile = self.checkpoint_file(ix)
+        tmpfile = ckfile.with_name(ckfile.name + '.tmp')
+        with gzip.open(str(tmpfile), 'wb') as stream:
+            pickle.dump(dict(grid=grid, done=done), stream)
+        tmpfile.replace(ckfile)
+
+    def load_checkpoint(self, ix):
+        """Return grid and processed nodes mask stored in checkpoint sidecar
+        file of section. When checkpoint does not exists returns (None, None)."""
+        ckfile = self.checkpoint_file(ix)
+        if ckfile.exists():
+            with gzip.open(str(ckfile), 'rb') as stream:
+                data = pickle.load(stream)
+            return data['grid'], data['done']
+        else:
+            return None, None
+
+    def _node_done(self, ix, grid, r, c):
+        """Mark grid node as processed and save checkpoint when due."""
+        ckpt = self._checkpoint
+        if ckpt is not None:
+            ckpt['done'][r, c] = True
+            ckpt['count'] += 1
+            if ckpt['count'] >= ckpt['nodes'] or time.time() - ckpt['time'] >= ckpt['interval']:
+                self.save_checkpoint(ix, grid, ckpt['done'])
+                ckpt['count'], ckpt['time'] = 0, time.time()
+            if not np.isnan(grid.status[r, c]):
+                ckpt['budget']['count'] += 1
+
+    def _out_of_budget(self):
+        """Return True when time or node budget of gridding is exhausted."""
+        ckpt = self._checkpoint
+        if ckpt is not None:
+            return self._budget_exhausted(ckpt['budget'])
+        return False
+
+    @staticmethod
+    def _budget_exhausted(budget):
+        """Return True when time or node limits of budget are reached."""
+        if budget['deadline'] is not None and time.time() >= budget['deadline']:
+            return True
+        if budget['maxnodes'] is not None and budget['count'] >= budget['maxnodes']:
+            return True
+        return False
+
+    def _incremental_done(self, grid):
+        """Compare actual divariant fields with grid masks and reset nodes,
+        which need to be recalculated.
+
+        Args:
+            grid (GridData): Previously calculated grid
+
+        Returns:
+            tuple: (done, ncalc) 2D boolean array of nodes which are kept and
+            number of nodes which need THERMOCALC calculation
+        """
+        old_keys = np.empty(grid.xg.shape, dtype=object)
+        for key, mask in grid.masks.items():
+            old_keys[mask] = key
+        done = np.ones(grid.xg.shape, dtype=bool)
+        ncalc = 0
+        for r, c in np.ndindex(grid.xg.shape):
+            k = self.identify(grid.xg[r, c], grid.yg[r, c])
+            if k != old_keys[r, c] or grid.status[r, c] == 0:
+                done[r, c] = False
+                grid.gridcalcs[r, c] = None
+                grid.status[r, c] = np.nan
+                grid.delta[r, c] = np.nan
+                if k is not None:
+                    ncalc += 1
+        return done, ncalc
+
+    def _target_mask(self, grid, fields=None, phases=None):
+        """Return 2D boolean array of grid nodes within selected fields.
+
+        Args:
+            grid (GridData): Grid of section
+            fields (list): List of divariant field keys. Keys could be
+                given as frozensets or strings of space separated phases.
+            phases (list): List of phases which all must be present in field.
+        """
+        keys = set()
+        for k in fields if fields is not None else []:
+            if isinstance(k, str):
+                k = frozenset(k.split())
+            keys.add(frozenset(k).union(self.tc.excess))
+        phases = set(phases if phases is not None else [])
+        target = np.zeros(grid.xg.shape, dtype=bool)
+        for r, c in np.ndindex(grid.xg.shape):
+            k = self.identify(grid.xg[r, c], grid.yg[r, c])
+            if k is not None:
+                target[r, c] = (not keys or k in keys) and phases.issubset(k)
+        return target
+
+    def calculate_composition(self, nx=50, ny=50, traversal='raster', resume=False, retry=False,
+                              checkpoint=500, interval=600, incremental=False, fields=None, phases=None,
+                              budget=None, maxnodes=None, workers=1):
+        """Method to calculate compositional variations on grid.
+
+        A compositions are calculated for stable assemblages in regular grid
+        covering pT range of pseudosection. A stable assemblage is identified
+        from constructed divariant fields. Results are stored in `grid` property
+        as `GridData` instance. A property `all_data_keys` is updated.
+
+        Before any grid point calculation, ptguesses are updated from nearest
+        invariant point. If calculation fails, nearest solution from univariant
+        line is used to update ptguesses. Finally, if solution is still not found,
+        the method `fix_solutions` is called and neigbouring grid calculations are
+        used to provide ptguess.
+
+        With `traversal='wavefront'` each divariant field is calculated as
+        breadth-first wavefront from its boundary, using ptguesses of already
+        solved neighbours. See `grid_wavefront` method.
+
+        With `traversal='progressive'` coarse subsampled grid is calculated first
+        and finer levels are filled in interleaved order. See `grid_progressive`
+        method. Together with `budget` or `maxnodes` it provides usable partial
+        grid within fixed time. Unfinished gridding could be continued later with
+        `resume=True`.
+
+        Args:
+            nx (int): Number of grid points along x direction (T)
+            ny (int): Number of grid points along y direction (p)
+            traversal (str): Order of grid calculation. 'raster', 'wavefront' or
+                'progressive'. Default 'raster'
+            resume (bool): Continue from last checkpoint. Already processed nodes
+                are skipped and nx, ny are taken from checkpoint. Default False
+            retry (bool): When resuming, calculate again also failed nodes.
+                Default False
+            checkpoint (int): Number of processed nodes between checkpoints.
+                Default 500
+            interval (float): Maximum time in seconds between checkpoints.
+                Default 600
+            incremental (bool): Reuse previous grid and recalculate only nodes
+                where divariant field changed or calculation failed. Number of
+                needed calculations is reported before gridding. Default False
+            fields (list): Calculate only nodes within given divariant fields.
+                Fields could be given as frozensets or strings of space separated
+                phases. Results are merged into existing grid. Default None
+            phases (list): Calculate only nodes within divariant fields where all
+                given phases are present. Results are merged into existing grid.
+                Default None
+            budget (float): Maximum wall-clock time of gridding in seconds. When
+                exhausted, partially calculated grid is saved and checkpoint is
+                kept to resume gridding. Default None
+            maxnodes (int): Maximum number of calculated nodes. When exhausted,
+                partially calculated grid is saved and checkpoint is kept to
+                resume gridding. Default None
+            workers (int): Number of concurrent THERMOCALC calculations used by
+                `fix_solutions`. Default 1
+
+        Failed points are fixed by `fix_solutions` only when budget is not
+        exhausted and within remaining time budget.
+        """
+        assert traversal in ['raster', 'wavefront', 'progressive'], 'Traversal must be raster, wavefront or progressive.'
+        self.tc_calls, self.tc_failed = 0, 0
+        axr = self.xrange
+        ayr = self.yrange
+        targeted = fields is not None or phases is not None
+        plan = OrderedDict()
+        for ix, ps in self.sections.items():
+            grid, done = None, None
+            if resume:
+                grid, done = self.load_checkpoint(ix)
+                if grid is None:
+                    print('No checkpoint found for {}. Gridding from scratch.'.format(self.projfiles[ix].name))
+                elif retry:
+                    done[grid.status == 0] = False
+            elif incremental:
+                grid = self.grids.get(ix, self.stale_grids.get(ix, None))
+                if grid is None:
+                    print('No previous grid found for {}. Gridding from scratch.'.format(self.projfiles[ix].name))
+                else:
+                    done, ncalc = self._incremental_done(grid)
+                    print('Incremental update of {}: {} of {} nodes to recalculate, at least {} THERMOCALC runs.'.format(self.projfiles[ix].name, len(np.flatnonzero(~done)), done.size, ncalc))
+            elif targeted and ix in self.grids:
+                grid = self.grids[ix]
+                done = grid.status == 1
+            if grid is None:
+                paxr = ps.xrange
+                payr = ps.yrange
+                grid = GridData(ps,
+                                nx=round(nx * (paxr[1] - paxr[0]) / (axr[1] - axr[0])),
+                                ny=round(ny * (payr[1] - payr[0]) / (ayr[1] - ayr[0])))
+                done = np.zeros(grid.xg.shape, dtype=bool)
+            if targeted:
+                done |= ~self._target_mask(grid, fields=fields, phases=phases)
+                print('Targeted gridding of {}: {} nodes to calculate.'.format(self.projfiles[ix].name, len(np.flatnonzero(~done))))
+            plan[ix] = (grid, done)
+        gpleft = 0
+        limits = dict(deadline=None if budget is None else time.time() + budget, maxnodes=maxnodes, count=0)
+        for ix, (grid, done) in plan.items():
+            nodes = list(zip(*np.unravel_index(np.arange(grid.xg.size), grid.xg.shape, order=self.grid_order)))
+            nodes = [node for node in nodes if not done[node]]
+            self._checkpoint = dict(done=done, count=0, time=time.time(), nodes=checkpoint, interval=interval, budget=limits)
+            try:
+                if traversal == 'wavefront':
+                    self.grid_wavefront(ix, grid, nodes, desc='Gridding {}/{}'.format(ix + 1, len(self.sections)))
+                elif traversal == 'progressive':
+                    self.grid_progressive(ix, grid, nodes, desc='Gridding {}/{}'.format(ix + 1, len(self.sections)))
+                else:
+                    self.grid_nodes(ix, grid, nodes, desc='Gridding {}/{}'.format(ix + 1, len(self.sections)))
+            finally:
+                self.save_checkpoint(ix, grid, done)
+                self._checkpoint = None
+            print('Grid search done. {} empty points left.'.format(len(np.flatnonzero(grid.status == 0))))
+            gpleft += len(np.flatnonzero(grid.status == 0))
+            self.grids[ix] = grid
+        if gpleft > 0:
+            if self._budget_exhausted(limits):
+                print('Gridding budget exhausted. Fixing of {} failed points skipped, use fix_solutions later.'.format(gpleft))
+            else:
+                self.fix_solutions(workers=workers, deadline=limits['deadline'])
+        self.tc_report()
+        self.create_masks()
+        # update variable lookup table
+        self.collect_all_data_keys()
+        # save
+        self.save()
+        # remove checkpoints of finished sections
+        for ix, (grid, done) in plan.items():
+            if not done.all():
+                print('Gridding budget exhausted. {} nodes of {} left. Use resume to continue.'.format(len(np.flatnonzero(~done)), self.projfiles[ix].name))
+            elif self.checkpoint_file(ix).exists():
+                self.checkpoint_file(ix).unlink()
+
+    def calc_seeded(self, ix, key, x, y, store=None, attempts=3, tcs=None, pool=None):
+        """Calculate compositions in single point using best available ptguesses.
+
+        Ptguesses are taken from nearest solved points from same divariant
+        field in point store, nearest point on univariant lines and nearest
+        invariant point. Calculation is repeated with next ptguess until success
+        or number of `attempts` is reached. When pool is provided, ptguesses are
+        calculated concurrently by `calc_first`.
+
+        Args:
+            ix (int): Index of section
+            key (frozenset): Key identifying divariant field
+            x (float): x-coordinate of point
+            y (float): y-coordinate of point
+            store (PointStore): Point store used for ptguesses. Default None
+            attempts (int): Maximum number of calculations. Default 3
+            tcs (list): List of TCAPI instances used with pool. Default None
+            pool (ThreadPoolExecutor): Executor used by `calc_first`. Default None
+
+        Returns:
+            tuple: (res, delta) THERMOCALC result or None when calculation failed
+            and time needed for calculation.
+        """
+        seeds = self.seeds[ix]
+        guesses = []
+        if store is not None:
+            guesses.extend(store.guesses(key, x, y, n=attempts - 1))
+        guesses.append(seeds.uni_guess(key, x, y))
+        id_inv = seeds.nearest_inv(x, y)[0]
+        if id_inv is not None:
+            guesses.append(seeds.inv_guess(id_inv))
+        tried = []
+        for guess in guesses:
+            if guess is not None and guess not in tried:
+                tried.append(guess)
+        tried = tried[:attempts]
+        if pool is not None:
+            return self.calc_first(key, x, y, tried if tried else [None], tcs, pool)
+        res, delta = None, np.nan
+        for guess in tried:
+            res, delta = self.calc_node(key, x, y, guesses=guess)
+            if res is not None:
+                break
+        if not tried:
+            res, delta = self.calc_node(key, x, y)
+        return res, delta
+
+    def _store_node(self, ix, store, x, y, pbar=None):
+        """Return index of point in store. Not yet existing point is calculated."""
+        ind = store.index(x, y)
+        if ind is None:
+            k = self.identify(x, y)
+            if k is None:
+                ind = store.add(x, y, None, None, np.nan)
+            else:
+                res, delta = self.calc_seeded(ix, k, x, y, store=store)
+                ind = store.add(x, y, k, res, delta)
+            if pbar is not None:
+                pbar.update(1)
+        return ind
+
+    def _refine_cell(self, store, corners, criteria, tolerance):
+        """Check whether quadtree cell should be subdivided."""
+        keys = set(store.keys[corners])
+        if len(keys) > 1:
+            return True
+        solved = [i for i in corners if store.status[i] == 1]
+        for phase, expr in criteria:
+            vals = compile_expr(expr)(store.calcs[solved], phase)
+            vals = vals[np.isfinite(vals)]
+            if len(vals) > 1 and vals.max() - vals.min() > tolerance:
+                return True
+        return False
+
+    def calculate_adaptive(self, nx=10, ny=10, maxnodes=2000, criteria=[], tolerance=0.01, maxlevel=5):
+        """Method to calculate compositional variations on adaptive quadtree grid.
+
+        Calculation starts from coarse grid, which cells are recursively
+        subdivided when they straddle boundary of divariant fields, or when the
+        values of any (phase, expr) criterion differs more than tolerance between
+        cell corners. Refinement proceeds level by level until node budget or
+        maximum level is reached. Cell is subdivided only when all its new
+        nodes fit into budget, so number of nodes never exceeds maxnodes unless
+        initial coarse grid is bigger. Results are stored in `pointstores`
+        property as `PointStore` instances and are used together with grid
+        data for interpolations, isopleths, `get_gridded`, `save_tab` and
+        `show_grid`.
+
+        Args:
+            nx (int): Number of coarse cells along x direction. Default 10
+            ny (int): Number of coarse cells along y direction. Default 10
+            maxnodes (int): Maximum number of nodes. Default 2000
+            criteria (list): List of (phase, expr) tuples used for refinement.
+                Default []
+            tolerance (float): Maximum allowed difference of criteria values
+                within cell. Default 0.01
+            maxlevel (int): Maximum number of subdivisions. Default 5
+        """
+        self.tc_calls, self.tc_failed = 0, 0
+        area = (self.xrange[1] - self.xrange[0]) * (self.yrange[1] - self.yrange[0])
+        for ix, ps in self.sections.items():
+            store = PointStore(ratio=ps.ratio)
+            budget = round(maxnodes * (ps.xrange[1] - ps.xrange[0]) * (ps.yrange[1] - ps.yrange[0]) / area)
+            # keep nodes slightly inside of section range
+            ex, ey = 1e-9 * (ps.xrange[1] - ps.xrange[0]), 1e-9 * (ps.yrange[1] - ps.yrange[0])
+            xs = np.linspace(ps.xrange[0] + ex, ps.xrange[1] - ex, nx + 1)
+            ys = np.linspace(ps.yrange[0] + ey, ps.yrange[1] - ey, ny + 1)
+            cells = deque((xs[c], xs[c + 1], ys[r], ys[r + 1], 0) for r in range(ny) for c in range(nx))
+            with tqdm(desc='Adaptive gridding {}/{}'.format(ix + 1, len(self.sections)), total=budget) as pbar:
+                for y in ys:
+                    for x in xs:
+                        self._store_node(ix, store, x, y, pbar=pbar)
+                while cells and len(store) < budget:
+                    x0, x1, y0, y1, level = cells.popleft()
+                    corners = [store.index(x, y) for x, y in [(x0, y0), (x1, y0), (x0, y1), (x1, y1)]]
+                    if level < maxlevel and self._refine_cell(store, corners, criteria, tolerance):
+                        xm, ym = (x0 + x1) / 2, (y0 + y1) / 2
+                        new = [(x, y) for x, y in [(xm, y0), (x0, ym), (xm, ym), (x1, ym), (xm, y1)]
+                               if store.index(x, y) is None]
+                        # whole subdivision must fit into budget
+                        if len(store) + len(new) > budget:
+                            break
+                        for x, y in new:
+                            self._store_node(ix, store, x, y, pbar=pbar)
+                        cells.extend([(x0, xm, y0, ym, level + 1), (xm, x1, y0, ym, level + 1),
+                                      (x0, xm, ym, y1, level + 1), (xm, x1, ym, y1, level + 1)])
+            print('Adaptive gridding done. {}'.format(store))
+            self.pointstores[ix] = store
+        self.tc_report()
+        # update variable lookup table
+        self.collect_all_data_keys()
+        # save
+        self.save()
+
+    def calculate_points(self, x, y, workers=1):
+        """Method to calculate compositions on arbitrary set of points.
+
+        Points are grouped by divariant fields (see `identify_points`) and
+        within each field are calculated in order of increasing distance from
+        univariant lines, so already solved points could provide ptguesses for
+        next ones. When `workers` > 1, ptguesses of each point are calculated
+        concurrently like in `fix_solutions`.
+
+        Calculated points are added to `pointstores` of sections, saved to
+        project and used together with grid data for interpolations,
+        isopleths and `get_gridded`. Points already stored are not calculated
+        again.
+
+        Args:
+            x (numpy.array): 1D array of x coordinates
+            y (numpy.array): 1D array of y coordinates
+            workers (int): Number of concurrent THERMOCALC calculations. Default 1
+
+        Returns:
+            PointStore: Calculated points in original order
+        """
+        x, y = np.atleast_1d(np.asarray(x, dtype=float)), np.atleast_1d(np.asarray(y, dtype=float))
+        assert x.shape == y.shape, 'Shape of x and y coordinates should be same.'
+        self.tc_calls, self.tc_failed = 0, 0
+        owners = {rec[0]: rec[3] for rec in self._field_index}
+        # calculation order
+        order = []
+        for k, ind in self.identify_points(x, y).items():
+            if len(owners[k]) == 1:
+                secs = np.full(len(ind), owners[k][0])
+            else:
+                secs = np.array([self.get_section_id(x[i], y[i]) for i in ind])
+            for ix in owners[k]:
+                sel = ind[secs == ix]
+                if ix in self.seeds and k in self.seeds[ix].uni_trees:
+                    tree, _ = self.seeds[ix].uni_trees[k]
+                    dst, _ = tree.query(np.column_stack((x[sel], self.seeds[ix].ratio * y[sel])))
+                    sel = sel[np.argsort(dst, kind='stable')]
+                order.extend((ix, k, i) for i in sel)
+        refs = {}
+        with ExitStack() as stack:
+            tcs, pool = self._tc_workers(stack, workers)
+            for ix, k, i in tqdm(order, desc='Calculating'):
+                store = self.pointstores.setdefault(ix, PointStore(ratio=self.sections[ix].ratio))
+                ind = store.index(x[i], y[i])
+                if ind is None:
+                    res, delta = self.calc_seeded(ix, k, x[i], y[i], store=store, tcs=tcs, pool=pool)
+                    ind = store.add(x[i], y[i], k, res, delta)
+                refs.setdefault(ix, ([], []))
+                refs[ix][0].append(i)
+                refs[ix][1].append(ind)
+        # collect in original order
+        keys = np.empty(len(x), np.dtype(object))
+        calcs = np.empty(len(x), np.dtype(object))
+        delta = np.full(len(x), np.nan)
+        for ix, (pos, ind) in refs.items():
+            store = self.pointstores[ix]
+            keys[pos] = store.keys[ind]
+            calcs[pos] = store.calcs[ind]
+            delta[pos] = store.delta[ind]
+        result = PointStore(ratio=self.ratio)
+        result.extend(x, y, keys, calcs, delta)
+        self.tc_report()
+        # update variable lookup table
+        self.collect_all_data_keys()
+        # save
+        self.save()
+        return result
+
+    def tc_report(self):
+        """Print number of THERMOCALC runs and failure rate of last gridding."""
+        if self.tc_calls > 0:
+            print('THERMOCALC runs: {}, failed: {} ({:.1%})'.format(self.tc_calls, self.tc_failed, self.tc_failed / self.tc_calls))
+
+    def rank_guesses(self, ix, grid, r, c, key, radius=2):
+        """Return ptguesses for grid node ranked from the most promising.
+
+        Candidates are ptguesses of successfully calculated nodes within
+        `radius` grid steps. Candidates are ranked by distance in grid steps
+        multiplied by dissimilarity of their divariant field, i.e. 1 for same
+        field and up to 2 for field with no common phase (Jaccard index of
+        phases). Seeds from nearest univariant line and invariant point are
+        appended at the end.
+
+        Args:
+            ix (int): Index of section
+            grid (GridData): Grid of section
+            r (int): Row index
+            c (int): Column index
+            key (frozenset): Key identifying divariant field of node
+            radius (int): Search radius in grid steps. Default 2
+
+        Returns:
+            list: List of unique ptguesses
+        """
+        x, y = grid.xg[r, c], grid.yg[r, c]
+        rows, cols = np.nonzero(grid.status[max(r - radius, 0):r + radius + 1, max(c - radius, 0):c + radius + 1] == 1)
+        ranked = []
+        for rn, cn in zip(rows + max(r - radius, 0), cols + max(c - radius, 0)):
+            kn = self.identify(grid.xg[rn, cn], grid.yg[rn, cn])
+            if kn is not None:
+                similarity = len(key & kn) / len(key | kn)
+                ranked.append((np.hypot(rn - r, cn - c) * (2 - similarity), grid.gridcalcs[rn, cn].ptguess))
+        ranked.sort(key=lambda v: v[0])
+        seeds = self.seeds[ix]
+        guesses = [guess for _, guess in ranked]
+        guesses.append(seeds.uni_guess(key, x, y))
+        id_inv = seeds.nearest_inv(x, y)[0]
+        if id_inv is not None:
+            guesses.append(seeds.inv_guess(id_inv))
+        unique = []
+        for guess in guesses:
+            if guess is not None and guess not in unique:
+                unique.append(guess)
+        return unique
+
+    def _tc_workers(self, stack, workers):
+        """Return list of TCAPI instances with working directories copied to
+        temporary directory and thread pool for `calc_first`. Both are closed
+        with stack. When workers is 1 or copies are not usable, ([], None) is
+        returned and calculations run serially.
+
+        Args:
+            stack (ExitStack): Context stack managing temporary directory and pool
+            workers (int): Number of concurrent THERMOCALC calculations
+        """
+        tcs, pool = [], None
+        if workers > 1:
+            tmpdir = Path(stack.enter_context(tempfile.TemporaryDirectory()))
+            tcs = [self.tc.clone(tmpdir / 'worker{}'.format(i)) for i in range(workers)]
+            if all(tc.OK for tc in tcs):
+                pool = stack.enter_context(ThreadPoolExecutor(max_workers=workers))
+            else:
+                print('Working directory could not be copied. Calculating serially.')
+        return tcs, pool
+
+    def calc_first(self, key, x, y, guesses, tcs, pool):
+        """Calculate compositions in single point with several ptguesses at once.
+
+        Ptguesses are processed in batches of size of `tcs`, each calculation
+        in its own working directory. First successful result is kept, other
+        running calculations are terminated and not yet started are cancelled.
+
+        Args:
+            key (frozenset): Key identifying divariant field
+            x (float): x-coordinate of point
+            y (float): y-coordinate of point
+            guesses (list): ptguesses in order of preference
+            tcs (list): List of TCAPI instances with isolated working directories
+            pool (ThreadPoolExecutor): Executor with at least len(tcs) workers
+
+        Returns:
+            tuple: (res, delta) THERMOCALC result or None when calculation failed
+            and time needed for calculation.
+        """
+        for b in range(0, len(guesses), len(tcs)):
+            batch = guesses[b:b + len(tcs)]
+            for tc in tcs:
+                tc.cancelled = False
+            futures = {pool.submit(self.calc_node, key, x, y, guesses=guess, tc=tc): tc for guess, tc in zip(batch, tcs)}
+            found = None
+            for future in as_completed(futures):
+                if future.cancelled():
+                    continue
+                res, delta = future.result()
+                if res is not None and found is None:
+                    found = res, delta
+                    for other, tc in futures.items():
+                        if not other.cancel():
+                            tc.terminate()
+            if found is not None:
+                return found
+        return None, np.nan
+
+    def fix_solutions(self, workers=1, radius=2, deadline=None):
+        """Method try to find solution for grid points with failed status.
+
+        Ptguesses are used from successfully calculated points nearby ranked
+        by distance and similarity of divariant fields (see `rank_guesses`)
+        until solution is find. Otherwise ststus remains failed.
+
+        When `workers` > 1, working directory is copied to temporary directories
+        and best ranked ptguesses of node are calculated concurrently. First
+        success is kept and remaining calculations are cancelled.
+
+        Args:
+            workers (int): Number of concurrent THERMOCALC calculations. Default 1
+            radius (int): Search radius for ptguesses in grid steps. Default 2
+            deadline (float): Time (as returned by time.time) when fixing is
+                stopped. Default None
+        """
+        if self.gridded:
+            with ExitStack() as stack:
+                tcs, pool = self._tc_workers(stack, workers)
+                for ix, grid in self.grids.items():
+                    log = []
+                    ri, ci = np.nonzero(grid.status == 0)
+                    fixed, ftot = 0, len(ri)
+                    tq = trange(ftot, desc='Fix ({}/{})'.format(fixed, ftot))
+                    for ind in tq:
+                        if deadline is not None and time.time() >= deadline:
+                            log.append('Time budget exhausted. Fix stopped after {} of {} points.'.format(ind, ftot))
+                            break
+                        r, c = ri[ind], ci[ind]
+                        x, y = grid.xg[r, c], grid.yg[r, c]
+                        k = self.identify(x, y)
+                        if k is not None:
+                            guesses = self.rank_guesses(ix, grid, r, c, k, radius=radius)
+                            res = None
+                            if pool is not None:
+                                res, delta = self.calc_first(k, x, y, guesses, tcs, pool)
+                            else:
+                                for guess in guesses:
+                                    res, delta = self.calc_node(k, x, y, guesses=guess)
+                                    if res is not None:
+                                        break
+                            if res is not None:
+                                grid.gridcalcs[r, c] = res
+                                grid.status[r, c] = 1
+                                grid.delta[r, c] = delta
+                                fixed += 1
+                                tq.set_description(desc='Fix ({}/{})'.format(fixed, ftot))
+                        if grid.status[r, c] == 0:
+                            log.append('No solution find for {}, {}'.format(x, y))
+                    grid.invalidate()
+                    log.append('Fix done. {} empty grid points left.'.format(len(np.flatnonzero(grid.status == 0))))
+                    print('\n'.join(log))
         else:
             print('Not yet gridded...')
 
@@ -340,9 +1425,8 @@ class PS:
         self.xg, self.yg = np.meshgrid(self.xspace, self.yspace)
         # Create data masks
         self.masks = {}
-        points = MultiPoint(list(zip(self.xg.flatten(), self.yg.flatten())))
         for key in self.shapes:
-            self.masks[key] = np.array(list(map(self.shapes[key].contains, points))).reshape(self.xg.shape)
+            self.masks[key] = contains_xy(self.shapes[key], self.xg, self.yg)
 
     def collect_all_data_keys(self):
         """Collect all phases and variables calculated on grid.
@@ -421,15 +1505,11 @@ class PS:
             'data' key  storing list of thermocalc results.
         """
         dt = dict(pts=[], data=[])
-        for ix, ps in self.sections.items():
-            if key in self.unilists[ix]:
-                for id_inv in self.invs_from_unilist(ix, self.unilists[ix][key]):
-                    inv = ps.invpoints[id_inv]
-                    if not inv.manual:
-                        if phase in inv.results.phases:
-                            if self.shapes[key].intersects(Point(inv._x, inv._y)):
-                                dt['pts'].append((inv._x, inv._y))
-                                dt['data'].append(eval_expr(expr, inv.results[0][phase]))
+        if key in self.samples:
+            smp = self.samples[key]
+            sel = smp.select(phase, 0)
+            dt['pts'] = list(map(tuple, smp.pts[sel]))
+            dt['data'] = list(smp.values(phase, expr)[sel])
         return dt
 
     def collect_uni_data(self, key, phase, expr):
@@ -448,24 +1528,17 @@ class PS:
             'data' key  storing list of thermocalc results.
         """
         dt = dict(pts=[], data=[])
-        for ix, ps in self.sections.items():
-            if key in self.unilists[ix]:
-                for id_uni in self.unilists[ix][key]:
-                    uni = ps.unilines[id_uni]
-                    if not uni.manual:
-                        if phase in uni.results.phases:
-                            edt = zip(uni._x[uni.used],
-                                      uni._y[uni.used],
-                                      uni.results[uni.used],)
-                            for x, y, res in edt:
-                                if self.shapes[key].intersects(Point(x, y)):
-                                    dt['pts'].append((x, y))
-                                    dt['data'].append(eval_expr(expr, res[phase]))
+        if key in self.samples:
+            smp = self.samples[key]
+            sel = smp.select(phase, 1)
+            dt['pts'] = list(map(tuple, smp.pts[sel]))
+            dt['data'] = list(smp.values(phase, expr)[sel])
         return dt
 
     def collect_grid_data(self, key, phase, expr):
         """Retrieve values of expression for given phase for
-        all GridData points within divariant field identified by key.
+        all GridData points and adaptively gridded points within divariant
+        field identified by key.
 
         Args:
             key (frozenset): Key identifying divariant field
@@ -482,17 +1555,15 @@ class PS:
         if self.gridded:
             for ix, grid in self.grids.items():
                 if key in grid.masks:
-                    results = grid.gridcalcs[grid.masks[key] & (grid.status == 1)]
-                    if len(results) > 0:
-                        if phase in results[0].phases:
-                            gdt = zip(grid.xg[grid.masks[key]],
-                                      grid.yg[grid.masks[key]],
-                                      results,
-                                      grid.status[grid.masks[key]])
-                            for x, y, res, ok in gdt:
-                                if ok == 1:
-                                    dt['pts'].append((x, y))
-                                    dt['data'].append(eval_expr(expr, res[phase]))
+                    sel = grid.masks[key] & grid.column(phase, None)
+                    dt['pts'].extend(zip(grid.xg[sel], grid.yg[sel]))
+                    dt['data'].extend(grid.values(phase, expr)[sel])
+        for ix, store in self.pointstores.items():
+            if key in store.masks:
+                sel = np.flatnonzero(store.masks[key] & (store.status == 1))
+                sel = sel[[phase in res.phases for res in store.calcs[sel]]]
+                dt['pts'].extend(zip(store.x[sel], store.y[sel]))
+                dt['data'].extend(compile_expr(expr)(store.calcs[sel], phase))
         # else:
         #     print('Not yet gridded...')
         return dt
@@ -784,7 +1855,7 @@ class PS:
 
     def show_grid(self, phase, expr=None, interpolation=None, label=False):
         """Convinient function to show values of expression for given phase only
-        from Grid Data.
+        from Grid Data. Points of adaptive point stores are shown as markers.
 
         Args:
             phase (str): Phase or end-member named
@@ -795,32 +1866,44 @@ class PS:
                 Default None.
             label (bool): Whether to label divariant fields. Default False.
         """
-        if self.gridded:
+        if self.has_results:
             if self.check_phase_expr(phase, expr):
                 fig, ax = plt.subplots()
                 cgd = {}
                 mn, mx = sys.float_info.max, -sys.float_info.max
                 for ix, grid in self.grids.items():
-                    gd = np.empty(grid.xg.shape)
-                    gd[:] = np.nan
-                    for key in grid.masks:
-                        results = grid.gridcalcs[grid.masks[key] & (grid.status == 1)]
-                        if len(results) > 0:
-                            if phase in results[0].phases:
-                                rows, cols = np.nonzero(grid.masks[key])
-                                for r, c in zip(rows, cols):
-                                    if grid.status[r, c] == 1:
-                                        gd[r, c] = eval_expr(expr, grid.gridcalcs[r, c][phase])
+                    gd = grid.values(phase, expr)
+                    # partially calculated grid, fill from nearest calculated node
+                    pending = grid.pending
+                    if np.any(pending):
+                        present = grid.column(phase, None)
+                        for key, mask in grid.masks.items():
+                            solved = mask & present
+                            if np.any(mask & pending) and np.any(solved):
+                                tree = cKDTree(np.column_stack((grid.xg[solved], self.ratio * grid.yg[solved])))
+                                _, ind = tree.query(np.column_stack((grid.xg[mask & pending], self.ratio * grid.yg[mask & pending])))
+                                gd[mask & pending] = gd[solved][ind]
                     cgd[ix] = gd
                     mn = min(np.nanmin(gd), mn)
                     mx = max(np.nanmax(gd), mx)
+                cpts, im = {}, None
+                for ix, store in self.pointstores.items():
+                    vals = store.values(phase, expr)
+                    ok = np.isfinite(vals)
+                    if np.any(ok):
+                        cpts[ix] = store.x[ok], store.y[ok], vals[ok]
+                        mn = min(vals[ok].min(), mn)
+                        mx = max(vals[ok].max(), mx)
                 for ix, grid in self.grids.items():
                     im = ax.imshow(cgd[ix], extent=grid.extent, interpolation=interpolation,
                                    aspect='auto', origin='lower', vmin=mn, vmax=mx)
+                for ix, (x, y, vals) in cpts.items():
+                    im = ax.scatter(x, y, c=vals, s=12, vmin=mn, vmax=mx)
                 self.add_overlay(ax, label=label)
                 ax.set_xlim(self.xrange)
                 ax.set_ylim(self.yrange)
-                fig.colorbar(im)
+                if im is not None:
+                    fig.colorbar(im)
                 ax.set_title('{}({})'.format(phase, expr))
                 fig.tight_layout()
                 plt.show()
@@ -893,12 +1976,33 @@ class PS:
             x (float): x coord
             y (float): y coord
         """
-        key = None
-        for k, shape in self.shapes.items():
-            if shape.contains(Point(x, y)):
-                key = k
-                break
-        return key
+        rec = self._find_field(x, y)
+        if rec is not None:
+            return rec[0]
+
+    def identify_points(self, x, y):
+        """Return divariant fields of many points at once.
+
+        Args:
+            x (numpy.array): 1D array of x coordinates
+            y (numpy.array): 1D array of y coordinates
+
+        Returns:
+            OrderedDict: Dictionary associating key (frozenset) of divariant
+            field and array of indexes of points within field. Points outside
+            of all fields are omitted.
+        """
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        free = np.ones(x.shape, dtype=bool)
+        groups = OrderedDict()
+        for key, (xmin, ymin, xmax, ymax), _, _ in self._field_index:
+            cand = np.flatnonzero(free & (x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax))
+            if len(cand) > 0:
+                ind = cand[contains_xy(self.shapes[key], x[cand], y[cand])]
+                if len(ind) > 0:
+                    groups[key] = ind
+                    free[ind] = False
+        return groups
 
     def gidentify(self, label=False):
         """Visual version of `identify` method. PT point is provided by mouse click.
@@ -944,7 +2048,7 @@ class PS:
         expression. Individual divariant fields are contoured separately, so
         final plot allows sharp changes accross univariant lines. Within
         divariant field the thin-plate radial basis function interpolation is
-        used. See scipy.interpolation.Rbf
+        used by default. See scipy.interpolation.Rbf and `Interpolant`
 
         Args:
             phase (str): Phase or end-member named
@@ -980,6 +2084,18 @@ class PS:
                 Default False.
             dt (bool): Whether the gradient should be calculated along
                 temperature or pressure. Default True.
+            method (str): Interpolation method. 'rbf' global radial basis
+                function, 'local' radial basis function using nearest samples,
+                'linear' or 'cubic' Delaunay based interpolation. Local methods
+                are much faster for fields with thousands of samples.
+                Default 'rbf'
+            neighbors (int): Number of neighbours used by 'local' method.
+                Default 50
+            filename (str): When provided, figure is saved to file instead of
+                being shown. Default None
+            interpolants (dict): Dictionary associating divariant field keys
+                and already fitted interpolants, e.g. from `fit_interpolants`.
+                When provided, interpolation arguments are ignored. Default None
         """
         if self.check_phase_expr(phase, expr):
             # parse kwargs
@@ -1000,8 +2116,12 @@ class PS:
             colors = kwargs.get('colors', None)
             cmap = kwargs.get('cmap', 'viridis')
             labelkeys = kwargs.get('labelkeys', [])
+            method = kwargs.get('method', 'rbf')
+            neighbors = kwargs.get('neighbors', 50)
+            filename = kwargs.get('filename', None)
+            interpolants = kwargs.get('interpolants', None)
 
-            if not self.gridded:
+            if not self.has_results:
                 print('Collecting only from uni lines and inv points. Not yet gridded...')
             # fix labelkeys
             if not isinstance(labelkeys, list):
@@ -1013,16 +2133,18 @@ class PS:
                 labelkyes_ok.append(lbl.union(self.tc.excess))
             if isinstance(out, str):
                 out = [out]
-            if only is not None:
-                recs = OrderedDict()
-                d = self.collect_data(only, phase, expr, which=which)
-                z = d['data']
-                if z:
-                    recs[only] = d
-                    mn = min(z)
-                    mx = max(z)
-            else:
-                recs, mn, mx = self.merge_data(phase, expr, which=which)
+            recs = OrderedDict()
+            mn, mx = sys.float_info.max, -sys.float_info.max
+            for key in [only] if only is not None else self:
+                if interpolants is not None:
+                    interp = interpolants.get(key, None)
+                else:
+                    interp = self.interpolant(key, phase, expr, which=which, smooth=smooth, rbf_func=rbf_func,
+                                              method=method, neighbors=neighbors)
+                if interp is not None:
+                    recs[key] = interp
+                    mn = min(mn, interp.zmin)
+                    mx = max(mx, interp.zmax)
             if step:
                 cntv = np.arange(0, mx + step, step)
                 cntv = cntv[cntv >= mn - step]
@@ -1042,30 +2164,7 @@ class PS:
                     ttspace = np.arange(tmin - self.gridxstep, tmax + self.gridxstep, self.gridxstep / refine)
                     ppspace = np.arange(pmin - self.gridystep, pmax + self.gridystep, self.gridystep / refine)
                     tg, pg = np.meshgrid(ttspace, ppspace)
-                    x, y = np.array(recs[key]['pts']).T
-                    pts = recs[key]['pts']
-                    data = recs[key]['data']
-                    try:
-                        # Firstly try Rbf Use scaling
-                        with warnings.catch_warnings():
-                            warnings.filterwarnings("error")
-                            rbf = Rbf(x, self.ratio * y, data, function=rbf_func, smooth=smooth)
-                            zg = rbf(tg, self.ratio * pg)
-                    except Exception:
-                        try:
-                            # preprocess with griddata cubic
-                            zg_tmp = griddata(pts, data, (tg, pg), method='linear', rescale=True)
-                            # locate valid data
-                            ri, ci = np.nonzero(np.isfinite(zg_tmp))
-                            x, y, z = np.array([[tg[r, c], pg[r, c], zg_tmp[r, c]] for r, c in zip(ri, ci)]).T
-                            # do Rbf extrapolation
-                            with warnings.catch_warnings():
-                                warnings.filterwarnings("ignore", category=LinAlgWarning)
-                                rbf = Rbf(x, self.ratio * y, z, function=rbf_func, smooth=smooth)
-                                zg = rbf(tg, self.ratio * pg)
-                        except Exception:
-                            print('Failed to nearest method in {}'.format(' '.join(sorted(list(key)))))
-                            zg = griddata(np.array(pts), data, (tg, pg), method='nearest', rescale=True)
+                    zg = recs[key](tg, pg)
                     # experimental
                     if gradient:
                         grd = np.gradient(zg, self.gridxstep, self.gridystep)
@@ -1169,7 +2268,118 @@ class PS:
             ax.format_coord = self.format_coord
             # connect button press
             # cid = fig.canvas.mpl_connect('button_press_event', self.onclick)
-            plt.show()
+            if filename is not None:
+                fig.savefig(filename)
+                plt.close(fig)
+            else:
+                plt.show()
+
+    def field_isolines(self, key, phase, expr, levels, **kwargs):
+        """Return isolines of expression clipped to divariant field.
+
+        Values are interpolated on regular grid covering field (see
+        `interpolant` method), contoured and resulting lines are clipped by
+        field geometry. No figure is created. Results are cached in `isolines`
+        cache.
+
+        Args:
+            key (frozenset): Key identifying divariant field
+            phase (str): Phase or end-member named
+            expr (str): Expression to evaluate.
+            levels (list): Values of isolines
+            which (int): Bitopt defining from where data are collected. See
+                `collect_data`. Default 7
+            smooth (int): Smoothness of the approximation. Default 0
+            refine (int): Degree of grid refinement. Default 1
+            method (str): Interpolation method. See `Interpolant`. Default 'rbf'
+            neighbors (int): Number of neighbours used by 'local' method.
+                Default 50
+
+        Returns:
+            OrderedDict: Dictionary associating levels and shapely geometries.
+            Levels without isoline within field are omitted.
+        """
+        which = kwargs.get('which', 7)
+        smooth = kwargs.get('smooth', 0)
+        refine = kwargs.get('refine', 1)
+        method = kwargs.get('method', 'rbf')
+        neighbors = kwargs.get('neighbors', 50)
+        ckey = (key, phase, expr, tuple(levels), which, smooth, refine, method, neighbors, self.field_version(key))
+        if ckey in self.isolines:
+            return self.isolines[ckey]
+        lines = OrderedDict()
+        interp = self.interpolant(key, phase, expr, which=which, smooth=smooth, method=method, neighbors=neighbors)
+        if interp is not None:
+            tmin, pmin, tmax, pmax = self.shapes[key].bounds
+            ttspace = np.arange(tmin - self.gridxstep, tmax + self.gridxstep, self.gridxstep / refine)
+            ppspace = np.arange(pmin - self.gridystep, pmax + self.gridystep, self.gridystep / refine)
+            tg, pg = np.meshgrid(ttspace, ppspace)
+            zg = interp(tg, pg)
+            for level in levels:
+                segs = [seg for seg in contour_lines(tg, pg, zg, level) if len(seg) > 1]
+                if segs:
+                    geom = self.shapes[key].intersection(MultiLineString(segs))
+                    if not geom.is_empty:
+                        lines[level] = linemerge(geom) if geom.geom_type == 'MultiLineString' else geom
+        self.isolines[ckey] = lines
+        return lines
+
+    def isopleth_lines(self, phase, expr, levels=10, **kwargs):
+        """Return isolines of expression as shapely geometries.
+
+        Every divariant field is contoured separately and lines are clipped
+        to field geometry. See `field_isolines` for keyword arguments.
+
+        Args:
+            phase (str): Phase or end-member named
+            expr (str): Expression to evaluate.
+            levels (int or list): Values of isolines or maximum number of
+                levels. Default 10
+
+        Returns:
+            OrderedDict: Dictionary associating levels and dictionaries of
+            geometries of individual divariant fields.
+        """
+        result = OrderedDict()
+        if self.check_phase_expr(phase, expr):
+            which = kwargs.get('which', 7)
+            keys = [key for key in self if phase.split(')')[0].split('(')[0] in key]
+            if np.isscalar(levels):
+                mn, mx = sys.float_info.max, -sys.float_info.max
+                for key in keys:
+                    interp = self.interpolant(key, phase, expr, which=which, smooth=kwargs.get('smooth', 0),
+                                              method=kwargs.get('method', 'rbf'), neighbors=kwargs.get('neighbors', 50))
+                    if interp is not None:
+                        mn, mx = min(mn, interp.zmin), max(mx, interp.zmax)
+                levels = ticker.MaxNLocator(nbins=levels).tick_values(vmin=mn, vmax=mx) if mn <= mx else []
+            for level in levels:
+                result[level] = OrderedDict()
+            for key in keys:
+                for level, geom in self.field_isolines(key, phase, expr, levels, **kwargs).items():
+                    result[level][key] = geom
+        return result
+
+    def export_isopleth_lines(self, filename, phase, expr, levels=10, **kwargs):
+        """Export isolines obtained by `isopleth_lines` to GeoJSON file.
+
+        Every feature has properties phase, expr, level and field.
+
+        Args:
+            filename (str): Name of GeoJSON file
+            phase (str): Phase or end-member named
+            expr (str): Expression to evaluate.
+            levels (int or list): Values of isolines or maximum number of
+                levels. Default 10
+        """
+        features = []
+        for level, geoms in self.isopleth_lines(phase, expr, levels=levels, **kwargs).items():
+            for key, geom in geoms.items():
+                features.append(dict(type='Feature', geometry=mapping(geom),
+                                     properties=dict(phase=phase, expr=expr, level=float(level),
+                                                     field=' '.join(sorted(key)))))
+        with Path(filename).open('w') as f:
+            json.dump(dict(type='FeatureCollection', features=features), f)
+        print('{} isolines saved to {}'.format(len(features), filename))
 
     def gendrawpd(self, export_areas=True):
         """Method to write drawpd file
@@ -1279,48 +2489,250 @@ class PS:
             else:
                 print('Drawpd error!')
 
-    def save_tab(self, comps, tabfile=None):
-        """Export gridded values to Perpex tab format
-        """
-        if not tabfile:
-            tabfile = self.name + '.tab'
-        data = []
-        comps_labels = []
-        for phase, expr in tqdm(comps, desc='Collecting data...'):
-            data.append(self.get_gridded(phase, expr).flatten())
-            comps_labels.append('{}({})'.format(phase, expr))
-        with Path(tabfile).open('wb') as f:
-            head = ['ptbuilder', self.name + '.tab', '{:12d}'.format(2),
-                    'T(°C)', '   {:16.16f}'.format(self.xrange[0])[:19],
-                    '   {:16.16f}'.format(self.xstep)[:19], '{:12d}'.format(len(self.xspace)),
-                    'p(kbar)', '   {:16.16f}'.format(self.yrange[0])[:19],
-                    '   {:16.16f}'.format(self.ystep)[:19], '{:12d}'.format(len(self.yspace)),
-                    '{:12d}'.format(len(data)), (len(data) * '{:15s}').format(*comps_labels)]
-            for ln in head:
-                f.write(bytes(ln + '\n', 'utf-8'))
-            np.savetxt(f, np.transpose(data), fmt='%15.6f', delimiter='')
-        print('Saved.')
-
-    def get_gridded(self, phase, expr=None, which=7, smooth=0):
+    def save_tab(self, comps, tabfile=None, binary=False, **kwargs):
+        """Export gridded values to Perple_X tab format.
+
+        Values of all expressions are interpolated on common grid (see
+        `common_grid_and_masks`) from cached or freshly fitted interpolants
+        (see `fit_interpolants`) and written in blocks of grid rows, so whole
+        table is never held in memory.
+
+        Args:
+            comps (list): List of (phase, expr) tuples
+            tabfile (str): Name of output file. Default project name with
+                '.tab' extension
+            binary (bool): When True, values are saved as data cube directory
+                named after tabfile without extension instead of text table.
+                See `DataCube`. Default False
+            which (int): Bitopt defining from where data are collected. See
+                `collect_data`. Default 7
+            smooth (int): Values greater than zero increase the smoothness
+                of the approximation. Default 0
+            rbf_func (str): Radial basis function. Default 'thin_plate'
+            method (str): Interpolation method. See `Interpolant`. Default 'rbf'
+            neighbors (int): Number of neighbours used by 'local' method.
+                Default 50
+            workers (int): Number of processes used to fit interpolants.
+                Default 1
+            rows (int): Number of grid rows written at once. Default 50
+        """
+        if self.has_results:
+            which = kwargs.get('which', 7)
+            smooth = kwargs.get('smooth', 0)
+            rbf_func = kwargs.get('rbf_func', 'thin_plate')
+            method = kwargs.get('method', 'rbf')
+            neighbors = kwargs.get('neighbors', 50)
+            workers = kwargs.get('workers', 1)
+            rows = kwargs.get('rows', 50)
+            comps = [(phase, expr) for phase, expr in comps if self.check_phase_expr(phase, expr)]
+            if not hasattr(self, 'masks'):
+                self.common_grid_and_masks()
+            interps = self.fit_interpolants(comps, which=which, smooth=smooth, rbf_func=rbf_func, method=method,
+                                            neighbors=neighbors, workers=workers)
+            if not tabfile:
+                tabfile = self.name + '.tab'
+            ny, nx = self.xg.shape
+            with ExitStack() as stack:
+                if binary:
+                    path = Path(tabfile).with_suffix('')
+                    path.mkdir(parents=True, exist_ok=True)
+                    out = np.lib.format.open_memmap(str(path / 'cube0.npy'), mode='w+', dtype='float64',
+                                                    shape=(ny, nx, len(comps)))
+                else:
+                    f = stack.enter_context(Path(tabfile).open('wb'))
+                    comps_labels = ['{}({})'.format(phase, expr) for phase, expr in comps]
+                    head = ['ptbuilder', self.name + '.tab', '{:12d}'.format(2),
+                            'T(°C)', '   {:16.16f}'.format(self.xrange[0])[:19],
+                            '   {:16.16f}'.format(self.xstep)[:19], '{:12d}'.format(nx),
+                            'p(kbar)', '   {:16.16f}'.format(self.yrange[0])[:19],
+                            '   {:16.16f}'.format(self.ystep)[:19], '{:12d}'.format(ny),
+                            '{:12d}'.format(len(comps)), (len(comps) * '{:15s}').format(*comps_labels)]
+                    for ln in head:
+                        f.write(bytes(ln + '\n', 'utf-8'))
+                for r in trange(0, ny, rows, desc='Saving...'):
+                    block = self.gridded_rows(comps, interps, r, r + rows)
+                    if binary:
+                        out[r:r + rows] = block
+                    else:
+                        np.savetxt(f, block.reshape(-1, len(comps)), fmt='%15.6f', delimiter='')
+            if binary:
+                out.flush()
+                del out
+                masks = {' '.join(sorted(key)): mask for key, mask in self.masks.items()}
+                np.savez_compressed(str(path / 'masks0.npz'), **masks)
+                index = dict(name=self.name, x_var=self.x_var, y_var=self.y_var, variables=comps,
+                             sections=[dict(cube='cube0.npy', masks='masks0.npz',
+                                            xspace=self.xspace.tolist(), yspace=self.yspace.tolist())])
+                with (path / 'index.json').open('w') as f:
+                    json.dump(index, f)
+                tabfile = path
+            print('Saved to {}.'.format(tabfile))
+        else:
+            print('Not yet gridded...')
+
+    def fit_interpolants(self, comps, which=7, smooth=0, rbf_func='thin_plate', method='rbf', neighbors=50, workers=None):
+        """Fit interpolants of many expressions in all divariant fields at once.
+
+        Data are collected like in `interpolant` and interpolants not found
+        in `interpolants` cache are fitted in process pool and stored in cache.
+
+        Args:
+            comps (list): List of (phase, expr) tuples
+            which (int): Bitopt defining from where data are collected. See
+                `collect_data`. Default 7
+            smooth (int): Values greater than zero increase the smoothness
+                of the approximation. Default 0
+            rbf_func (str): Radial basis function. Default 'thin_plate'
+            method (str): Interpolation method. See `Interpolant`. Default 'rbf'
+            neighbors (int): Number of neighbours used by 'local' method.
+                Default 50
+            workers (int): Number of processes. Default None (number of CPUs)
+
+        Returns:
+            dict: Dictionary associating (key, phase, expr) tuples and fitted
+            `Interpolant` or None when no data available
+        """
+        interps = {}
+        tasks, ckeys = [], []
+        for key in tqdm(list(self), desc='Collecting data...'):
+            version = self.field_version(key)
+            for phase, expr in comps:
+                ckey = (key, phase, expr, which, smooth, rbf_func, method, neighbors, version)
+                if ckey in self.interpolants:
+                    interps[(key, phase, expr)] = self.interpolants[ckey]
+                else:
+                    task = self.interpolant_task(key, phase, expr, which=which, smooth=smooth, rbf_func=rbf_func,
+                                                 method=method, neighbors=neighbors)
+                    if task is None:
+                        interps[(key, phase, expr)] = self.interpolants[ckey] = None
+                    else:
+                        tasks.append(task)
+                        ckeys.append(ckey)
+        if workers == 1:
+            fitted = [_fit_interpolant(task) for task in tqdm(tasks, desc='Interpolating...')]
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                fitted = list(tqdm(pool.map(_fit_interpolant, tasks), desc='Interpolating...', total=len(tasks)))
+        for ckey, interp in zip(ckeys, fitted):
+            key, phase, expr = ckey[:3]
+            if interp.method == 'nearest':
+                print('Failed to nearest method in {}'.format(' '.join(sorted(list(key)))))
+            interps[(key, phase, expr)] = self.interpolants[ckey] = interp
+        return interps
+
+    def gridded_rows(self, comps, interps, start, stop):
+        """Return values of expressions in rows of common grid.
+
+        Args:
+            comps (list): List of (phase, expr) tuples
+            interps (dict): Interpolants returned by `fit_interpolants`
+            start (int): First row of common grid
+            stop (int): Row of common grid after last one
+
+        Returns:
+            numpy.array: Array of shape (rows, nx, len(comps))
+        """
+        xg, yg = self.xg[start:stop], self.yg[start:stop]
+        block = np.full(xg.shape + (len(comps),), np.nan)
+        for key in self:
+            mask = self.masks[key][start:stop]
+            if np.any(mask):
+                for j, (phase, expr) in enumerate(comps):
+                    interp = interps[(key, phase, expr)]
+                    if interp is not None:
+                        block[mask, j] = interp(xg[mask], yg[mask])
+        return block
+
+    def isopleths_batch(self, comps, which=7, smooth=0, rbf_func='thin_plate', method='rbf', neighbors=50, workers=None):
+        """Compute values of many expressions on common grid at once.
+
+        Interpolants are fitted by `fit_interpolants`, so following
+        `isopleths` or `get_gridded` calls with same arguments do not need to
+        fit them again.
+
+        Args:
+            comps (list): List of (phase, expr) tuples
+            which (int): Bitopt defining from where data are collected. See
+                `collect_data`. Default 7
+            smooth (int): Values greater than zero increase the smoothness
+                of the approximation. Default 0
+            rbf_func (str): Radial basis function. Default 'thin_plate'
+            method (str): Interpolation method. See `Interpolant`. Default 'rbf'
+            neighbors (int): Number of neighbours used by 'local' method.
+                Default 50
+            workers (int): Number of processes. Default None (number of CPUs)
+
+        Returns:
+            OrderedDict: Dictionary associating (phase, expr) tuples and 2D
+            arrays of values on common grid (see `common_grid_and_masks`)
+        """
+        comps = [(phase, expr) for phase, expr in comps if self.check_phase_expr(phase, expr)]
+        if not hasattr(self, 'masks'):
+            self.common_grid_and_masks()
+        interps = self.fit_interpolants(comps, which=which, smooth=smooth, rbf_func=rbf_func, method=method,
+                                        neighbors=neighbors, workers=workers)
+        values = self.gridded_rows(comps, interps, 0, self.xg.shape[0])
+        return OrderedDict((comp, values[:, :, j]) for j, comp in enumerate(comps))
+
+    def export_cube(self, path, dtype='float64'):
+        """Export all variables of all phases and end-members calculated on
+        grid(s) to data cube.
+
+        Data cube is directory containing for every section memory-mappable
+        numpy file of shape (ny, nx, number of variables) with raw grid values
+        (NaN where variable is not available), npz file with status and masks
+        of divariant fields and index.json with list of variables and grid
+        coordinates. Grid is processed row by row, so whole cube is never held
+        in memory. Use `DataCube` to read it.
+
+        Args:
+            path (str): Directory where data cube is created
+            dtype (str): Data type of stored values. Default 'float64'
+        """
         if self.gridded:
+            path = Path(path)
+            path.mkdir(parents=True, exist_ok=True)
+            variables = [(phase, var) for phase in sorted(self.all_data_keys) for var in self.all_data_keys[phase]]
+            vindex = {v: j for j, v in enumerate(variables)}
+            index = dict(name=self.name, x_var=self.x_var, y_var=self.y_var, variables=variables, sections=[])
+            for ix, grid in self.grids.items():
+                cubefile, masksfile = 'cube{}.npy'.format(ix), 'masks{}.npz'.format(ix)
+                cube = np.lib.format.open_memmap(str(path / cubefile), mode='w+', dtype=dtype,
+                                                 shape=grid.xg.shape + (len(variables),))
+                row = np.empty(cube.shape[1:], dtype=dtype)
+                for r in trange(grid.xg.shape[0], desc='Exporting {}/{}'.format(ix + 1, len(self.grids))):
+                    row[:] = np.nan
+                    for c in np.flatnonzero(grid.status[r] == 1):
+                        for phase, vals in grid.gridcalcs[r, c].data.items():
+                            for var, val in vals.items():
+                                j = vindex.get((phase, var), None)
+                                if j is not None:
+                                    row[c, j] = val
+                    cube[r] = row
+                cube.flush()
+                del cube
+                masks = {' '.join(sorted(key)): mask for key, mask in grid.masks.items()}
+                np.savez_compressed(str(path / masksfile), status=grid.status, **masks)
+                index['sections'].append(dict(cube=cubefile, masks=masksfile,
+                                              xspace=grid.xspace.tolist(), yspace=grid.yspace.tolist()))
+            with (path / 'index.json').open('w') as f:
+                json.dump(index, f)
+            print('Data cube with {} variables saved to {}'.format(len(variables), path))
+        else:
+            print('Not yet gridded...')
+
+    def get_gridded(self, phase, expr=None, which=7, smooth=0, method='rbf'):
+        if self.has_results:
             if self.check_phase_expr(phase, expr):
                 if not hasattr(self, 'masks'):
                     self.common_grid_and_masks()
                 #  interpolate on common grid
-                recs, mn, mx = self.merge_data(phase, expr, which=which)
                 gd = np.empty(self.xg.shape)
                 gd[:] = np.nan
-                for key in recs:
-                    xmin, ymin, xmax, ymax = self.shapes[key].bounds
-                    xxind = np.logical_and(self.xspace >= xmin - self.xstep, self.xspace <= xmax + self.xstep)
-                    yyind = np.logical_and(self.yspace >= ymin - self.ystep, self.yspace <= ymax + self.ystep)
-                    slc = np.ix_(yyind, xxind)
-                    tg, pg = self.xg[slc], self.yg[slc]
-                    x, y = np.array(recs[key]['pts']).T
-                    # Use scaling
-                    rbf = Rbf(x, self.ratio * y, recs[key]['data'], function='thin_plate', smooth=smooth)
-                    zg = rbf(tg, self.ratio * pg)
-                    gd[self.masks[key]] = zg[self.masks[key][slc]]
+                for key in self:
+                    interp = self.interpolant(key, phase, expr, which=which, smooth=smooth, method=method)
+                    if interp is not None:
+                        gd[self.masks[key]] = interp(self.xg[self.masks[key]], self.yg[self.masks[key]])
                 return gd
         else:
             print('Not yet gridded...')
@@ -1331,134 +2743,12 @@ class PTPS(PS):
     """
     def __init__(self, *args, **kwargs):
         self.section_class = PTsection
+        self.grid_order = 'C'
         super(PTPS, self).__init__(*args, **kwargs)
 
-    def calculate_composition(self, nx=50, ny=50):
-        """Method to calculate compositional variations on grid.
-
-        A compositions are calculated for stable assemblages in regular grid
-        covering pT range of pseudosection. A stable assemblage is identified
-        from constructed divariant fields. Results are stored in `grid` property
-        as `GridData` instance. A property `all_data_keys` is updated.
-
-        Before any grid point calculation, ptguesses are updated from nearest
-        invariant point. If calculation fails, nearest solution from univariant
-        line is used to update ptguesses. Finally, if solution is still not found,
-        the method `fix_solutions` is called and neigbouring grid calculations are
-        used to provide ptguess.
-
-        Args:
-            nx (int): Number of grid points along x direction (T)
-            ny (int): Number of grid points along y direction (p)
-        """
-        axr = self.xrange
-        ayr = self.yrange
-        gpleft = 0
-        for ix, ps in self.sections.items():
-            paxr = ps.xrange
-            payr = ps.yrange
-            grid = GridData(ps,
-                            nx=round(nx * (paxr[1] - paxr[0]) / (axr[1] - axr[0])),
-                            ny=round(ny * (payr[1] - payr[0]) / (ayr[1] - ayr[0])))
-            last_inv = 0
-            for (r, c) in tqdm(np.ndindex(grid.xg.shape), desc='Gridding {}/{}'.format(ix + 1, len(self.sections)), total=np.prod(grid.xg.shape)):
-                x, y = grid.xg[r, c], grid.yg[r, c]
-                k = self.identify(x, y)
-                if k is not None:
-                    # update guesses from closest inv point
-                    dst = sys.float_info.max
-                    for id_inv, inv in ps.invpoints.items():
-                        d2 = (inv._x - x)**2 + (inv._y - y)**2
-                        if d2 < dst:
-                            dst = d2
-                            id_close = id_inv
-                    if id_close != last_inv and not ps.invpoints[id_close].manual:
-                        self.tc.update_scriptfile(guesses=ps.invpoints[id_close].ptguess())
-                        last_inv = id_close
-                    grid.status[r, c] = 0
-                    start_time = time.time()
-                    tcout, ans = self.tc.calc_assemblage(k.difference(self.tc.excess), y, x)
-                    delta = time.time() - start_time
-                    status, res, output = self.tc.parse_logfile()
-                    if res is not None:
-                        grid.gridcalcs[r, c] = res[0]
-                        grid.status[r, c] = 1
-                        grid.delta[r, c] = delta
-                    else:
-                        # update guesses from closest uni line point
-                        dst = sys.float_info.max
-                        for id_uni in self.unilists[ix][k]:
-                            uni = ps.unilines[id_uni]
-                            if not uni.manual:
-                                for vix in list(range(len(uni._x))[uni.used]):
-                                    d2 = (uni._x[vix] - x)**2 + (uni._y[vix] - y)**2
-                                    if d2 < dst:
-                                        dst = d2
-                                        id_close = id_uni
-                                        vix_close = vix
-                        self.tc.update_scriptfile(guesses=ps.unilines[id_close].ptguess(idx=vix_close))
-                        start_time = time.time()
-                        tcout, ans = self.tc.calc_assemblage(k.difference(self.tc.excess), y, x)
-                        delta = time.time() - start_time
-                        status, res, output = self.tc.parse_logfile()
-                        if res is not None:
-                            grid.gridcalcs[r, c] = res[0]
-                            grid.status[r, c] = 1
-                            grid.delta[r, c] = delta
-                        else:
-                            grid.gridcalcs[r, c] = None
-                            grid.status[r, c] = 0
-                else:
-                    grid.gridcalcs[r, c] = None
-            print('Grid search done. {} empty points left.'.format(len(np.flatnonzero(grid.status == 0))))
-            gpleft += len(np.flatnonzero(grid.status == 0))
-            self.grids[ix] = grid
-        if gpleft > 0:
-            self.fix_solutions()
-        self.create_masks()
-        # save
-        self.save()
-        # update variable lookup table
-        self.collect_all_data_keys()
-
-    def fix_solutions(self):
-        """Method try to find solution for grid points with failed status.
-
-        Ptguesses are used from successfully calculated neighboring points until
-        solution is find. Otherwise ststus remains failed.
-        """
-        if self.gridded:
-            for ix, grid in self.grids.items():
-                log = []
-                ri, ci = np.nonzero(grid.status == 0)
-                fixed, ftot = 0, len(ri)
-                tq = trange(ftot, desc='Fix ({}/{})'.format(fixed, ftot))
-                for ind in tq:
-                    r, c = ri[ind], ci[ind]
-                    x, y = grid.xg[r, c], grid.yg[r, c]
-                    k = self.identify(x, y)
-                    if k is not None:
-                        # search already done grid neighs
-                        for rn, cn in grid.neighs(r, c):
-                            if grid.status[rn, cn] == 1:
-                                self.tc.update_scriptfile(guesses=grid.gridcalcs[rn, cn].ptguess)
-                                start_time = time.time()
-                                tcout, ans = self.tc.calc_assemblage(k.difference(self.tc.excess), y, x)
-                                delta = time.time() - start_time
-                                status, res, output = self.tc.parse_logfile()
-                                if res is not None:
-                                    grid.gridcalcs[r, c] = res[0]
-                                    grid.status[r, c] = 1
-                                    grid.delta[r, c] = delta
-                                    fixed += 1
-                                    tq.set_description(desc='Fix ({}/{})'.format(fixed, ftot))
-                                    break
-                    if grid.status[r, c] == 0:
-                        log.append('No solution find for {}, {}'.format(x, y))
-                log.append('Fix done. {} empty grid points left.'.format(len(np.flatnonzero(grid.status == 0))))
-                print('\n'.join(log))
-        else:
-            print('Not yet gridded...')
+    def _calc_node(self, tc, phases, x, y):
+        """Axis adaptor. Run THERMOCALC for assemblage at x=T and y=p."""
+        return tc.calc_assemblage(phases, y, x)
 
     def collect_ptpath(self, tpath, ppath, N=100, kind='quadratic'):
         """Method to collect THERMOCALC calculations along defined PT path.
@@ -1502,12 +2792,10 @@ class PTPS(PS):
                                 calc = self.grids[ix].gridcalcs[rn, cn]
                                 break
                     if calc is not None:
-                        self.tc.update_scriptfile(guesses=calc.ptguess)
-                        tcout, ans = self.tc.calc_assemblage(key.difference(self.tc.excess), p, t)
-                        status, res, output = self.tc.parse_logfile()
+                        res, delta = self.calc_node(key, t, p, guesses=calc.ptguess)
                         if res is not None:
                             points.append((t, p))
-                            results.append(res[0])
+                            results.append(res)
                     else:
                         err += 1
             if err > 0:
@@ -1606,139 +2894,13 @@ class TXPS(PS):
     """
     def __init__(self, *args, **kwargs):
         self.section_class = TXsection
+        self.grid_order = 'C'
         super(TXPS, self).__init__(*args, **kwargs)
 
-    def calculate_composition(self, nx=50, ny=50):
-        """Method to calculate compositional variations on grid.
-
-        A compositions are calculated for stable assemblages in regular grid
-        covering pT range of pseudosection. A stable assemblage is identified
-        from constructed divariant fields. Results are stored in `grid` property
-        as `GridData` instance. A property `all_data_keys` is updated.
-
-        Before any grid point calculation, ptguesses are updated from nearest
-        invariant point. If calculation fails, nearest solution from univariant
-        line is used to update ptguesses. Finally, if solution is still not found,
-        the method `fix_solutions` is called and neigbouring grid calculations are
-        used to provide ptguess.
-
-        Args:
-            nx (int): Number of grid points along x direction (T)
-            ny (int): Number of grid points along y direction (p)
-        """
-        axr = self.xrange
-        ayr = self.yrange
-        gpleft = 0
-        for ix, ps in self.sections.items():
-            paxr = ps.xrange
-            payr = ps.yrange
-            grid = GridData(ps,
-                            nx=round(nx * (paxr[1] - paxr[0]) / (axr[1] - axr[0])),
-                            ny=round(ny * (payr[1] - payr[0]) / (ayr[1] - ayr[0])))
-            last_inv = 0
-            with tqdm(desc='Gridding {}/{}'.format(ix + 1, len(self.sections)), total=np.prod(grid.xg.shape)) as pbar:
-                pm = (self.tc.prange[0] + self.tc.prange[1]) / 2
-                for r in range(len(grid.yspace)):
-                    for c in range(len(grid.xspace)):
-                        x, y = grid.xg[r, c], grid.yg[r, c]
-                        k = self.identify(x, y)
-                        if k is not None:
-                            # update guesses from closest inv point
-                            dst = sys.float_info.max
-                            for id_inv, inv in ps.invpoints.items():
-                                d2 = (inv._x - x)**2 + (inv._y - y)**2
-                                if d2 < dst:
-                                    dst = d2
-                                    id_close = id_inv
-                            if id_close != last_inv and not ps.invpoints[id_close].manual:
-                                self.tc.update_scriptfile(guesses=ps.invpoints[id_close].ptguess())
-                                last_inv = id_close
-                            grid.status[r, c] = 0
-                            start_time = time.time()
-                            tcout, ans = self.tc.calc_assemblage(k.difference(self.tc.excess), pm, x, onebulk=y)
-                            delta = time.time() - start_time
-                            status, res, output = self.tc.parse_logfile()
-                            if res is not None:
-                                grid.gridcalcs[r, c] = res[0]
-                                grid.status[r, c] = 1
-                                grid.delta[r, c] = delta
-                            else:
-                                # update guesses from closest uni line point
-                                dst = sys.float_info.max
-                                for id_uni in self.unilists[ix][k]:
-                                    uni = ps.unilines[id_uni]
-                                    if not uni.manual:
-                                        for vix in list(range(len(uni._x))[uni.used]):
-                                            d2 = (uni._x[vix] - x)**2 + (uni._y[vix] - y)**2
-                                            if d2 < dst:
-                                                dst = d2
-                                                id_close = id_uni
-                                                vix_close = vix
-                                self.tc.update_scriptfile(guesses=ps.unilines[id_close].ptguess(idx=vix_close))
-                                start_time = time.time()
-                                tcout, ans = self.tc.calc_assemblage(k.difference(self.tc.excess), pm, x, onebulk=y)
-                                delta = time.time() - start_time
-                                status, res, output = self.tc.parse_logfile()
-                                if res is not None:
-                                    grid.gridcalcs[r, c] = res[0]
-                                    grid.status[r, c] = 1
-                                    grid.delta[r, c] = delta
-                                else:
-                                    grid.gridcalcs[r, c] = None
-                                    grid.status[r, c] = 0
-                        else:
-                            grid.gridcalcs[r, c] = None
-                        pbar.update(1)
-            print('Grid search done. {} empty points left.'.format(len(np.flatnonzero(grid.status == 0))))
-            gpleft += len(np.flatnonzero(grid.status == 0))
-            self.grids[ix] = grid
-        if gpleft > 0:
-            self.fix_solutions()
-        self.create_masks()
-        # update variable lookup table
-        self.collect_all_data_keys()
-        # save
-        self.save()
-
-    def fix_solutions(self):
-        """Method try to find solution for grid points with failed status.
-
-        Ptguesses are used from successfully calculated neighboring points until
-        solution is find. Otherwise ststus remains failed.
-        """
-        if self.gridded:
-            for ix, grid in self.grids.items():
-                log = []
-                ri, ci = np.nonzero(grid.status == 0)
-                fixed, ftot = 0, len(ri)
-                pm = (self.tc.prange[0] + self.tc.prange[1]) / 2
-                tq = trange(ftot, desc='Fix ({}/{})'.format(fixed, ftot))
-                for ind in tq:
-                    r, c = ri[ind], ci[ind]
-                    x, y = grid.xg[r, c], grid.yg[r, c]
-                    k = self.identify(x, y)
-                    if k is not None:
-                        # search already done grid neighs
-                        for rn, cn in grid.neighs(r, c):
-                            if grid.status[rn, cn] == 1:
-                                self.tc.update_scriptfile(guesses=grid.gridcalcs[rn, cn]['ptguess'])
-                                start_time = time.time()
-                                tcout, ans = self.tc.calc_assemblage(k.difference(self.tc.excess), pm, x, onebulk=y)
-                                delta = time.time() - start_time
-                                status, res, output = self.tc.parse_logfile()
-                                if res is not None:
-                                    grid.gridcalcs[r, c] = res[0]
-                                    grid.status[r, c] = 1
-                                    grid.delta[r, c] = delta
-                                    fixed += 1
-                                    tq.set_description(desc='Fix ({}/{})'.format(fixed, ftot))
-                                    break
-                    if grid.status[r, c] == 0:
-                        log.append('No solution find for {}, {}'.format(x, y))
-                log.append('Fix done. {} empty grid points left.'.format(len(np.flatnonzero(grid.status == 0))))
-                print('\n'.join(log))
-        else:
-            print('Not yet gridded...')
+    def _calc_node(self, tc, phases, x, y):
+        """Axis adaptor. Run THERMOCALC for assemblage at x=T and y=X."""
+        pm = (tc.prange[0] + tc.prange[1]) / 2
+        return tc.calc_assemblage(phases, pm, x, onebulk=y)
 
 
 class PXPS(PS):
@@ -1746,138 +2908,13 @@ class PXPS(PS):
     """
     def __init__(self, *args, **kwargs):
         self.section_class = PXsection
+        self.grid_order = 'F'
         super(PXPS, self).__init__(*args, **kwargs)
 
-    def calculate_composition(self, nx=50, ny=50):
-        """Method to calculate compositional variations on grid.
-
-        A compositions are calculated for stable assemblages in regular grid
-        covering pT range of pseudosection. A stable assemblage is identified
-        from constructed divariant fields. Results are stored in `grid` property
-        as `GridData` instance. A property `all_data_keys` is updated.
-
-        Before any grid point calculation, ptguesses are updated from nearest
-        invariant point. If calculation fails, nearest solution from univariant
-        line is used to update ptguesses. Finally, if solution is still not found,
-        the method `fix_solutions` is called and neigbouring grid calculations are
-        used to provide ptguess.
-
-        Args:
-            nx (int): Number of grid points along x direction (T)
-            ny (int): Number of grid points along y direction (p)
-        """
-        axr = self.xrange
-        ayr = self.yrange
-        gpleft = 0
-        for ix, ps in self.sections.items():
-            paxr = ps.xrange
-            payr = ps.yrange
-            grid = GridData(ps,
-                            nx=round(nx * (paxr[1] - paxr[0]) / (axr[1] - axr[0])),
-                            ny=round(ny * (payr[1] - payr[0]) / (ayr[1] - ayr[0])))
-            last_inv = 0
-            with tqdm(desc='Gridding', total=np.prod(grid.xg.shape)) as pbar:
-                tm = (self.tc.trange[0] + self.tc.trange[1]) / 2
-                for c in range(len(grid.xspace)):
-                    for r in range(len(grid.yspace)):
-                        x, y = grid.xg[r, c], grid.yg[r, c]
-                        k = self.identify(x, y)
-                        if k is not None:
-                            # update guesses from closest inv point
-                            dst = sys.float_info.max
-                            for id_inv, inv in ps.invpoints.items():
-                                d2 = (inv._x - x)**2 + (inv._y - y)**2
-                                if d2 < dst:
-                                    dst = d2
-                                    id_close = id_inv
-                            if id_close != last_inv and not ps.invpoints[id_close].manual:
-                                self.tc.update_scriptfile(guesses=ps.invpoints[id_close].ptguess())
-                                last_inv = id_close
-                            grid.status[r, c] = 0
-                            start_time = time.time()
-                            tcout, ans = self.tc.calc_assemblage(k.difference(self.tc.excess), y, tm, onebulk=x)
-                            delta = time.time() - start_time
-                            status, res, output = self.tc.parse_logfile()
-                            if res is not None:
-                                grid.gridcalcs[r, c] = res[0]
-                                grid.status[r, c] = 1
-                                grid.delta[r, c] = delta
-                            else:
-                                # update guesses from closest uni line point
-                                dst = sys.float_info.max
-                                for id_uni in self.unilists[ix][k]:
-                                    uni = ps.unilines[id_uni]
-                                    if not uni.manual:
-                                        for vix in list(range(len(uni._x))[uni.used]):
-                                            d2 = (uni._x[vix] - x)**2 + (uni._y[vix] - y)**2
-                                            if d2 < dst:
-                                                dst = d2
-                                                id_close = id_uni
-                                                vix_close = vix
-                                self.tc.update_scriptfile(guesses=ps.unilines[id_close].ptguess(idx=vix_close))
-                                start_time = time.time()
-                                tcout, ans = self.tc.calc_assemblage(k.difference(self.tc.excess), y, tm, onebulk=x)
-                                delta = time.time() - start_time
-                                status, res, output = self.tc.parse_logfile()
-                                if res is not None:
-                                    grid.gridcalcs[r, c] = res[0]
-                                    grid.status[r, c] = 1
-                                    grid.delta[r, c] = delta
-                                else:
-                                    grid.gridcalcs[r, c] = None
-                                    grid.status[r, c] = 0
-                        else:
-                            grid.gridcalcs[r, c] = None
-                        pbar.update(1)
-            print('Grid search done. {} empty points left.'.format(len(np.flatnonzero(grid.status == 0))))
-            gpleft += len(np.flatnonzero(grid.status == 0))
-            self.grids[ix] = grid
-        if gpleft > 0:
-            self.fix_solutions()
-        self.create_masks()
-        # update variable lookup table
-        self.collect_all_data_keys()
-        # save
-        self.save()
-
-    def fix_solutions(self):
-        """Method try to find solution for grid points with failed status.
-
-        Ptguesses are used from successfully calculated neighboring points until
-        solution is find. Otherwise ststus remains failed.
-        """
-        if self.gridded:
-            for ix, grid in self.grids.items():
-                log = []
-                ri, ci = np.nonzero(grid.status == 0)
-                fixed, ftot = 0, len(ri)
-                tm = (self.tc.trange[0] + self.tc.trange[1]) / 2
-                tq = trange(ftot, desc='Fix ({}/{})'.format(fixed, ftot))
-                for ind in tq:
-                    r, c = ri[ind], ci[ind]
-                    x, y = grid.xg[r, c], grid.yg[r, c]
-                    k = self.identify(x, y)
-                    if k is not None:
-                        # search already done grid neighs
-                        for rn, cn in grid.neighs(r, c):
-                            if grid.status[rn, cn] == 1:
-                                start_time = time.time()
-                                tcout, ans = self.tc.calc_assemblage(k.difference(self.tc.excess), y, tm, onebulk=x)
-                                delta = time.time() - start_time
-                                status, res, output = self.tc.parse_logfile()
-                                if res is not None:
-                                    grid.gridcalcs[r, c] = res[0]
-                                    grid.status[r, c] = 1
-                                    grid.delta[r, c] = delta
-                                    fixed += 1
-                                    tq.set_description(desc='Fix ({}/{})'.format(fixed, ftot))
-                                    break
-                    if grid.status[r, c] == 0:
-                        log.append('No solution find for {}, {}'.format(x, y))
-                log.append('Fix done. {} empty grid points left.'.format(len(np.flatnonzero(grid.status == 0))))
-                print('\n'.join(log))
-        else:
-            print('Not yet gridded...')
+    def _calc_node(self, tc, phases, x, y):
+        """Axis adaptor. Run THERMOCALC for assemblage at x=X and y=p."""
+        tm = (tc.trange[0] + tc.trange[1]) / 2
+        return tc.calc_assemblage(phases, y, tm, onebulk=x)
 
 
 class GridData:
@@ -1916,6 +2953,47 @@ class GridData:
         return tmpl.format(len(self.xspace), len(self.yspace),
                            ok, fail, np.prod(self.xg.shape) - ok - fail)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_columns', None)
+        return state
+
+    def column(self, phase, var):
+        """Return 2D array of variable of phase or end-member. NaN is used
+        where variable is not available. When `var` is None, boolean array of
+        presence of phase is returned. Columns are cached until `invalidate`
+        is called.
+
+        Args:
+            phase (str): Phase or end-member named
+            var (str): Variable name or None
+        """
+        cols = self.__dict__.setdefault('_columns', {})
+        if (phase, var) not in cols:
+            ok = self.status == 1
+            col = np.zeros(self.xg.shape, dtype=bool) if var is None else np.full(self.xg.shape, np.nan)
+            col[ok] = result_column(self.gridcalcs[ok], phase, var)
+            cols[(phase, var)] = col
+        return cols[(phase, var)]
+
+    def invalidate(self):
+        """Remove cached columns. Must be called when calculations changed."""
+        self._columns = {}
+
+    def values(self, phase, expr):
+        """Return 2D array of values of expression for given phase. NaN is
+        used where phase is not present or calculation failed.
+
+        Args:
+            phase (str): Phase or end-member named
+            expr (str): Expression to evaluate
+        """
+        ex = compile_expr(expr)
+        cols = {(ref, var): self.column(phase if ref is None else ref, var) for ref, var in ex.refs}
+        vals = np.array(np.broadcast_to(ex.evaluate(cols), self.xg.shape), dtype=float)
+        vals[~self.column(phase, None)] = np.nan
+        return vals
+
     def get_indexes(self, x, y):
         """Return row and column index tuple of nearest grid point
 
@@ -1932,27 +3010,63 @@ class GridData:
         xmin, xmax, ymin, ymax = self.extent
         return (x >= xmin) & (x < xmax) & (y >= ymin) & (y < ymax)
 
-    def neighs(self, r, c):
+    def neighs(self, r, c, step=1):
         """Returns list of row, column tuples of neighbouring points on grid.
 
         Args:
             r (int): Row index
             c (int): Column index
+            step (int): Distance of neighbours in grid steps. Default 1
         """
-        m = np.array([[(r - 1, c - 1), (r - 1, c), (r - 1, c + 1)],
-                      [(r, c - 1), (None, None), (r, c + 1)],
-                      [(r + 1, c - 1), (r + 1, c), (r + 1, c + 1)]])
-        if r < 1:
+        s = step
+        m = np.array([[(r - s, c - s), (r - s, c), (r - s, c + s)],
+                      [(r, c - s), (None, None), (r, c + s)],
+                      [(r + s, c - s), (r + s, c), (r + s, c + s)]])
+        if r < s:
             m = m[1:, :]
-        if r > len(self.yspace) - 2:
+        if r > len(self.yspace) - 1 - s:
             m = m[:-1, :]
-        if c < 1:
+        if c < s:
             m = m[:, 1:]
-        if c > len(self.xspace) - 2:
+        if c > len(self.xspace) - 1 - s:
             m = m[:, :-1]
         return zip([i for i in m[:, :, 0].flat if i is not None],
                    [i for i in m[:, :, 1].flat if i is not None])
 
+    def levels(self, nodes):
+        """Returns list of (node, step) tuples ordered from coarse to fine.
+
+        Step of the coarsest level is largest power of two not exceeding eighth
+        of grid size. Node belongs to level with the largest step dividing
+        both its row and column index. Order of nodes within level is kept.
+
+        Args:
+            nodes (list): List of (row, column) tuples
+        """
+        top = 1
+        while 16 * top <= max(self.xg.shape):
+            top *= 2
+        levels = OrderedDict()
+        step = top
+        while step >= 1:
+            levels[step] = []
+            step //= 2
+        for r, c in nodes:
+            step = top
+            while r % step or c % step:
+                step //= 2
+            levels[step].append((r, c))
+        return [(node, step) for step, lnodes in levels.items() for node in lnodes]
+
+    @property
+    def pending(self):
+        """Returns 2D boolean array of not yet calculated nodes within
+        divariant fields"""
+        infield = np.zeros(self.xg.shape, dtype=bool)
+        for mask in self.masks.values():
+            infield |= mask
+        return infield & np.isnan(self.status)
+
     @property
     def xstep(self):
         """Returns spacing along temperature axis"""
@@ -1970,6 +3084,566 @@ class GridData:
                 self.yspace[0] - self.ystep / 2, self.yspace[-1] + self.ystep / 2)
 
 
+class PointStore:
+    """Class to store THERMOCALC calculations on scattered points.
+
+    Points are stored in compact arrays with capacity doubling and spatial
+    lookup is provided by KD-tree in axis-ratio-scaled coordinates. KD-tree
+    is rebuilt only after `reindex` additions, newer points are searched
+    by brute force.
+
+    Attributes:
+        ratio (float): y-coordinate multiplier used for spatial lookup
+        x (numpy.array): Array of x coordinates
+        y (numpy.array): Array of y coordinates
+        keys (numpy.array): Array of divariant field keys (None outside of any
+            divariant field)
+        calcs (numpy.array): Array of THERMOCALC Results
+        status (numpy.array): Array indicating status of calculation. The
+            values are 1 - OK, 0 - Failed, NaN - not calculated (outside of any
+            divariant field)
+        delta (numpy.array): Array of time needed for THERMOCALC calculation
+    """
+    reindex = 256
+
+    def __init__(self, ratio=1):
+        self.ratio = ratio
+        self._size = 0
+        self._buffers = dict(x=np.empty(0), y=np.empty(0),
+                             keys=np.empty(0, np.dtype(object)), calcs=np.empty(0, np.dtype(object)),
+                             status=np.empty(0), delta=np.empty(0))
+        self._lookup = {}
+        self._tree = None
+        self._indexed = 0
+
+    def __repr__(self):
+        tmpl = 'Points {} with ok/failed/none solutions {}/{}/{}'
+        ok = len(np.flatnonzero(self.status == 1))
+        fail = len(np.flatnonzero(self.status == 0))
+        return tmpl.format(len(self), ok, fail, len(self) - ok - fail)
+
+    def __len__(self):
+        return self._size
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_buffers'] = {name: buf[:self._size].copy() for name, buf in self._buffers.items()}
+        state['_tree'] = None
+        state['_indexed'] = 0
+        return state
+
+    x = property(lambda self: self._buffers['x'][:self._size])
+    y = property(lambda self: self._buffers['y'][:self._size])
+    keys = property(lambda self: self._buffers['keys'][:self._size])
+    calcs = property(lambda self: self._buffers['calcs'][:self._size])
+    status = property(lambda self: self._buffers['status'][:self._size])
+    delta = property(lambda self: self._buffers['delta'][:self._size])
+
+    def _reserve(self, n):
+        """Ensure capacity of buffers for n more points."""
+        capacity = len(self._buffers['x'])
+        if self._size + n > capacity:
+            capacity = max(self._size + n, 2 * capacity, 16)
+            for name, buf in self._buffers.items():
+                new = np.empty(capacity, buf.dtype)
+                new[:self._size] = buf[:self._size]
+                self._buffers[name] = new
+
+    def add(self, x, y, key, res, delta):
+        """Add point to store and return its index.
+
+        Args:
+            x (float): x-coordinate of point
+            y (float): y-coordinate of point
+            key (frozenset): Key identifying divariant field or None
+            res (TCResult): THERMOCALC result or None when failed
+            delta (float): time needed for calculation
+        """
+        return self.extend([x], [y], [key], [res], [delta])[0]
+
+    def extend(self, x, y, keys, calcs, delta):
+        """Add points to store and return array of their indexes.
+
+        Args:
+            x (numpy.array): x-coordinates of points
+            y (numpy.array): y-coordinates of points
+            keys (list): Keys identifying divariant fields or None
+            calcs (list): THERMOCALC results or None when failed
+            delta (numpy.array): times needed for calculations
+        """
+        n = len(x)
+        self._reserve(n)
+        ind = np.arange(self._size, self._size + n)
+        buf = self._buffers
+        buf['x'][ind] = x
+        buf['y'][ind] = y
+        for i, key, res in zip(ind, keys, calcs):
+            buf['keys'][i] = key
+            buf['calcs'][i] = res
+            buf['status'][i] = np.nan if key is None else 0 if res is None else 1
+        buf['delta'][ind] = delta
+        self._size += n
+        for i in ind:
+            self._lookup[(float(buf['x'][i]), float(buf['y'][i]))] = i
+        return ind
+
+    def index(self, x, y):
+        """Return index of point with given coordinates or None."""
+        return self._lookup.get((float(x), float(y)), None)
+
+    @property
+    def masks(self):
+        """Dictionary associating divariant field key (frozenset) and binary
+        mask of points"""
+        masks = OrderedDict()
+        for key in self.keys:
+            if key is not None and key not in masks:
+                masks[key] = self.keys == key
+        return masks
+
+    def nearest(self, x, y, k=1):
+        """Return distances and indexes of k nearest points.
+
+        Args:
+            x (float or numpy.array): x-coordinate(s) of point(s)
+            y (float or numpy.array): y-coordinate(s) of point(s)
+            k (int): Number of nearest points, at most number of stored
+                points. Default 1
+        """
+        if self._tree is None or self._size - self._indexed > self.reindex:
+            self._tree = cKDTree(np.column_stack((self.x, self.ratio * self.y)))
+            self._indexed = self._size
+        pts = np.column_stack((np.atleast_1d(x), self.ratio * np.atleast_1d(y)))
+        if self._indexed > 0:
+            dist, ind = self._tree.query(pts, k=list(range(1, min(k, self._indexed) + 1)))
+        else:
+            dist, ind = np.empty((len(pts), 0)), np.empty((len(pts), 0), dtype=int)
+        if self._size > self._indexed:
+            tail = np.column_stack((self.x[self._indexed:], self.ratio * self.y[self._indexed:]))
+            dist = np.hstack((dist, np.hypot(pts[:, [0]] - tail[:, 0], pts[:, [1]] - tail[:, 1])))
+            ind = np.hstack((ind, np.broadcast_to(np.arange(self._indexed, self._size), (len(pts), len(tail)))))
+            order = np.argsort(dist, axis=1, kind='stable')[:, :k]
+            dist = np.take_along_axis(dist, order, axis=1)
+            ind = np.take_along_axis(ind, order, axis=1)
+        if k == 1:
+            return dist[:, 0], ind[:, 0]
+        return dist, ind
+
+    def values(self, phase, expr):
+        """Return array of values of expression for given phase. NaN is used
+        where phase is not present or calculation failed.
+
+        Args:
+            phase (str): Phase or end-member named
+            expr (str): Expression to evaluate
+        """
+        vals = np.full(len(self), np.nan)
+        ok = np.flatnonzero(self.status == 1)
+        vals[ok] = compile_expr(expr)(self.calcs[ok], phase)
+        return vals
+
+    def save(self, filename):
+        """Save point store to gzipped pickle file."""
+        with gzip.open(str(filename), 'wb') as stream:
+            pickle.dump(self, stream)
+
+    @classmethod
+    def from_file(cls, filename):
+        """Load point store saved with `save` method."""
+        with gzip.open(str(filename), 'rb') as stream:
+            return pickle.load(stream)
+
+    @classmethod
+    def read_csv(cls, filename):
+        """Return x and y coordinates from first two columns of csv file.
+        Rows which could not be parsed (e.g. header) are skipped."""
+        xy = np.genfromtxt(str(filename), delimiter=',', usecols=(0, 1), ndmin=2)
+        xy = xy[np.all(np.isfinite(xy), axis=1)]
+        return xy[:, 0], xy[:, 1]
+
+    def guesses(self, key, x, y, n=1):
+        """Return ptguesses of up to n nearest solved points from divariant field.
+
+        Args:
+            key (frozenset): Key identifying divariant field
+            x (float): x-coordinate of point
+            y (float): y-coordinate of point
+            n (int): Maximum number of ptguesses. Default 1
+        """
+        guesses = []
+        if len(self) > 0 and n > 0:
+            _, ind = self.nearest(x, y, k=min(len(self), 8 * n))
+            for i in np.atleast_1d(ind[0]):
+                if self.status[i] == 1 and self.keys[i] == key:
+                    guesses.append(self.calcs[i].ptguess)
+                    if len(guesses) == n:
+                        break
+        return guesses
+
+
+class DataCube:
+    """Class to read data cube exported by `PS.export_cube` or by `PS.save_tab`
+    with binary option.
+
+    Values are memory-mapped, so only requested variables are read from disk.
+
+    Attributes:
+        path (Path): Directory of data cube
+        variables (list): List of (phase, variable) tuples
+        sections (list): List of dictionaries with section grid coordinates
+
+    Example:
+        >>> cube = DataCube('avgpelite_cube')
+        >>> xmg = cube.values('g', 'xMgX/(xFeX+xMgX)')
+    """
+    def __init__(self, path):
+        self.path = Path(path)
+        with (self.path / 'index.json').open('r') as f:
+            index = json.load(f)
+        self.name = index['name']
+        self.x_var, self.y_var = index['x_var'], index['y_var']
+        self.variables = [tuple(v) for v in index['variables']]
+        self.sections = index['sections']
+        self._vindex = {v: j for j, v in enumerate(self.variables)}
+        self._cubes = {}
+
+    def __repr__(self):
+        return 'Data cube {} with {} variables in {} section(s)'.format(self.name, len(self.variables), len(self.sections))
+
+    def cube(self, ix=0):
+        """Return memory-mapped array (ny, nx, number of variables) of section."""
+        if ix not in self._cubes:
+            self._cubes[ix] = np.load(str(self.path / self.sections[ix]['cube']), mmap_mode='r')
+        return self._cubes[ix]
+
+    def get(self, phase, var, ix=0):
+        """Return 2D array of variable of phase or end-member.
+
+        Args:
+            phase (str): Phase or end-member named
+            var (str): Variable name
+            ix (int): Index of section. Default 0
+        """
+        j = self._vindex.get((phase, var), None)
+        if j is None:
+            return np.full(self.cube(ix).shape[:2], np.nan)
+        return np.array(self.cube(ix)[:, :, j])
+
+    def values(self, phase, expr, ix=0):
+        """Return 2D array of values of expression for given phase. See
+        `Expression` for syntax.
+
+        Args:
+            phase (str): Phase or end-member named
+            expr (str): Expression to evaluate
+            ix (int): Index of section. Default 0
+        """
+        ex = compile_expr(expr)
+        cols = {(ref, var): self.get(phase if ref is None else ref, var, ix=ix) for ref, var in ex.refs}
+        return np.array(np.broadcast_to(ex.evaluate(cols), self.cube(ix).shape[:2]), dtype=float)
+
+    def masks(self, ix=0):
+        """Return dictionary associating divariant field keys (frozenset) and
+        binary masks of section."""
+        with np.load(str(self.path / self.sections[ix]['masks'])) as data:
+            return OrderedDict((frozenset(name.split()), data[name]) for name in data.files if name != 'status')
+
+    def status(self, ix=0):
+        """Return 2D array of status of grid calculations of section or None
+        when not available."""
+        with np.load(str(self.path / self.sections[ix]['masks'])) as data:
+            if 'status' in data.files:
+                return data['status']
+
+    def grid(self, ix=0):
+        """Return 2D arrays of x and y coordinates of section grid."""
+        return np.meshgrid(self.sections[ix]['xspace'], self.sections[ix]['yspace'])
+
+
+class FieldSamples:
+    """Class to store samples of divariant field from invariant points and
+    univariant lines.
+
+    Attributes:
+        pts (numpy.array): Array of (x, y) coordinates of samples
+        results (numpy.array): Array of THERMOCALC results of samples
+        source (numpy.array): Array of sample sources. 0 - invariant point,
+            1 - univariant line
+    """
+    def __init__(self, pts, results, source):
+        self.pts = np.array(pts, dtype=float).reshape(-1, 2)
+        self.results = np.array(list(results) + [None], dtype=object)[:-1]
+        self.source = np.array(source, dtype=int)
+        self._columns = {}
+
+    def __repr__(self):
+        return 'Samples {} from invariant points and {} from univariant lines'.format(np.sum(self.source == 0),
+                                                                                     np.sum(self.source == 1))
+
+    def __len__(self):
+        return len(self.source)
+
+    def column(self, phase, var):
+        """Return cached array of variable of phase or end-member. See
+        `result_column`."""
+        if (phase, var) not in self._columns:
+            self._columns[(phase, var)] = result_column(self.results, phase, var)
+        return self._columns[(phase, var)]
+
+    def values(self, phase, expr):
+        """Return array of values of expression for given phase. NaN is used
+        where phase is not present."""
+        ex = compile_expr(expr)
+        cols = {(ref, var): self.column(phase if ref is None else ref, var) for ref, var in ex.refs}
+        vals = np.array(np.broadcast_to(ex.evaluate(cols), (len(self),)), dtype=float)
+        vals[~self.column(phase, None)] = np.nan
+        return vals
+
+    def select(self, phase, source):
+        """Return boolean array of samples from source containing phase."""
+        return (self.source == source) & self.column(phase, None)
+
+
+class SeedIndex:
+    """Class to provide ptguesses from nearest calculated points of section.
+
+    KD-tree indexes are built in axis-ratio-scaled coordinates over non-manual
+    invariant points and over used points of non-manual univariant lines
+    grouped by divariant fields.
+
+    Attributes:
+        ratio (float): y-coordinate multiplier used for scaling
+        inv_ids (numpy.array): Array of indexed invariant points ids
+        inv_tree (cKDTree): KD-tree of invariant points or None
+        uni_trees (dict): Dictionary associating divariant field key (frozenset)
+            and tuple of KD-tree of univariant lines points and list of (uni, idx)
+            references to calculated results.
+    """
+    def __init__(self, ps, unilists):
+        self.ratio = ps.ratio
+        self.ps = ps
+        invs = [inv for inv in ps.invpoints.values() if not inv.manual]
+        self.inv_ids = np.array([inv.id for inv in invs], dtype=int)
+        if invs:
+            self.inv_tree = cKDTree([(inv._x, self.ratio * inv._y) for inv in invs])
+        else:
+            self.inv_tree = None
+        self.uni_trees = {}
+        for key, unilist in unilists.items():
+            pts, refs = [], []
+            for id_uni in unilist:
+                uni = ps.unilines[id_uni]
+                if not uni.manual:
+                    for vix in range(len(uni._x))[uni.used]:
+                        pts.append((uni._x[vix], self.ratio * uni._y[vix]))
+                        refs.append((uni, vix))
+            if pts:
+                self.uni_trees[key] = (cKDTree(pts), refs)
+
+    def nearest_inv(self, x, y):
+        """Return ids of nearest invariant points.
+
+        Args:
+            x (numpy.array): x-coordinates of points
+            y (numpy.array): y-coordinates of points
+
+        Returns:
+            list: ids of nearest invariant points or None when no invariant
+            points are available
+        """
+        x, y = np.atleast_1d(x), np.atleast_1d(y)
+        if self.inv_tree is None:
+            return [None] * len(x)
+        _, ind = self.inv_tree.query(np.column_stack((x, self.ratio * y)))
+        return self.inv_ids[ind].tolist()
+
+    def inv_guess(self, id_inv):
+        """Return ptguess of invariant point."""
+        return self.ps.invpoints[id_inv].ptguess()
+
+    def uni_guess(self, key, x, y):
+        """Return ptguess of nearest point on univariant lines surrounding
+        divariant field or None.
+
+        Args:
+            key (frozenset): Key identifying divariant field
+            x (float): x-coordinate of point
+            y (float): y-coordinate of point
+        """
+        if key in self.uni_trees:
+            tree, refs = self.uni_trees[key]
+            _, ind = tree.query((x, self.ratio * y))
+            uni, vix = refs[ind]
+            return uni.ptguess(idx=vix)
+
+
+def contour_lines(x, y, z, level):
+    """Return list of vertex arrays of contour lines of level. Contours are
+    generated without figure using contourpy when available.
+
+    Args:
+        x (numpy.array): 2D array of x coordinates
+        y (numpy.array): 2D array of y coordinates
+        z (numpy.array): 2D array of values
+        level (float): Contour level
+    """
+    if contour_generator is not None:
+        return contour_generator(x, y, z).lines(level)
+    else:
+        from matplotlib.figure import Figure
+        return Figure().add_subplot().contour(x, y, z, [level]).allsegs[0]
+
+
+def _fit_interpolant(args):
+    """Fit `Interpolant` from tuple of arguments. Used by process pool."""
+    pts, data, ratio, bounds, step, rbf_func, smooth, method, neighbors = args
+    return Interpolant(pts, data, ratio, bounds, step, rbf_func=rbf_func, smooth=smooth,
+                       method=method, neighbors=neighbors)
+
+
+class Interpolant:
+    """Class to interpolate values within divariant field.
+
+    All methods work in axis-ratio-scaled coordinates. Available methods are:
+
+    - 'rbf' Global thin-plate (or other) radial basis function interpolation.
+      When it fails, data are linearly interpolated on regular grid covering
+      field bounds and radial basis function is fitted to the result. It
+      builds dense system, so it is slow for thousands of samples.
+    - 'local' Thin-plate spline radial basis function using only `neighbors`
+      nearest samples for every evaluated point (scipy RBFInterpolator,
+      requires scipy>=1.7).
+    - 'linear' Linear interpolation on Delaunay triangulation.
+    - 'cubic' Clough-Tocher interpolation on Delaunay triangulation.
+
+    Delaunay based methods use nearest sample outside of convex hull of data.
+    When chosen method fails, nearest neighbour interpolation is used.
+
+    Attributes:
+        method (str): Used method. 'rbf', 'gridded rbf', 'local', 'linear',
+            'cubic' or 'nearest'
+        zmin (float): Minimum of interpolated data
+        zmax (float): Maximum of interpolated data
+    """
+    def __init__(self, pts, data, ratio, bounds, step, rbf_func='thin_plate', smooth=0, method='rbf', neighbors=50):
+        assert method in ['rbf', 'local', 'linear', 'cubic'], 'Method must be rbf, local, linear or cubic.'
+        assert method != 'local' or RBFInterpolator is not None, 'Local method needs scipy>=1.7 (scipy.interpolate.RBFInterpolator).'
+        x, y = np.array(pts, dtype=float).T
+        data = np.asarray(data, dtype=float)
+        self.ratio = ratio
+        self.zmin, self.zmax = np.nanmin(data), np.nanmax(data)
+        if method != 'rbf':
+            self._fit_local(x, y, data, method, neighbors, smooth)
+            return
+        try:
+            # Firstly try Rbf Use scaling
+            with warnings.catch_warnings():
+                warnings.filterwarnings("error")
+                self.rbf = Rbf(x, ratio * y, data, function=rbf_func, smooth=smooth)
+                self.method = 'rbf'
+        except Exception:
+            try:
+                # preprocess with griddata linear on regular grid covering field
+                tmin, pmin, tmax, pmax = bounds
+                tg, pg = np.meshgrid(np.arange(tmin - step[0], tmax + step[0], step[0]),
+                                     np.arange(pmin - step[1], pmax + step[1], step[1]))
+                zg = griddata(np.column_stack((x, y)), data, (tg, pg), method='linear', rescale=True)
+                # locate valid data
+                valid = np.isfinite(zg)
+                # do Rbf extrapolation
+                with warnings.catch_warnings():
+                    warnings.filterwarnings("ignore", category=LinAlgWarning)
+                    self.rbf = Rbf(tg[valid], ratio * pg[valid], zg[valid], function=rbf_func, smooth=smooth)
+                    self.method = 'gridded rbf'
+            except Exception:
+                self.pts, self.data = np.column_stack((x, y)), data
+                self.method = 'nearest'
+
+    def _fit_local(self, x, y, data, method, neighbors, smooth):
+        xy = np.column_stack((x, self.ratio * y))
+        self.nearest = NearestNDInterpolator(xy, data)
+        try:
+            if method == 'local':
+                self.interp = RBFInterpolator(xy, data, neighbors=min(neighbors, len(data)),
+                                              kernel='thin_plate_spline', smoothing=smooth)
+            elif method == 'linear':
+                self.interp = LinearNDInterpolator(xy, data)
+            else:
+                self.interp = CloughTocher2DInterpolator(xy, data)
+            self.method = method
+        except Exception:
+            self.pts, self.data = np.column_stack((x, y)), data
+            self.method = 'nearest'
+
+    def __repr__(self):
+        return 'Interpolant {} of values {:g} - {:g}'.format(self.method, self.zmin, self.zmax)
+
+    def __call__(self, x, y):
+        """Return interpolated values in points with coordinates x and y."""
+        if self.method == 'nearest':
+            return griddata(self.pts, self.data, (x, y), method='nearest', rescale=True)
+        elif self.method in ['rbf', 'gridded rbf']:
+            return self.rbf(x, self.ratio * np.asarray(y))
+        else:
+            x, y = np.broadcast_arrays(np.asarray(x, dtype=float), self.ratio * np.asarray(y, dtype=float))
+            xy = np.column_stack((x.ravel(), y.ravel()))
+            z = self.interp(xy)
+            if self.method != 'local':
+                outside = np.isnan(z)
+                z[outside] = self.nearest(xy[outside])
+            return z.reshape(x.shape)
+
+
+class FieldCache:
+    """LRU cache of data derived from divariant fields, e.g. fitted
+    interpolants or isolines. First item of key is divariant field key.
+
+    Attributes:
+        maxsize (int): Maximum number of stored interpolants
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self._cache = OrderedDict()
+
+    def __repr__(self):
+        return 'Cache of {} items (max {})'.format(len(self), self.maxsize)
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __contains__(self, key):
+        return key in self._cache
+
+    def __getitem__(self, key):
+        self._cache.move_to_end(key)
+        return self._cache[key]
+
+    def __setitem__(self, key, interp):
+        self._cache[key] = interp
+        self._cache.move_to_end(key)
+        while len(self._cache) > self.maxsize:
+            self._cache.popitem(last=False)
+
+    def invalidate(self, field=None):
+        """Remove cached items of divariant field or all when field is None."""
+        if field is None:
+            self._cache.clear()
+        else:
+            for key in [key for key in self._cache if key[0] == field]:
+                del self._cache[key]
+
+    def save(self, filename):
+        """Save cache to gzipped pickle file."""
+        with gzip.open(str(filename), 'wb') as stream:
+            pickle.dump(self._cache, stream)
+
+    def load(self, filename):
+        """Update cache from file saved with `save` method."""
+        with gzip.open(str(filename), 'rb') as stream:
+            for key, interp in pickle.load(stream).items():
+                self[key] = interp
+
+
 class PTpath:
     """Class to store THERMOCALC calculations along PT paths.
 
@@ -1983,8 +3657,142 @@ class PTpath:
         self.results = results
 
     def get_path_data(self, phase, expr):
-        ex = np.array([eval_expr(expr, res[phase]) if phase in res.phases else np.nan for res in self.results])
-        return ex
+        return compile_expr(expr)(self.results, phase)
+
+
+class Expression:
+    """Class to evaluate expression on columns of THERMOCALC results.
+
+    Expression is parsed and compiled only once and is evaluated on arrays of
+    variables. Names refer to variables of evaluated phase. Variables of other
+    phases or end-members are referenced as `phase.variable` or
+    `phase(endmember).variable`, e.g. `g(alm).activity/g(py).activity`.
+    Functions log, log10, exp, sqrt, abs, min and max could be used.
+
+    Attributes:
+        expr (str): Expression
+        refs (list): List of (phase, variable) tuples used in expression. Phase
+            is None for variables of evaluated phase.
+
+    Example:
+        >>> ex = Expression('xMgX/(xFeX+xMgX)')
+        >>> ex([inv.results[0] for inv in ps.invpoints.values()], 'g')
+        array([0.12584216, ...])
+    """
+    ops = {ast.Add: np.add, ast.Sub: np.subtract,
+           ast.Mult: np.multiply, ast.Div: np.divide,
+           ast.Pow: np.power, ast.USub: np.negative, ast.UAdd: np.positive}
+    functions = {'log': np.log, 'log10': np.log10, 'exp': np.exp,
+                 'sqrt': np.sqrt, 'abs': np.abs,
+                 'min': lambda *args: functools.reduce(np.minimum, args),
+                 'max': lambda *args: functools.reduce(np.maximum, args)}
+
+    def __init__(self, expr):
+        self.expr = expr
+        self.refs = []
+        self._func = self._compile(ast.parse(expr, mode='eval').body)
+
+    def __repr__(self):
+        return 'Expression {}'.format(self.expr)
+
+    def _ref(self, phase, var):
+        if (phase, var) not in self.refs:
+            self.refs.append((phase, var))
+        return lambda cols: cols[(phase, var)]
+
+    def _compile(self, node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):  # number
+            return lambda cols: node.value
+        elif isinstance(node, ast.Name):  # variable
+            return self._ref(None, node.id)
+        elif isinstance(node, ast.Attribute):  # phase.variable or phase(em).variable
+            if isinstance(node.value, ast.Name):
+                return self._ref(node.value.id, node.attr)
+            elif (isinstance(node.value, ast.Call) and isinstance(node.value.func, ast.Name)
+                  and len(node.value.args) == 1 and isinstance(node.value.args[0], ast.Name)):
+                return self._ref('{}({})'.format(node.value.func.id, node.value.args[0].id), node.attr)
+        elif isinstance(node, ast.BinOp) and type(node.op) in self.ops:  # <left> <operator> <right>
+            op, left, right = self.ops[type(node.op)], self._compile(node.left), self._compile(node.right)
+            return lambda cols: op(left(cols), right(cols))
+        elif isinstance(node, ast.UnaryOp) and type(node.op) in self.ops:  # <operator> <operand> e.g., -1
+            op, operand = self.ops[type(node.op)], self._compile(node.operand)
+            return lambda cols: op(operand(cols))
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in self.functions:
+            func, args = self.functions[node.func.id], [self._compile(arg) for arg in node.args]
+            return lambda cols: func(*[arg(cols) for arg in args])
+        raise TypeError('Unsupported expression {}'.format(ast.dump(node)))
+
+    def unknown(self, phase, datakeys):
+        """Return list of names used in expression not available in datakeys.
+
+        Args:
+            phase (str): Evaluated phase or end-member
+            datakeys (dict): Dictionary of available variables. See
+                `PS.all_data_keys`
+        """
+        unknown = []
+        for ref, var in self.refs:
+            name = phase if ref is None else ref
+            if var not in datakeys.get(name, []):
+                unknown.append(var if ref is None else '{}.{}'.format(ref, var))
+        return unknown
+
+    def evaluate(self, cols):
+        """Evaluate expression on dictionary of variables.
+
+        Args:
+            cols (dict): Dictionary with (phase, variable) keys and values (scalars
+                or arrays). Phase is None for variables of evaluated phase.
+
+        Raises:
+            ValueError: When variable used in expression is not in cols.
+        """
+        missing = [var if ref is None else '{}.{}'.format(ref, var) for ref, var in self.refs if (ref, var) not in cols]
+        if missing:
+            raise ValueError('Unknown variables {} in expression {}'.format(' '.join(missing), self.expr))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return self._func(cols)
+
+    def __call__(self, results, phase):
+        """Evaluate expression on THERMOCALC results.
+
+        Args:
+            results (list): List or array of THERMOCALC results
+            phase (str): Phase or end-member named
+
+        Returns:
+            numpy.array: Values of expression. NaN is used where phase or
+            referenced variable is not available.
+        """
+        n = len(results)
+        present = result_column(results, phase, None)
+        cols = {(ref, var): result_column(results, phase if ref is None else ref, var) for ref, var in self.refs}
+        vals = np.array(np.broadcast_to(self.evaluate(cols), (n,)), dtype=float)
+        vals[~present] = np.nan
+        return vals
+
+
+def result_column(results, phase, var):
+    """Return array of variable of phase or end-member from THERMOCALC
+    results. NaN is used where variable is not available. When `var` is None,
+    boolean array of presence of phase is returned.
+
+    Args:
+        results (list): List or array of THERMOCALC results
+        phase (str): Phase or end-member named
+        var (str): Variable name or None
+    """
+    if var is None:
+        return np.array([phase in res.data for res in results], dtype=bool)
+    else:
+        return np.array([res.data[phase].get(var, np.nan) if phase in res.data else np.nan
+                         for res in results], dtype=float)
+
+
+@functools.lru_cache(maxsize=128)
+def compile_expr(expr):
+    """Return compiled `Expression`. Compiled expressions are cached."""
+    return Expression(expr)
 
 
 def eval_expr(expr, dt):
@@ -1997,6 +3805,9 @@ def eval_expr(expr, dt):
     Returns:
         float: value evaluated from epxression
 
+    Raises:
+        ValueError: When expression uses variable not available in dt.
+
     Example:
         >>> ps = pt.sections[0]
         >>> eval_expr('mode', ps.invpoints[5].results['g'])
@@ -2004,21 +3815,8 @@ def eval_expr(expr, dt):
         >>> eval_expr('xMgX/(xFeX+xMgX)', ps.invpoints[5].results['g'])
         0.12584215591915301
     """
-    def eval_(node):
-        if isinstance(node, ast.Num):  # number
-            return node.n
-        if isinstance(node, ast.Name):  # variable
-            return dt[node.id]
-        elif isinstance(node, ast.BinOp):  # <left> <operator> <right>
-            return ops[type(node.op)](eval_(node.left), eval_(node.right))
-        elif isinstance(node, ast.UnaryOp):  # <operator> <operand> e.g., -1
-            return ops[type(node.op)](eval_(node.operand))
-        else:
-            raise TypeError(node)
-    ops = {ast.Add: np.add, ast.Sub: np.subtract,
-           ast.Mult: np.multiply, ast.Div: np.divide,
-           ast.Pow: np.power}
-    return eval_(ast.parse(expr, mode='eval').body)
+    ex = compile_expr(expr)
+    return ex.evaluate({(ref, var): dt[var] for ref, var in ex.refs if ref is None and var in dt})
 
 
 explorers = {'.ptb': PTPS,
@@ -2068,6 +3866,28 @@ def ps_grid():
                         help='number of T steps')
     parser.add_argument('--ny', type=int, default=50,
                         help='number of P steps')
+    parser.add_argument('--traversal', choices=['raster', 'wavefront', 'progressive'], default='raster',
+                        help='order of grid calculation')
+    parser.add_argument('--budget', type=float, default=None,
+                        help='maximum gridding time in seconds')
+    parser.add_argument('--maxnodes', type=int, default=None,
+                        help='maximum number of calculated points')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='number of concurrent THERMOCALC runs to fix failed or calculate given points')
+    parser.add_argument('--resume', action='store_true',
+                        help='continue from last checkpoint')
+    parser.add_argument('--retry', action='store_true',
+                        help='recalculate failed points when resuming')
+    parser.add_argument('--checkpoint', type=int, default=500,
+                        help='number of points between checkpoints')
+    parser.add_argument('--incremental', action='store_true',
+                        help='recalculate only points where field changed')
+    parser.add_argument('--fields', action='append', default=None,
+                        help='calculate only field defined by set of phases')
+    parser.add_argument('--phases', nargs='+', default=None,
+                        help='calculate only fields where all phases are present')
+    parser.add_argument('--points', type=str, default=None,
+                        help='csv file with x, y coordinates of points to calculate')
     parser.add_argument('--origwd', action='store_true',
                         help='use stored original working directory')
     parser.add_argument('--tolerance', type=float, default=None,
@@ -2076,7 +3896,18 @@ def ps_grid():
     PSOK = explorers.get(Path(args.project[0]).suffix, None)
     if PSOK is not None:
         ps = PSOK(*args.project, tolerance=args.tolerance, origwd=args.origwd)
-        sys.exit(ps.calculate_composition(nx=args.nx, ny=args.ny))
+        if args.points is not None:
+            store = ps.calculate_points(*PointStore.read_csv(args.points), workers=args.workers)
+            ptsfile = Path(args.points).with_suffix('.pts')
+            store.save(ptsfile)
+            print('{} saved to {}'.format(store, ptsfile))
+            sys.exit()
+        sys.exit(ps.calculate_composition(nx=args.nx, ny=args.ny, traversal=args.traversal,
+                                          resume=args.resume, retry=args.retry,
+                                          checkpoint=args.checkpoint, incremental=args.incremental,
+                                          fields=args.fields, phases=args.phases,
+                                          budget=args.budget, maxnodes=args.maxnodes,
+                                          workers=args.workers))
     else:
         print('Project file not recognized...')
         sys.exit(1)
@@ -2087,7 +3918,11 @@ def ps_iso():
     parser.add_argument('project', type=str, nargs='+',
                         help='builder project file(s)')
     parser.add_argument('phase', type=str,
-                        help='phase used for contouring')
+                        help='phase used for contouring or batch file with --batch')
+    parser.add_argument('--batch', action='store_true',
+                        help='phase argument is text file with phase and expression on each line, figures are saved')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of processes used in batch mode')
     parser.add_argument('-e', '--expr', type=str, default=None,
                         help='expression evaluated to calculate values')
     parser.add_argument('-f', '--filled', action='store_true',
@@ -2110,6 +3945,10 @@ def ps_iso():
                         default=None, help='name of the colormap')
     parser.add_argument('--smooth', type=float,
                         default=0, help='smoothness of the approximation')
+    parser.add_argument('--method', choices=['rbf', 'local', 'linear', 'cubic'],
+                        default='rbf', help='interpolation method')
+    parser.add_argument('--neighbors', type=int,
+                        default=50, help='number of neighbours for local method')
     parser.add_argument('--labelkey', action='append',
                         default=[], help='label contours in field defined by set of phases')
     parser.add_argument('--high', action='append',
@@ -2120,11 +3959,86 @@ def ps_iso():
     PSOK = explorers.get(Path(args.project[0]).suffix, None)
     if PSOK is not None:
         ps = PSOK(*args.project, tolerance=args.tolerance, origwd=args.origwd)
+        if args.batch:
+            comps = []
+            with open(args.phase) as f:
+                for ln in f:
+                    items = ln.split('#')[0].split(maxsplit=1)
+                    if items:
+                        comps.append((items[0], items[1].strip() if len(items) > 1 else None))
+            comps = [(phase, expr) for phase, expr in comps if ps.check_phase_expr(phase, expr)]
+            interps = ps.fit_interpolants(comps, smooth=args.smooth, method=args.method,
+                                          neighbors=args.neighbors, workers=args.workers)
+            for phase, expr in comps:
+                filename = '{}_{}.png'.format(ps.name, re.sub(r'[^\w()\-]+', '_', '{}_{}'.format(phase, expr)))
+                ps.isopleths(phase, expr=expr, filled=args.filled,
+                             smooth=args.smooth, step=args.step, bulk=args.bulk,
+                             N=args.ncont, labelkeys=args.labelkey,
+                             nosplit=args.nosplit, colors=args.colors,
+                             cmap=args.cmap, out=args.out, high=args.high,
+                             interpolants={key: interps[(key, phase, expr)] for key in ps},
+                             filename=filename)
+                print('{}({}) saved to {}'.format(phase, expr, filename))
+            sys.exit()
         sys.exit(ps.isopleths(args.phase, expr=args.expr, filled=args.filled,
                               smooth=args.smooth, step=args.step, bulk=args.bulk,
                               N=args.ncont, labelkeys=args.labelkey,
                               nosplit=args.nosplit, colors=args.colors,
-                              cmap=args.cmap, out=args.out, high=args.high))
+                              cmap=args.cmap, out=args.out, high=args.high,
+                              method=args.method, neighbors=args.neighbors))
+    else:
+        print('Project file not recognized...')
+        sys.exit(1)
+
+
+def ps_query():
+    parser = argparse.ArgumentParser(description='Evaluate expression in points from csv file')
+    parser.add_argument('project', type=str, nargs='+',
+                        help='builder project file(s)')
+    parser.add_argument('phase', type=str,
+                        help='phase used for evaluation')
+    parser.add_argument('-e', '--expr', type=str, default=None,
+                        help='expression evaluated to calculate values')
+    parser.add_argument('-i', '--input', type=argparse.FileType('r'), default=sys.stdin,
+                        help='csv file with x, y coordinates (default stdin)')
+    parser.add_argument('-o', '--output', type=argparse.FileType('w'), default=sys.stdout,
+                        help='output csv file with x, y and values (default stdout)')
+    parser.add_argument('--chunk', type=int, default=10000,
+                        help='number of points evaluated at once')
+    parser.add_argument('--smooth', type=float,
+                        default=0, help='smoothness of the approximation')
+    parser.add_argument('--method', choices=['rbf', 'local', 'linear', 'cubic'],
+                        default='rbf', help='interpolation method')
+    parser.add_argument('--neighbors', type=int,
+                        default=50, help='number of neighbours for local method')
+    parser.add_argument('--origwd', action='store_true',
+                        help='use stored original working directory')
+    parser.add_argument('--tolerance', type=float, default=None,
+                        help='tolerance to simplify univariant lines')
+    args = parser.parse_args()
+    PSOK = explorers.get(Path(args.project[0]).suffix, None)
+    if PSOK is not None:
+        # messages go to stderr, so values could be written to stdout
+        with redirect_stdout(sys.stderr):
+            ps = PSOK(*args.project, tolerance=args.tolerance, origwd=args.origwd)
+            if not ps.check_phase_expr(args.phase, args.expr):
+                sys.exit(1)
+            args.output.write('{},{},{}({})\n'.format(ps.x_var, ps.y_var, args.phase, args.expr))
+            buffer = []
+            for ln in itertools.chain(args.input, [None]):
+                if ln is not None:
+                    try:
+                        xv, yv = (float(v) for v in ln.split(',')[:2])
+                        buffer.append((xv, yv))
+                    except ValueError:
+                        # skip header and unparsable rows
+                        continue
+                if buffer and (ln is None or len(buffer) == args.chunk):
+                    xy = np.array(buffer, ndmin=2)
+                    vals = ps.query(args.phase, args.expr, xy[:, 0], xy[:, 1], smooth=args.smooth,
+                                    method=args.method, neighbors=args.neighbors)
+                    np.savetxt(args.output, np.column_stack((xy, vals)), delimiter=',', fmt='%.10g')
+                    buffer = []
     else:
         print('Project file not recognized...')
         sys.exit(1)
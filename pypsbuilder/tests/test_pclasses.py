@@ -1,3 +1,5 @@
+import pickle
+
 import pytest
 from pypsbuilder import TCAPI, InvPoint, UniLine, PTsection
 
@@ -223,6 +225,23 @@ def test_getiduni():
         assert key == id_found, 'Error chcecking existing uni id'
 
 
+def test_getid_pickled():
+    ps = pickle.loads(pickle.dumps(pytest.ps))
+    for key, inv in pytest.ps.invpoints.items():
+        assert ps.getidinv(inv) == (False, key), 'Error in invariant points lookup after unpickling'
+    for key, uni in pytest.ps.unilines.items():
+        assert ps.getiduni(uni) == (False, key), 'Error in univariant lines lookup after unpickling'
+
+
+def test_remove_uni():
+    ps = pickle.loads(pickle.dumps(pytest.ps))
+    uni = ps.unilines[3]
+    ps.remove_uni(3)
+    assert ps.getiduni(uni) == (True, 3), 'Error in univariant lines lookup after removal'
+    ps.add_uni(3, uni)
+    assert ps.getiduni(uni) == (False, 3), 'Error in univariant lines lookup after adding'
+
+
 def test_auto_connect():
     for uni in pytest.ps.unilines.values():
         candidates = [inv for inv in pytest.ps.invpoints.values() if uni.contains_inv(inv)]
@@ -240,6 +259,32 @@ def test_remaining_uni():
         assert n == 2, 'Error in detection of remaining univariant lines'
 
 
+def test_find_intersections():
+    candidates = pytest.ps.find_intersections()
+    assert len(candidates) == 1, 'Wrong number of intersections found'
+    c = candidates[0]
+    inv = pytest.ps.invpoints[2]
+    assert c['id'] == 2, 'Wrong invariant point found by intersection'
+    assert set(c['unilines']) == {1, 3}, 'Wrong univariant lines intersecting'
+    assert abs(c['x'] - inv.x[0]) < 0.01 and abs(c['y'] - inv.y[0]) < 0.01, 'Wrong intersection coordinates'
+
+
+def test_inv_connections():
+    for key, inv in pytest.ps.invpoints.items():
+        conn = pytest.ps.inv_connections(key)
+        connected = [id for id in conn.values() if id is not None]
+        assert len(conn) == 4, 'Wrong number of expected univariant lines'
+        assert len(connected) == 2, 'Error in connectivity of invariant points'
+        assert not pytest.ps.inv_connected(key), 'Error in connectivity of invariant points'
+    ps = pickle.loads(pickle.dumps(pytest.ps))
+    ps.remove_uni(1)
+    assert 1 not in ps.inv_connections(1).values(), 'Connectivity not updated after removal'
+    assert 1 not in ps.inv_connections(2).values(), 'Connectivity not updated after removal'
+    ps.unilines[2].end = 0
+    ps.trim_uni(2)
+    assert 2 not in ps.inv_connections(3).values(), 'Connectivity not updated after trimming'
+
+
 def test_trim_uni():
     uni = pytest.ps.unilines[1]
     assert uni.used == slice(0, 33), 'Wrong used slice before trimming uni 1'
@@ -257,6 +302,25 @@ def test_trim_uni():
     assert uni.used == slice(10, 31), 'Wrong used slice after trimming uni 3'
 
 
+def test_trim_all():
+    used = {key: uni.used for key, uni in pytest.ps.unilines.items()}
+    pytest.ps.trim_all()
+    for key, uni in pytest.ps.unilines.items():
+        assert uni.used == used[key], 'Wrong used slice after trimming all unilines'
+
+
+def test_trim_all_single_vertex():
+    ps = pickle.loads(pickle.dumps(pytest.ps))
+    used = {key: uni.used for key, uni in ps.unilines.items()}
+    # line with single vertex trimmed before all others
+    uni = ps.unilines[1]
+    uni._x, uni._y = uni._x[:1], uni._y[:1]
+    ps.trim_all()
+    assert uni.used == slice(0, 1), 'Wrong used slice of single vertex uniline'
+    for key in [2, 3]:
+        assert ps.unilines[key].used == used[key], 'Wrong used slice after trimming with single vertex uniline'
+
+
 def test_create_shapes():
     shapes, shape_edges, log = pytest.ps.create_shapes()
     akey = frozenset({'pa', 'ep', 'g', 'q', 'bi', 'mu', 'H2O', 'sph'})
@@ -0,0 +1,662 @@
+import gzip
+import json
+import pickle
+import warnings
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import matplotlib.pyplot as plt
+import pytest
+from shapely.geometry import Point, box
+
+from pypsbuilder import TCAPI, InvPoint, UniLine, PTsection, PTPS, TXPS, PXPS
+from pypsbuilder import psexplorer
+from pypsbuilder.psclasses import TCResult
+from pypsbuilder.psexplorer import GridData, PointStore, SeedIndex, FieldCache, Interpolant, DataCube, Expression, compile_expr, eval_expr
+
+# two divariant fields split at 550 degC, garnet is present only in first one
+gkey = frozenset({'bi', 'mu', 'H2O', 'ep', 'q', 'g', 'sph', 'pa'})
+ckey = frozenset({'bi', 'mu', 'H2O', 'ep', 'q', 'chl', 'sph', 'pa'})
+
+
+def parse_output(tc, name):
+    with (tc.workdir / '{}-log.txt'.format(name)).open('r', encoding=tc.TCenc) as f:
+        output = f.read()
+    with (tc.workdir / '{}-ic.txt'.format(name)).open('r', encoding=tc.TCenc) as f:
+        resic = f.read()
+    status, res, output = tc.parse_logfile_new(output=output, resic=resic)
+    return res, output
+
+
+def ptguess(x, y):
+    """Fake ptguess remembering where it was calculated"""
+    return ['ptguess {:.6f} {:.6f}'.format(x, y)]
+
+
+class FakeTC:
+    """THERMOCALC replacement for PT explorer. Calculation succeeds only when
+    ptguess comes from point not farther than reach (in axis-ratio-scaled
+    coordinates). Garnet mode of results is T/1000 and garnet x is p/100."""
+    excess = set()
+    trange = (400., 700.)
+    prange = (7., 16.)
+
+    def __init__(self, template, reach=np.inf, ratio=1):
+        self.template = template
+        self.reach = reach
+        self.ratio = ratio
+        self.guesses = None
+        self.calls = []
+        self.cancelled = False
+        self.OK = True
+
+    def clone(self, workdir):
+        return FakeTC(self.template, reach=self.reach, ratio=self.ratio)
+
+    def terminate(self):
+        self.cancelled = True
+
+    def update_scriptfile(self, guesses=None, **kwargs):
+        if guesses is not None:
+            self.guesses = guesses
+
+    def calc_assemblage(self, phases, p, t, onebulk=None):
+        self.calls.append((frozenset(phases), p, t, onebulk, self.guesses))
+        return '', []
+
+    def parse_logfile(self, **kwargs):
+        phases, p, t, onebulk, guesses = self.calls[-1]
+        if np.isfinite(self.reach):
+            if guesses is None:
+                return 'bombed', None, ''
+            gx, gy = map(float, guesses[0].split()[1:])
+            if (gx - t)**2 + (self.ratio * (gy - p))**2 > self.reach**2:
+                return 'bombed', None, ''
+        data = {comp: dict(vals) for comp, vals in self.template.items()
+                if comp.split('(')[0] in phases or comp in ['bulk', 'sys']}
+        if 'g' in data:
+            data['g']['mode'] = t / 1000
+            data['g']['x'] = p / 100
+        return 'ok', [TCResult(t, p, data=data, ptguess=ptguess(t, p))], ''
+
+
+def build_section():
+    """Return PT section with fake ptguesses of invariant points and univariant lines"""
+    tc = TCAPI('./examples/outputs')
+    ps = PTsection(trange=(400., 700.), prange=(7., 16.))
+    P = {'bi', 'mu', 'chl', 'H2O', 'ep', 'q', 'g', 'sph', 'pa'}
+    for id, (name, phases, out) in enumerate([('inv1', P, {'ep', 'chl'}),
+                                              ('inv2', P | {'ab'}, {'ab', 'chl'}),
+                                              ('inv3', P - {'chl'} | {'ab'}, {'ab', 'ep'})], 1):
+        res, output = parse_output(tc, name)
+        res[0].ptguess = ptguess(res[0].T, res[0].p)
+        ps.add_inv(id, InvPoint(phases=phases, out=out, variance=res.variance,
+                                x=res.x, y=res.y, results=res, output=output))
+    for id, (name, phases, out, begin, end) in enumerate([('uni1', P, {'chl'}, 2, 1),
+                                                          ('uni2', P - {'chl'}, {'ep'}, 1, 3),
+                                                          ('uni3', P - {'chl'} | {'ab'}, {'ab'}, 2, 3)], 1):
+        res, output = parse_output(tc, name)
+        for r in res.results:
+            r.ptguess = ptguess(r.T, r.p)
+        ps.add_uni(id, UniLine(phases=phases, out=out, variance=res.variance, x=res.x, y=res.y,
+                               begin=begin, end=end, results=res, output=output))
+    ps.trim_all()
+    return ps
+
+
+@pytest.fixture
+def section():
+    return build_section()
+
+
+@pytest.fixture
+def template():
+    res, output = parse_output(TCAPI('./examples/outputs'), 'inv1')
+    return res[0].data
+
+
+def make_explorer(cls, path, ps, tc):
+    """Return explorer of section with fields gkey and ckey and project file
+    saved in path. THERMOCALC is replaced by tc."""
+    projfile = path / 'test.ptb'
+    with gzip.open(str(projfile), 'wb') as stream:
+        pickle.dump(dict(section=ps), stream)
+    ex = cls.__new__(cls)
+    ex.section_class = type(ps)
+    ex.grid_order = 'F' if cls is PXPS else 'C'
+    ex.projfiles = {0: projfile}
+    ex.sections = {0: ps}
+    ex.grids, ex.stale_grids, ex.pointstores = {}, {}, {}
+    ex._shapes = {0: {gkey: box(400, 7, 550, 16), ckey: box(550, 7, 700, 16)}}
+    ex.unilists = {0: {gkey: [1, 2], ckey: [2, 3]}}
+    ex.seeds = {0: SeedIndex(ps, ex.unilists[0])}
+    ex._variance = {0: {gkey: 4, ckey: 4}}
+    ex.tc_calls, ex.tc_failed = 0, 0
+    ex._checkpoint = None
+    ex.interpolants, ex.isolines = FieldCache(), FieldCache()
+    ex.tolerance = None
+    ex.tc = tc
+    ex.union_shapes()
+    ex.build_sample_index()
+    ex.collect_all_data_keys()
+    return ex
+
+
+@pytest.fixture
+def explorer(tmp_path, section, template):
+    """PT explorer gridded 30x18 with THERMOCALC always succeeding"""
+    pt = make_explorer(PTPS, tmp_path, section, FakeTC(template))
+    pt.calculate_composition(nx=30, ny=18)
+    return pt
+
+
+def test_axis_adaptors(tmp_path, section, template):
+    expected = {PTPS: (10., 450., None), TXPS: (11.5, 450., 10.), PXPS: (10., 550., 450.)}
+    for cls, (p, t, onebulk) in expected.items():
+        tc = FakeTC(template)
+        ex = make_explorer(cls, tmp_path, section, tc)
+        res, delta = ex.calc_node(gkey, 450., 10., guesses=ptguess(450., 10.))
+        assert tc.calls[-1][:4] == (gkey, p, t, onebulk), 'Wrong axis mapping of {}'.format(cls.__name__)
+        assert res is not None and delta >= 0, 'Calculation failed'
+        assert ex.tc_calls == 1 and ex.tc_failed == 0, 'Wrong THERMOCALC runs counters'
+
+
+def test_grid_order(tmp_path, section, template):
+    for cls in [PTPS, PXPS]:
+        tc = FakeTC(template)
+        ex = make_explorer(cls, tmp_path, section, tc)
+        ex.calculate_composition(nx=6, ny=4)
+        p, t, onebulk = np.array([call[1:4] for call in tc.calls], dtype=float).T
+        if cls is PTPS:
+            assert np.all(p[:6] == p[0]) and np.all(np.diff(t[:6]) > 0), 'PTPS grid is calculated by rows'
+        else:
+            assert np.all(onebulk[:4] == onebulk[0]) and np.all(np.diff(p[:4]) > 0), 'PXPS grid is calculated by columns'
+
+
+def test_calculate_composition(explorer):
+    grid = explorer.grids[0]
+    assert grid.status.shape == (18, 30), 'Wrong grid shape'
+    assert np.all(grid.status == 1), 'All nodes should be calculated'
+    assert explorer.tc_calls == 540 and explorer.tc_failed == 0, 'Wrong THERMOCALC runs counters'
+    gmask = grid.xg < 550
+    assert np.array_equal(grid.masks[gkey], gmask) and np.array_equal(grid.masks[ckey], ~gmask), 'Wrong grid masks'
+    assert np.allclose(grid.values('g', 'mode')[gmask], grid.xg[gmask] / 1000), 'Wrong grid values'
+    assert np.all(np.isnan(grid.values('g', 'mode')[~gmask])), 'Garnet should be missing'
+    assert 'g' in explorer.all_data_keys and 'chl' in explorer.all_data_keys, 'Data keys not updated'
+    with gzip.open(str(explorer.projfiles[0]), 'rb') as stream:
+        data = pickle.load(stream)
+    assert np.array_equal(data['grid'].status, grid.status), 'Grid not saved to project'
+    assert not explorer.checkpoint_file(0).exists(), 'Checkpoint of finished gridding not removed'
+
+
+@pytest.mark.parametrize('workers', [1, 3])
+def test_fix_solutions(tmp_path, section, template, workers):
+    tc = FakeTC(template, reach=25, ratio=section.ratio)
+    ex = make_explorer(PTPS, tmp_path, section, tc)
+    grid = GridData(section, nx=30, ny=18)
+    failed = ex.grid_nodes(0, grid, list(np.ndindex(grid.xg.shape)))
+    assert failed == np.sum(grid.status == 0) > 0, 'Wrong number of failed nodes'
+    ex.grids = {0: grid}
+    ex.fix_solutions(workers=workers)
+    assert np.sum(grid.status == 0) < failed / 10, 'Failed nodes not fixed from neighbours'
+    for r, c in zip(*np.nonzero(grid.status == 1)):
+        assert grid.gridcalcs[r, c].ptguess == ptguess(grid.xg[r, c], grid.yg[r, c]), 'Wrong result stored'
+
+
+def test_seed_index(section):
+    seeds = SeedIndex(section, {gkey: [1, 2], ckey: [3]})
+    rng = np.random.default_rng(0)
+    x, y = rng.uniform(400, 700, 50), rng.uniform(7, 16, 50)
+    invs = list(section.invpoints.values())
+    for xp, yp, id_inv in zip(x, y, seeds.nearest_inv(x, y)):
+        dst = [(inv._x - xp)**2 + (section.ratio * (inv._y - yp))**2 for inv in invs]
+        assert id_inv == invs[np.argmin(dst)].id, 'Wrong nearest invariant point'
+        for key, ids in [(gkey, [1, 2]), (ckey, [3])]:
+            vx = np.hstack([section.unilines[id]._x[section.unilines[id].used] for id in ids])
+            vy = np.hstack([section.unilines[id]._y[section.unilines[id].used] for id in ids])
+            ix = np.argmin((vx - xp)**2 + (section.ratio * (vy - yp))**2)
+            assert seeds.uni_guess(key, xp, yp) == ptguess(vx[ix], vy[ix]), 'Wrong nearest univariant line point'
+    assert seeds.uni_guess(frozenset({'q'}), 500, 10) is None, 'Field without lines should not provide guess'
+    section.invpoints[1].manual = True
+    assert 1 not in SeedIndex(section, {}).nearest_inv(x, y), 'Manual invariant points should not be used'
+
+
+def test_grid_seeding(tmp_path, section, template):
+    tc = FakeTC(template, reach=40, ratio=section.ratio)
+    ex = make_explorer(PTPS, tmp_path, section, tc)
+    grid = GridData(section, nx=30, ny=18)
+    ex.grid_nodes(0, grid, [(10, 13)])
+    assert tc.calls[0][4] == section.invpoints[1].ptguess(), 'Node not seeded from nearest invariant point'
+    assert grid.status[10, 13] == 1, 'Node near invariant point not calculated'
+    # too far from invariant point, but close to univariant line
+    ex.grid_nodes(0, grid, [(2, 11)])
+    assert tc.calls[1][4] == section.invpoints[2].ptguess(), 'Node not seeded from nearest invariant point'
+    assert len(tc.calls) == 3, 'Node not recalculated with univariant line seed'
+    assert grid.status[2, 11] == 1, 'Node near univariant line not calculated'
+
+
+def test_wavefront(tmp_path, section, template):
+    stats = {}
+    for traversal in ['raster', 'wavefront']:
+        tc = FakeTC(template, reach=25, ratio=section.ratio)
+        ex = make_explorer(PTPS, tmp_path, section, tc)
+        grid = GridData(section, nx=30, ny=18)
+        nodes = list(np.ndindex(grid.xg.shape))
+        if traversal == 'wavefront':
+            failed = ex.grid_wavefront(0, grid, nodes)
+        else:
+            failed = ex.grid_nodes(0, grid, nodes)
+        assert failed == np.sum(grid.status == 0), 'Wrong number of failed nodes'
+        stats[traversal] = failed, ex.tc_calls
+    assert stats['wavefront'][0] < stats['raster'][0] / 10, 'Wavefront should propagate guesses'
+    assert stats['wavefront'][1] < stats['raster'][1], 'Wavefront should need less THERMOCALC runs'
+
+
+def test_wavefront_attempts(tmp_path, section, template):
+    tc = FakeTC(template, reach=1, ratio=section.ratio)
+    ex = make_explorer(PTPS, tmp_path, section, tc)
+    grid = GridData(section, nx=10, ny=6)
+    failed = ex.grid_wavefront(0, grid, list(np.ndindex(grid.xg.shape)), attempts=2)
+    assert failed == 60, 'All nodes should fail'
+    calls = {}
+    for phases, p, t, onebulk, guesses in tc.calls:
+        calls.setdefault((p, t), []).append(guesses)
+    assert len(calls) == 60 and all(len(g) <= 2 for g in calls.values()), 'Wrong number of attempts'
+    assert all(len(set(map(tuple, g))) == len(g) for g in calls.values()), 'Same guess used twice'
+
+
+def test_checkpoint_roundtrip(explorer):
+    grid = explorer.grids[0]
+    done = np.zeros(grid.xg.shape, dtype=bool)
+    done[::2] = True
+    explorer.save_checkpoint(0, grid, done)
+    grid2, done2 = explorer.load_checkpoint(0)
+    assert np.array_equal(done, done2), 'Wrong processed nodes'
+    assert np.array_equal(grid.status, grid2.status), 'Wrong grid status'
+    assert np.allclose(grid2.values('g', 'mode'), grid.values('g', 'mode'), equal_nan=True), 'Wrong grid results'
+    explorer.checkpoint_file(0).unlink()
+    assert explorer.load_checkpoint(0) == (None, None)
+
+
+def test_resume(tmp_path, section, template):
+    class CrashingTC(FakeTC):
+        def calc_assemblage(self, phases, p, t, onebulk=None):
+            if len(self.calls) == 200:
+                raise RuntimeError('THERMOCALC killed')
+            return super().calc_assemblage(phases, p, t, onebulk=onebulk)
+
+    ex = make_explorer(PTPS, tmp_path, section, CrashingTC(template))
+    with pytest.raises(RuntimeError):
+        ex.calculate_composition(nx=30, ny=18, checkpoint=50)
+    grid, done = ex.load_checkpoint(0)
+    assert np.sum(done) == 200 and np.sum(grid.status == 1) == 200, 'Checkpoint not saved'
+    ex.tc = FakeTC(template)
+    ex.calculate_composition(resume=True)
+    assert len(ex.tc.calls) == 340, 'Already calculated nodes should be skipped'
+    assert np.all(ex.grids[0].status == 1), 'Gridding not finished'
+    assert not ex.checkpoint_file(0).exists(), 'Checkpoint of finished gridding not removed'
+
+
+def test_incremental(explorer):
+    grid = explorer.grids[0]
+    calcs = grid.gridcalcs.copy()
+    explorer._shapes[0] = {gkey: box(400, 7, 600, 16), ckey: box(600, 7, 700, 16)}
+    explorer.union_shapes()
+    explorer.tc.calls.clear()
+    explorer.calculate_composition(incremental=True)
+    moved = (grid.xg >= 550) & (grid.xg < 600)
+    assert len(explorer.tc.calls) == np.sum(moved), 'Only nodes in changed field should be calculated'
+    grid = explorer.grids[0]
+    assert np.all(grid.status == 1), 'Gridding not finished'
+    assert np.array_equal(grid.masks[gkey], grid.xg < 600), 'Wrong grid masks'
+    assert all(grid.gridcalcs[node] is calcs[node] for node in zip(*np.nonzero(~moved))), 'Unchanged results not kept'
+    assert np.allclose(grid.values('g', 'mode')[moved], grid.xg[moved] / 1000), 'Wrong recalculated values'
+
+
+def test_point_store(template):
+    rng = np.random.default_rng(7)
+    store = PointStore(ratio=20)
+    store.reindex = 5
+    for i in range(60):
+        x, y = rng.uniform(400, 700), rng.uniform(7, 16)
+        key = gkey if x < 550 else ckey
+        res = None if i % 10 == 0 else TCResult(x, y, data=template)
+        assert store.add(x, y, key, res, 0.1) == i, 'Wrong index of added point'
+        qx, qy = rng.uniform(400, 700, 3), rng.uniform(7, 16, 3)
+        k = min(len(store), 4)
+        dist, ind = store.nearest(qx, qy, k=k)
+        brute = np.hypot(qx[:, np.newaxis] - store.x, 20 * (qy[:, np.newaxis] - store.y))
+        assert np.allclose(dist, np.sort(brute, axis=1)[:, :k].squeeze()), 'Wrong nearest distances'
+        assert np.allclose(np.take_along_axis(brute, np.atleast_2d(ind.T).T, axis=1), np.atleast_2d(dist.T).T), 'Wrong nearest indexes'
+    ind = store.extend([400.5, 699.5], [8., 15.], [gkey, None], [TCResult(400.5, 8., data=template), None], [0.2, np.nan])
+    assert list(ind) == [60, 61] and len(store) == 62, 'Wrong indexes of extended points'
+    assert store.index(400.5, 8.) == 60 and store.index(401, 8) is None, 'Wrong point lookup'
+    assert np.isnan(store.status[61]) and np.sum(store.status == 0) == 6, 'Wrong status of points'
+    masks = store.masks
+    assert set(masks) == {gkey, ckey} and np.sum(masks[gkey]) + np.sum(masks[ckey]) == 61, 'Wrong masks'
+    assert np.array_equal(np.isfinite(store.values('bi', 'mode')), store.status == 1), 'Wrong values'
+    clone = pickle.loads(pickle.dumps(store))
+    assert len(clone) == 62 and np.array_equal(clone.x, store.x) and list(clone.keys) == list(store.keys), 'Pickle round trip failed'
+    assert np.array_equal(clone.nearest(550, 10, k=3)[1], store.nearest(550, 10, k=3)[1]), 'Wrong nearest after pickle round trip'
+    clone.add(550, 10, gkey, None, np.nan)
+    assert clone.nearest(550, 10)[1][0] == 62 and len(store) == 62, 'Wrong point added to unpickled store'
+
+
+def test_calculate_adaptive(tmp_path, section, template):
+    ex = make_explorer(PTPS, tmp_path, section, FakeTC(template))
+    ex.calculate_adaptive(nx=5, ny=3, maxnodes=60, criteria=[('g', 'mode')], tolerance=0.1)
+    store = ex.pointstores[0]
+    assert 24 < len(store) <= 60, 'Node budget not respected'
+    assert not np.any(store.status == 0), 'No calculation should fail'
+    refined = store.x[24:]
+    assert np.all((refined >= 520) & (refined <= 580)), 'Only cells on field boundary should be refined'
+    assert not ex.gridded and ex.has_results, 'Adaptive gridding should provide results'
+    gd = ex.get_gridded('g', 'mode', which=4)
+    ok = ex.masks[gkey]
+    assert np.all(np.isfinite(gd[ok])) and np.allclose(gd[ok], ex.xg[ok] / 1000, atol=0.01), 'Wrong gridded values from point store'
+
+
+def test_targeted_gridding(tmp_path, section, template):
+    ex = make_explorer(PTPS, tmp_path, section, FakeTC(template))
+    ex.calculate_composition(nx=30, ny=18, phases=['g'])
+    grid = ex.grids[0]
+    gmask = grid.xg < 550
+    assert len(ex.tc.calls) == np.sum(gmask) == 270, 'Only nodes with garnet should be calculated'
+    assert np.all(grid.status[gmask] == 1) and np.all(np.isnan(grid.status[~gmask])), 'Wrong grid status'
+    calcs = grid.gridcalcs.copy()
+    ex.calculate_composition(fields=['bi mu H2O ep q chl sph pa'])
+    grid = ex.grids[0]
+    assert len(ex.tc.calls) == 540, 'Only nodes within chlorite field should be calculated'
+    assert np.all(grid.status == 1), 'Results not merged into grid'
+    assert all(grid.gridcalcs[node] is calcs[node] for node in zip(*np.nonzero(gmask))), 'Previous results not kept'
+
+
+def test_calculate_points(tmp_path, section, template):
+    rng = np.random.default_rng(3)
+    x, y = rng.uniform(400, 700, 40), rng.uniform(7, 16, 40)
+    x[5], y[5] = x[2], y[2]
+    x[7] = 350
+    stores = []
+    for workers in [1, 3]:
+        (tmp_path / str(workers)).mkdir()
+        ex = make_explorer(PTPS, tmp_path / str(workers), section, FakeTC(template))
+        stores.append(ex.calculate_points(x, y, workers=workers))
+    serial, parallel = stores
+    assert np.array_equal(serial.x, x) and np.array_equal(serial.y, y), 'Points not in original order'
+    assert list(serial.keys) == [ex.identify(xx, yy) for xx, yy in zip(x, y)], 'Wrong keys of points'
+    assert np.isnan(serial.status[7]) and np.sum(serial.status == 1) == 39, 'Wrong status of points'
+    assert serial.calcs[5] is serial.calcs[2], 'Duplicate point should be calculated once'
+    assert list(parallel.keys) == list(serial.keys), 'Concurrent calculation gives different keys'
+    ok = serial.status == 1
+    assert np.allclose(parallel.values('bi', 'mode')[ok], serial.values('bi', 'mode')[ok]), 'Concurrent calculation gives different results'
+    store = ex.pointstores[0]
+    assert len(store) == 38, 'Points not registered in project'
+    gdata = ex.collect_grid_data(gkey, 'g', 'mode')
+    assert len(gdata['pts']) == np.sum(x[ok] < 550) and np.allclose(gdata['data'], np.array(gdata['pts'])[:, 0] / 1000), 'Points not used for grid data'
+    with gzip.open(str(ex.projfiles[0]), 'rb') as stream:
+        data = pickle.load(stream)
+    assert len(data['points']) == 38, 'Points not saved to project'
+    ex.tc.calls.clear()
+    ex.calculate_points(x[:10], y[:10])
+    assert not ex.tc.calls and len(store) == 38, 'Stored points should not be calculated again'
+
+
+def test_progressive_budget(tmp_path, section, template, monkeypatch):
+    ex = make_explorer(PTPS, tmp_path, section, FakeTC(template))
+    ex.calculate_composition(nx=30, ny=18, traversal='progressive', maxnodes=100)
+    grid = ex.grids[0]
+    solved = np.nonzero(grid.status == 1)
+    assert len(ex.tc.calls) == len(solved[0]) == 100, 'Node budget not respected'
+    assert np.all(solved[0] % 2 == 0) and np.all(solved[1] % 2 == 0), 'Coarse level should be calculated first'
+    assert ex.checkpoint_file(0).exists(), 'Checkpoint of partial grid not kept'
+    assert ex.has_results and np.sum(grid.pending) == 440, 'Wrong pending nodes'
+    shown = []
+    plt.switch_backend('Agg')
+    monkeypatch.setattr(plt, 'show', lambda: shown.append(plt.gca().images[0].get_array()))
+    ex.show_grid('g', 'mode')
+    assert shown and np.all(np.isfinite(shown[0][grid.masks[gkey]])), 'Pending nodes not filled from nearest ones'
+    plt.close('all')
+    ex.calculate_composition(traversal='progressive', resume=True)
+    assert len(ex.tc.calls) == 540 and np.all(ex.grids[0].status == 1), 'Resumed gridding not finished'
+    assert not ex.checkpoint_file(0).exists(), 'Checkpoint of finished gridding not removed'
+
+
+def test_rank_guesses(explorer):
+    grid = explorer.grids[0]
+    r, c = 9, np.flatnonzero(grid.xspace < 550)[-1]
+    grid.status[r, c] = 0
+    guesses = explorer.rank_guesses(0, grid, r, c, gkey)
+    same = [grid.gridcalcs[n].ptguess for n in [(r - 1, c), (r, c - 1), (r + 1, c)]]
+    assert sorted(guesses[:3]) == sorted(same), 'Nearest nodes of same field should be first'
+    assert guesses[3] == grid.gridcalcs[r, c + 1].ptguess, 'Nearest node of similar field should follow'
+    assert len(guesses) == len(set(map(tuple, guesses))) == 24 + 2, 'Wrong number of ptguesses'
+    seeds = explorer.seeds[0]
+    x, y = grid.xg[r, c], grid.yg[r, c]
+    assert guesses[-2:] == [seeds.uni_guess(gkey, x, y), seeds.inv_guess(seeds.nearest_inv(x, y)[0])], 'Seeds should be last'
+
+
+def test_calc_first(tmp_path, section, template):
+    ex = make_explorer(PTPS, tmp_path, section, FakeTC(template))
+    tcs = [FakeTC(template, reach=5) for i in range(3)]
+    bad = [ptguess(600, 15), ptguess(650, 8), ptguess(420, 10)]
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        res, delta = ex.calc_first(gkey, 500, 10, bad + [ptguess(502, 10)], tcs, pool)
+        assert res is not None and res.ptguess == ptguess(500, 10) and np.isfinite(delta), 'Solution not found'
+        assert tcs[0].calls[-1][-1] == ptguess(502, 10), 'Second batch not calculated'
+        assert sum(len(tc.calls) for tc in tcs) == 4, 'Wrong number of calculations'
+        res, delta = ex.calc_first(gkey, 500, 10, bad, tcs, pool)
+        assert res is None and np.isnan(delta), 'Failed calculation should return None'
+
+
+def test_expression_matches_python(template):
+    dt = template['g']
+    ns = {'sqrt': np.sqrt, 'abs': abs, 'max': max, 'log': np.log}
+    for expr in ['mode', 'xMgX/(xFeX+xMgX)', '-mode*2+1', '2.5e-1*x', 'sqrt(abs(x))', 'max(x, z)', 'log(mode)**2']:
+        assert eval_expr(expr, dt) == pytest.approx(eval(expr, ns, dict(dt))), 'Wrong value of {}'.format(expr)
+
+
+def test_expression_on_results(template):
+    res = TCResult(500., 10., data=template)
+    vals = compile_expr('g(alm).activity/mode')([res, res], 'g')
+    assert vals == pytest.approx(2 * [template['g(alm)']['activity'] / template['g']['mode']])
+    assert np.isnan(compile_expr('mode')([res], 'xx')).all(), 'Missing phase should give NaN'
+
+
+def test_expression_errors(template):
+    with pytest.raises(ValueError, match='foo'):
+        eval_expr('mode/foo', template['g'])
+    with pytest.raises(TypeError):
+        Expression('mode*"2"')
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        assert Expression('2*mode+1').refs == [(None, 'mode')], 'Wrong references of expression'
+
+
+def test_field_cache_eviction():
+    cache = FieldCache(maxsize=2)
+    cache[('a', 1)] = 1
+    cache[('b', 1)] = 2
+    cache[('a', 1)]
+    cache[('c', 1)] = 3
+    assert ('b', 1) not in cache, 'Least recently used item should be evicted'
+    assert ('a', 1) in cache and ('c', 1) in cache
+    cache.invalidate('a')
+    assert len(cache) == 1, 'Items of field should be removed'
+
+
+def test_field_cache_save_load(tmp_path):
+    cache = FieldCache()
+    cache[('a', 1)] = [1, 2]
+    cache.save(tmp_path / 'cache')
+    other = FieldCache()
+    other.load(tmp_path / 'cache')
+    assert other[('a', 1)] == [1, 2]
+
+
+def test_field_version(explorer):
+    grid = explorer.grids[0]
+    gver, cver = explorer.field_version(gkey), explorer.field_version(ckey)
+    interp = explorer.interpolant(gkey, 'g', 'mode', which=4, method='linear')
+    assert explorer.interpolant(gkey, 'g', 'mode', which=4, method='linear') is interp, 'Interpolant not cached'
+    grid.status[0, -1] = 0
+    assert explorer.field_version(gkey) == gver, 'Version changed by other field'
+    assert explorer.field_version(ckey) != cver, 'Version not changed'
+    grid.status[0, 0] = 0
+    assert explorer.field_version(gkey) != gver, 'Version not changed'
+    assert explorer.interpolant(gkey, 'g', 'mode', which=4, method='linear') is not interp, 'Stale interpolant used'
+
+
+@pytest.mark.parametrize('method', ['rbf', 'local', 'linear', 'cubic'])
+def test_interpolant(method):
+    rng = np.random.default_rng(11)
+    x, y = rng.uniform(400, 550, 200), rng.uniform(7, 16, 200)
+    interp = Interpolant(np.column_stack((x, y)), x / 1000 + y / 100, 20, (400, 7, 550, 16), (5, 0.3), method=method)
+    assert interp.method == method, 'Method {} not used'.format(method)
+    xi, yi = np.meshgrid(np.linspace(420, 530, 12), np.linspace(8, 15, 8))
+    assert np.allclose(interp(xi, yi), xi / 1000 + yi / 100, atol=1e-3), 'Linear data not reproduced'
+    assert np.all(np.isfinite(interp(np.array([300., 600.]), np.array([10., 20.])))), 'No values outside of samples'
+
+
+def test_interpolant_local_missing(monkeypatch):
+    monkeypatch.setattr(psexplorer, 'RBFInterpolator', None)
+    with pytest.raises(AssertionError, match='scipy'):
+        Interpolant([(0, 0), (1, 0), (0, 1)], [1, 2, 3], 1, (0, 0, 1, 1), (0.1, 0.1), method='local')
+
+
+def test_isopleths_batch(explorer):
+    explorer.interpolants = FieldCache(maxsize=2)
+    comps = [('g', 'mode'), ('bi', 'mode'), ('xx', 'mode')]
+    gds = explorer.isopleths_batch(comps, which=4, method='linear', workers=1)
+    assert list(gds) == comps[:2], 'Invalid expressions should be skipped'
+    assert explorer.interpolants.maxsize == 2, 'Cache size should not change'
+    for (phase, expr), gd in gds.items():
+        ref = explorer.get_gridded(phase, expr, which=4, method='linear')
+        assert np.allclose(gd, ref, equal_nan=True), 'Wrong batch values of {}'.format(phase)
+    assert np.all(np.isnan(gds[('g', 'mode')][explorer.masks[ckey]])), 'Garnet should be missing'
+
+
+def test_fit_interpolants(explorer):
+    comps = [('g', 'mode'), ('bi', 'mode')]
+    interps = explorer.fit_interpolants(comps, which=4, rbf_func='linear', workers=1)
+    assert interps[(ckey, 'g', 'mode')] is None, 'No interpolant without data'
+    interp = interps[(gkey, 'g', 'mode')]
+    assert interp.rbf.function == 'linear', 'Radial basis function not used'
+    assert explorer.interpolant(gkey, 'g', 'mode', which=4, rbf_func='linear') is interp, 'Fitted interpolant not cached'
+    fresh = explorer.interpolant(gkey, 'bi', 'mode', which=4, rbf_func='cubic')
+    assert fresh.rbf.function == 'cubic' and fresh is not interps[(gkey, 'bi', 'mode')]
+    explorer.interpolants.invalidate()
+    serial = explorer.interpolant(ckey, 'bi', 'mode', which=4, rbf_func='linear')
+    x, y = np.linspace(560, 690, 10), np.linspace(8, 15, 10)
+    assert np.allclose(serial(x, y), interps[(ckey, 'bi', 'mode')](x, y)), 'Batch and serial interpolants differ'
+
+
+def test_isopleths_with_interpolants(explorer, tmp_path, monkeypatch):
+    interps = explorer.fit_interpolants([('g', 'mode')], which=4, method='linear', workers=1)
+
+    def refit(*args, **kwargs):
+        raise AssertionError('Interpolant fitted again')
+
+    monkeypatch.setattr(explorer, 'interpolant', refit)
+    plt.switch_backend('Agg')
+    filename = tmp_path / 'g.png'
+    explorer.isopleths('g', 'mode', interpolants={key: interps[(key, 'g', 'mode')] for key in explorer},
+                       filename=str(filename))
+    assert filename.exists(), 'Figure not saved'
+    plt.close('all')
+
+
+def test_isopleth_lines(explorer, tmp_path):
+    lines = explorer.isopleth_lines('g', 'mode', levels=[0.45, 0.5], which=4, method='linear')
+    assert list(lines) == [0.45, 0.5] and list(lines[0.5]) == [gkey], 'Isolines should be only in garnet field'
+    xmin, ymin, xmax, ymax = lines[0.5][gkey].bounds
+    assert xmin == pytest.approx(500, abs=explorer.gridxstep) and xmax == pytest.approx(500, abs=explorer.gridxstep), 'Wrong position of isoline'
+    assert ymin >= 7 and ymax <= 16 and ymax - ymin > 8, 'Isoline not clipped to field'
+    isolines = explorer.field_isolines(gkey, 'g', 'mode', [0.45, 0.5], which=4, method='linear')
+    assert isolines[0.5] is lines[0.5][gkey] and len(explorer.isolines) == 1, 'Isolines not cached'
+    explorer.export_isopleth_lines(tmp_path / 'g.json', 'g', 'mode', levels=[0.45, 0.5], which=4, method='linear')
+    with (tmp_path / 'g.json').open() as f:
+        features = json.load(f)['features']
+    assert [ft['properties']['level'] for ft in features] == [0.45, 0.5], 'Wrong exported features'
+    assert features[0]['properties']['field'] == ' '.join(sorted(gkey)) and features[0]['geometry']['type'] in ['LineString', 'MultiLineString']
+
+
+def test_grid_columns(explorer, monkeypatch):
+    grid = explorer.grids[0]
+    for phase, expr in [('g', 'mode'), ('g', 'xMgX/(xFeX+xMgX)'), ('bi', '2*mode+x'), ('chl', 'x')]:
+        vals = grid.values(phase, expr)
+        ref = np.full(grid.xg.shape, np.nan)
+        for r, c in np.ndindex(grid.xg.shape):
+            data = grid.gridcalcs[r, c].data
+            if phase in data:
+                ref[r, c] = eval_expr(expr, data[phase])
+        assert np.allclose(vals, ref, equal_nan=True), 'Wrong values of {}({})'.format(phase, expr)
+        for key in [gkey, ckey]:
+            d = explorer.collect_grid_data(key, phase, expr)
+            sel = grid.masks[key] & grid.column(phase, None)
+            assert d['pts'] == list(zip(grid.xg[sel], grid.yg[sel])) and np.allclose(d['data'], ref[sel], equal_nan=True)
+    col = grid.column('g', 'mode')
+    assert grid.column('g', 'mode') is col, 'Column not cached'
+    grid.invalidate()
+    assert grid.column('g', 'mode') is not col, 'Column cache not invalidated'
+    shown = []
+    plt.switch_backend('Agg')
+    monkeypatch.setattr(plt, 'show', lambda: shown.append(plt.gca().images[0].get_array()))
+    explorer.show_grid('g', 'mode')
+    assert np.allclose(shown[0], grid.values('g', 'mode'), equal_nan=True), 'Wrong values shown'
+    plt.close('all')
+
+
+def test_sample_index(explorer, section):
+    for key in [gkey, ckey]:
+        shape = explorer.shapes[key]
+        smp = explorer.samples[key]
+        assert len(smp) > 0 and all(shape.intersects(Point(x, y)) for x, y in smp.pts), 'Samples outside of field'
+        invs, unis = [], []
+        for id_inv in explorer.invs_from_unilist(0, explorer.unilists[0][key]):
+            inv = section.invpoints[id_inv]
+            if shape.intersects(Point(inv._x, inv._y)):
+                invs.append(((inv._x, inv._y), inv.results[0]))
+        for id_uni in explorer.unilists[0][key]:
+            uni = section.unilines[id_uni]
+            for x, y, res in zip(uni._x[uni.used], uni._y[uni.used], uni.results[uni.used]):
+                if shape.intersects(Point(x, y)):
+                    unis.append(((x, y), res))
+        for phase, expr in [('g', 'xMgX/(xFeX+xMgX)'), ('bi', '2*mode+x')]:
+            for d, ref in [(explorer.collect_inv_data(key, phase, expr), invs), (explorer.collect_uni_data(key, phase, expr), unis)]:
+                ref = [(pt, eval_expr(expr, res.data[phase])) for pt, res in ref if phase in res.data]
+                assert d['pts'] == [pt for pt, _ in ref], 'Wrong samples of {} in {}'.format(phase, ' '.join(sorted(key)))
+                assert np.allclose(d['data'], [val for _, val in ref]), 'Wrong values of {} in {}'.format(phase, ' '.join(sorted(key)))
+
+
+def test_data_cube(explorer, tmp_path):
+    grid = explorer.grids[0]
+    explorer.export_cube(tmp_path / 'cube')
+    cube = DataCube(tmp_path / 'cube')
+    assert ('g', 'mode') in cube.variables
+    assert np.allclose(cube.get('g', 'mode'), grid.column('g', 'mode'), equal_nan=True)
+    assert np.allclose(cube.values('g', 'xMgX/(xFeX+xMgX)'), grid.values('g', 'xMgX/(xFeX+xMgX)'), equal_nan=True)
+    assert np.array_equal(cube.status(), grid.status)
+    masks = cube.masks()
+    assert all(np.array_equal(masks[key], grid.masks[key]) for key in grid.masks), 'Wrong masks'
+
+
+def test_query(explorer):
+    interp = explorer.interpolant(gkey, 'g', 'mode', which=4, method='linear')
+    x, y = np.array([450., 500., 600., 800.]), np.array([10., 12., 10., 10.])
+    vals = explorer.query('g', 'mode', x, y, which=4, method='linear')
+    assert vals[:2] == pytest.approx(interp(x[:2], y[:2]))
+    assert vals[:2] == pytest.approx(x[:2] / 1000)
+    assert np.isnan(vals[2:]).all(), 'Values outside of garnet field should be NaN'
+    assert explorer.query('g', 'mode', x.reshape(2, 2), y.reshape(2, 2), which=4, method='linear').shape == (2, 2)
+
+
+def test_save_tab(explorer, tmp_path):
+    comps = [('g', 'mode'), ('g', 'xMgX/(xFeX+xMgX)')]
+    explorer.save_tab(comps, tabfile=tmp_path / 'test.tab', which=4, method='linear', rows=4)
+    data = np.loadtxt(str(tmp_path / 'test.tab'), skiprows=13)
+    for j, (phase, expr) in enumerate(comps):
+        gd = explorer.get_gridded(phase, expr, which=4, method='linear')
+        assert np.allclose(data[:, j], gd.flatten(), atol=1e-6, equal_nan=True), 'Wrong values of {}'.format(expr)
+    explorer.save_tab(comps, tabfile=tmp_path / 'test.tab', binary=True, which=4, method='linear', rows=4)
+    cube = DataCube(tmp_path / 'test')
+    assert np.allclose(cube.get(*comps[0]).flatten(), data[:, 0], atol=1e-6, equal_nan=True)
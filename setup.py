@@ -42,6 +42,7 @@ setup(
     psshow=pypsbuilder.psexplorer:ps_show
     psiso=pypsbuilder.psexplorer:ps_iso
     psgrid=pypsbuilder.psexplorer:ps_grid
+    psquery=pypsbuilder.psexplorer:ps_query
     psdrawpd=pypsbuilder.psexplorer:ps_drawpd
     """,
     install_requires=requirements,